@@ -2,25 +2,41 @@
 """
 
 import argparse
+import csv
 import datetime
+import functools
 import json
+import math
 import multiprocessing
-import operator
 import os
+import queue
+import re
 import sys
-from multiprocessing import Pool, freeze_support
+from multiprocessing import freeze_support
 
 import numpy as np
 
 import audio
+import columnar
 import config as cfg
 import model
+import manifest
+import metadata
+import pipeline
+import scores
 import species
 import utils
+import workers
 
 #                    0       1      2           3             4              5               6                7           8             9           10         11
 RTABLE_HEADER = "Selection\tView\tChannel\tBegin Time (s)\tEnd Time (s)\tLow Freq (Hz)\tHigh Freq (Hz)\tCommon Name\tSpecies Code\tConfidence\tBegin Path\tFile Offset (s)\n"
 
+# A single detection: the window (start, end) in seconds, the index into cfg.LABELS and the score
+DETECTION_DTYPE = np.dtype([("start", "f8"), ("end", "f8"), ("label", "i4"), ("score", "f4")])
+
+# Model output stored for windows that the energy gate kept from the model, scores as no call
+GATED_LOGIT = -20.0
+
 
 def loadCodes():
     """Loads the eBird codes.
@@ -34,30 +50,47 @@ def loadCodes():
     return codes
 
 
-def saveResultFile(r: dict[str, list], path: str, afile_path: str):
+def saveResultFile(r: np.ndarray, path: str, afile_path: str, sample_rate=None, duration=None, location=None):
     """Saves the results to the hard drive.
 
     Args:
-        r: The dictionary with {segment: scores}.
+        r: The detections as array of DETECTION_DTYPE.
         path: The path where the result should be saved.
         afile_path: The path to audio file.
+        sample_rate: Native sample rate of the audio file, read from the file if None.
+        duration: Duration of the audio file in seconds, stored by the columnar result type.
+        location: The (lat, lon, week) of the recording, see getFileLocation if None.
     """
     # Make folder if it doesn't exist
     if os.path.dirname(path):
         os.makedirs(os.path.dirname(path), exist_ok=True)
 
+    if location is None:
+        location = getFileLocation(afile_path)
+
+    # Sort by time, then by descending score
+    r = r[np.lexsort((-r["score"], r["start"]))]
+
+    # Typed columns, no text formatting
+    if cfg.RESULT_TYPE == "columnar":
+        columnar.saveResultFile(r, path, afile_path, sample_rate, duration, location)
+
+        return
+
+    detections = zip(r["start"].tolist(), r["end"].tolist(), r["label"].tolist(), r["score"].tolist())
+
     # Selection table
-    out_string = ""
+    out_string = []
 
     if cfg.RESULT_TYPE == "table":
         selection_id = 0
         filename = os.path.basename(afile_path)
 
         # Write header
-        out_string += RTABLE_HEADER
+        out_string.append(RTABLE_HEADER)
 
         # Read native sample rate
-        high_freq = audio.get_sample_rate(afile_path) / 2
+        high_freq = (sample_rate or audio.get_sample_rate(afile_path)) / 2
 
         if high_freq > cfg.SIG_FMAX:
             high_freq = cfg.SIG_FMAX
@@ -65,210 +98,212 @@ def saveResultFile(r: dict[str, list], path: str, afile_path: str):
         high_freq = min(high_freq, cfg.BANDPASS_FMAX)
         low_freq = max(cfg.SIG_FMIN, cfg.BANDPASS_FMIN)
 
-        # Extract valid predictions for every timestamp
-        for timestamp in getSortedTimestamps(r):
-            rstring = ""
-            start, end = timestamp.split("-", 1)
-
-            for c in r[timestamp]:
-                if c[1] > cfg.MIN_CONFIDENCE and (not cfg.SPECIES_LIST or c[0] in cfg.SPECIES_LIST):
-                    selection_id += 1
-                    label = cfg.TRANSLATED_LABELS[cfg.LABELS.index(c[0])]
-                    code = cfg.CODES[c[0]] if c[0] in cfg.CODES else c[0]
-                    rstring += f"{selection_id}\tSpectrogram 1\t1\t{start}\t{end}\t{low_freq}\t{high_freq}\t{label.split('_', 1)[-1]}\t{code}\t{c[1]:.4f}\t{afile_path}\t{start}\n"
-
-            # Write result string to file
-            out_string += rstring
+        # Write every detection
+        for start, end, c, score in detections:
+            selection_id += 1
+            label = cfg.TRANSLATED_LABELS[c]
+            code = cfg.CODES.get(cfg.LABELS[c], cfg.LABELS[c])
+            out_string.append(f"{selection_id}\tSpectrogram 1\t1\t{start}\t{end}\t{low_freq}\t{high_freq}\t{label.split('_', 1)[-1]}\t{code}\t{score:.4f}\t{afile_path}\t{start}\n")
 
         # If we don't have any valid predictions, we still need to add a line to the selection table in case we want to combine results
         # TODO: That's a weird way to do it, but it works for now. It would be better to keep track of file durations during the analysis.
-        if len(out_string) == len(RTABLE_HEADER) and cfg.OUTPUT_PATH is not None:
+        if selection_id == 0 and cfg.OUTPUT_PATH is not None:
             selection_id += 1
-            out_string += f"{selection_id}\tSpectrogram 1\t1\t0\t3\t{low_freq}\t{high_freq}\tnocall\tnocall\t1.0\t{afile_path}\t0\n"
+            out_string.append(f"{selection_id}\tSpectrogram 1\t1\t0\t3\t{low_freq}\t{high_freq}\tnocall\tnocall\t1.0\t{afile_path}\t0\n")
 
     elif cfg.RESULT_TYPE == "audacity":
         # Audacity timeline labels
-        for timestamp in getSortedTimestamps(r):
-            rstring = ""
-
-            for c in r[timestamp]:
-                if c[1] > cfg.MIN_CONFIDENCE and (not cfg.SPECIES_LIST or c[0] in cfg.SPECIES_LIST):
-                    label = cfg.TRANSLATED_LABELS[cfg.LABELS.index(c[0])]
-                    ts = timestamp.replace("-", "\t")
-                    lbl = label.replace("_", ", ")
-                    rstring += f"{ts}\t{lbl}\t{c[1]:.4f}\n"
-
-            # Write result string to file
-            out_string += rstring
+        for start, end, c, score in detections:
+            label = cfg.TRANSLATED_LABELS[c]
+            lbl = label.replace("_", ", ")
+            out_string.append(f"{start}\t{end}\t{lbl}\t{score:.4f}\n")
 
     elif cfg.RESULT_TYPE == "r":
         # Output format for R
         header = "filepath,start,end,scientific_name,common_name,confidence,lat,lon,week,overlap,sensitivity,min_conf,species_list,model"
-        out_string += header
-
-        for timestamp in getSortedTimestamps(r):
-            rstring = ""
-            start, end = timestamp.split("-", 1)
-
-            for c in r[timestamp]:
-                if c[1] > cfg.MIN_CONFIDENCE and (not cfg.SPECIES_LIST or c[0] in cfg.SPECIES_LIST):
-                    label = cfg.TRANSLATED_LABELS[cfg.LABELS.index(c[0])]
-                    rstring += "\n{},{},{},{},{},{:.4f},{:.4f},{:.4f},{},{},{},{},{},{}".format(
-                        afile_path,
-                        start,
-                        end,
-                        label.split("_", 1)[0],
-                        label.split("_", 1)[-1],
-                        c[1],
-                        cfg.LATITUDE,
-                        cfg.LONGITUDE,
-                        cfg.WEEK,
-                        cfg.SIG_OVERLAP,
-                        (1.0 - cfg.SIGMOID_SENSITIVITY) + 1.0,
-                        cfg.MIN_CONFIDENCE,
-                        cfg.SPECIES_LIST_FILE,
-                        os.path.basename(cfg.MODEL_PATH),
-                    )
-
-            # Write result string to file
-            out_string += rstring
+        out_string.append(header)
+        lat, lon, week = location
+
+        for start, end, c, score in detections:
+            label = cfg.TRANSLATED_LABELS[c]
+            out_string.append(
+                "\n{},{},{},{},{},{:.4f},{:.4f},{:.4f},{},{},{},{},{},{}".format(
+                    afile_path,
+                    start,
+                    end,
+                    label.split("_", 1)[0],
+                    label.split("_", 1)[-1],
+                    score,
+                    lat,
+                    lon,
+                    week,
+                    cfg.SIG_OVERLAP,
+                    (1.0 - cfg.SIGMOID_SENSITIVITY) + 1.0,
+                    cfg.MIN_CONFIDENCE,
+                    cfg.SPECIES_LIST_FILE,
+                    os.path.basename(cfg.MODEL_PATH),
+                )
+            )
 
     elif cfg.RESULT_TYPE == "kaleidoscope":
         # Output format for kaleidoscope
         header = "INDIR,FOLDER,IN FILE,OFFSET,DURATION,scientific_name,common_name,confidence,lat,lon,week,overlap,sensitivity"
-        out_string += header
+        out_string.append(header)
 
         folder_path, filename = os.path.split(afile_path)
         parent_folder, folder_name = os.path.split(folder_path)
-
-        for timestamp in getSortedTimestamps(r):
-            rstring = ""
-            start, end = timestamp.split("-", 1)
-
-            for c in r[timestamp]:
-                if c[1] > cfg.MIN_CONFIDENCE and (not cfg.SPECIES_LIST or c[0] in cfg.SPECIES_LIST):
-                    label = cfg.TRANSLATED_LABELS[cfg.LABELS.index(c[0])]
-                    rstring += "\n{},{},{},{},{},{},{},{:.4f},{:.4f},{:.4f},{},{},{}".format(
-                        parent_folder.rstrip("/"),
-                        folder_name,
-                        filename,
-                        start,
-                        float(end) - float(start),
-                        label.split("_", 1)[0],
-                        label.split("_", 1)[-1],
-                        c[1],
-                        cfg.LATITUDE,
-                        cfg.LONGITUDE,
-                        cfg.WEEK,
-                        cfg.SIG_OVERLAP,
-                        (1.0 - cfg.SIGMOID_SENSITIVITY) + 1.0,
-                    )
-
-            # Write result string to file
-            out_string += rstring
+        lat, lon, week = location
+
+        for start, end, c, score in detections:
+            label = cfg.TRANSLATED_LABELS[c]
+            out_string.append(
+                "\n{},{},{},{},{},{},{},{:.4f},{:.4f},{:.4f},{},{},{}".format(
+                    parent_folder.rstrip("/"),
+                    folder_name,
+                    filename,
+                    start,
+                    end - start,
+                    label.split("_", 1)[0],
+                    label.split("_", 1)[-1],
+                    score,
+                    lat,
+                    lon,
+                    week,
+                    cfg.SIG_OVERLAP,
+                    (1.0 - cfg.SIGMOID_SENSITIVITY) + 1.0,
+                )
+            )
 
     else:
         # CSV output file
         header = "Start (s),End (s),Scientific name,Common name,Confidence\n"
 
         # Write header
-        out_string += header
+        out_string.append(header)
 
-        for timestamp in getSortedTimestamps(r):
-            rstring = ""
+        for start, end, c, score in detections:
+            label = cfg.TRANSLATED_LABELS[c]
+            out_string.append(
+                "{},{},{},{},{:.4f}\n".format(start, end, label.split("_", 1)[0], label.split("_", 1)[-1], score)
+            )
 
-            for c in r[timestamp]:
-                start, end = timestamp.split("-", 1)
+    # Save as file
+    with open(path, "w", encoding="utf-8") as rfile:
+        rfile.write("".join(out_string))
 
-                if c[1] > cfg.MIN_CONFIDENCE and (not cfg.SPECIES_LIST or c[0] in cfg.SPECIES_LIST):
-                    label = cfg.TRANSLATED_LABELS[cfg.LABELS.index(c[0])]
-                    rstring += "{},{},{},{},{:.4f}\n".format(
-                        start, end, label.split("_", 1)[0], label.split("_", 1)[-1], c[1]
-                    )
 
-            # Write result string to file
-            out_string += rstring
+def combineResults(folder: str, output_file: str, entries: list[tuple] | None = None):
+    """Combines the result files of a folder into one file.
 
-    # Save as file
-    with open(path, "w", encoding="utf-8") as rfile:
-        rfile.write(out_string)
+    The files are streamed line by line, so memory does not grow with the number of detections.
+    Formats without a file column (table, audacity, csv) are put on one timeline,
+    each file starting where the previous one ended.
 
+    Args:
+        folder: Folder with the result files.
+        output_file: Name of the combined file.
+        entries: (result file, audio file, duration in seconds) in the order to combine, see manifest.getResultFiles.
+                 Defaults to all result files in the folder. Missing durations are probed from the audio file.
+    """
+    output_path = os.path.join(folder, output_file)
+
+    if cfg.RESULT_TYPE == "columnar":
+        rfiles = [e[0] for e in entries] if entries is not None else utils.collect_all_files(folder, ["bin"], pattern=columnar.RESULT_FILE_SUFFIX[1:])
+        columnar.combineResults([r for r in rfiles if os.path.abspath(r) != os.path.abspath(output_path)], output_path)
 
-def combineResults(folder: str, output_file: str):
+        return
 
     # Read all files
-    files = utils.collect_all_files(folder, ["txt"], pattern="BirdNET.selection.table")
+    if entries is None:
+        suffix = getResultFileSuffix()
+        entries = [(r, None, None) for r in utils.collect_all_files(folder, [suffix.rsplit(".", 1)[-1]], pattern=suffix[1:])]
 
     # Combine all files
     s_id = 1
     time_offset = 0
-    audiofiles = set()
-
-    with open(os.path.join(folder, output_file), "w", encoding="utf-8") as f:
-        f.write(RTABLE_HEADER)
-
-        for rfile in files:
-            with open(rfile, "r", encoding="utf-8") as rf:
+    header = None
+    audiofiles = []
 
-                try:
-                    lines = rf.readlines()
+    with open(output_path, "w", encoding="utf-8") as f:
+        if cfg.RESULT_TYPE == "table":
+            header = RTABLE_HEADER
+            f.write(RTABLE_HEADER)
 
-                    # make sure it's a selection table
-                    if not "Selection" in lines[0] or not "File Offset" in lines[0]:
-                        continue
+        for rfile, f_name, f_duration in entries:
+            if os.path.abspath(rfile) == os.path.abspath(output_path):
+                continue
 
-                    # skip header and add to file
-                    f_name = lines[1].split("\t")[10]
-                    f_duration = audio.getAudioFileLength(f_name, cfg.SAMPLE_RATE)
+            try:
+                with open(rfile, "r", encoding="utf-8") as rf:
+                    # Every format but audacity starts with a header
+                    if cfg.RESULT_TYPE != "audacity":
+                        first = rf.readline()
 
-                    audiofiles.add(f_name)
+                        # make sure it's a result file of this type
+                        if cfg.RESULT_TYPE == "table" and (not "Selection" in first or not "File Offset" in first):
+                            continue
 
-                    for line in lines[1:]:
+                        if header is None:
+                            header = first.rstrip("\n")
+                            f.write(header + ("\n" if cfg.RESULT_TYPE in ["table", "csv"] else ""))
 
+                    for line in rf:
                         # empty line?
                         if not line.strip():
                             continue
 
-                        # Is species code and common name == 'nocall'?
-                        # If so, that's a dummy line and we can skip it
-                        if line.split("\t")[7] == "nocall" and line.split("\t")[8] == "nocall":
-                            continue
+                        line = line.rstrip("\n")
 
-                        # adjust selection id
-                        line = line.split("\t")
-                        line[0] = str(s_id)
-                        s_id += 1
+                        if cfg.RESULT_TYPE == "table":
+                            line = line.split("\t")
 
-                        # adjust time
-                        line[3] = str(float(line[3]) + time_offset)
-                        line[4] = str(float(line[4]) + time_offset)
+                            # The audio file is part of every row
+                            if f_name is None:
+                                f_name = line[10]
 
-                        # write line
-                        f.write("\t".join(line))
+                            # Is species code and common name == 'nocall'?
+                            # If so, that's a dummy line and we can skip it
+                            if line[7] == "nocall" and line[8] == "nocall":
+                                continue
 
-                    # adjust time offset
-                    time_offset += f_duration
+                            # adjust selection id and time
+                            line[0] = str(s_id)
+                            s_id += 1
+                            line[3] = str(float(line[3]) + time_offset)
+                            line[4] = str(float(line[4]) + time_offset)
+                            f.write("\t".join(line) + "\n")
 
-                except Exception as ex:
-                    print(f"Error: Cannot combine results from {rfile}.\n", flush=True)
-                    utils.writeErrorLog(ex)
+                        elif cfg.RESULT_TYPE in ["audacity", "csv"]:
+                            # Start and end are the first columns
+                            sep = "\t" if cfg.RESULT_TYPE == "audacity" else ","
+                            start, end, rest = line.split(sep, 2)
+                            f.write(f"{float(start) + time_offset}{sep}{float(end) + time_offset}{sep}{rest}\n")
 
-    listfilesname = output_file.rsplit(".", 1)[0] + ".list.txt"
+                        else:
+                            # Rows name their audio file, no offset needed
+                            f.write("\n" + line)
 
-    with open(os.path.join(folder, listfilesname), "w", encoding="utf-8") as f:
-        f.writelines((f + "\n" for f in audiofiles))
+                # adjust time offset
+                if cfg.RESULT_TYPE in ["table", "audacity", "csv"]:
+                    if f_duration is None:
+                        if f_name is None:
+                            raise ValueError(f"Duration of the audio file of {rfile} is unknown.")
 
+                        f_duration = audio.getAudioFileLength(f_name, cfg.SAMPLE_RATE)
 
-def getSortedTimestamps(results: dict[str, list]):
-    """Sorts the results based on the segments.
+                    time_offset += f_duration
 
-    Args:
-        results: The dictionary with {segment: scores}.
+                if f_name is not None:
+                    audiofiles.append(f_name)
 
-    Returns:
-        Returns the sorted list of segments and their scores.
-    """
-    return sorted(results, key=lambda t: float(t.split("-", 1)[0]))
+            except Exception as ex:
+                print(f"Error: Cannot combine results from {rfile}.\n", flush=True)
+                utils.writeErrorLog(ex)
+
+    listfilesname = output_file.rsplit(".", 1)[0] + ".list.txt"
+
+    with open(os.path.join(folder, listfilesname), "w", encoding="utf-8") as f:
+        f.writelines((f + "\n" for f in audiofiles))
 
 
 def getRawAudioFromFile(fpath: str, offset, duration):
@@ -291,6 +326,23 @@ def getRawAudioFromFile(fpath: str, offset, duration):
     return chunks
 
 
+def getRawAudioChunks(fpath: str):
+    """Reads an audio file as a stream of chunks.
+
+    The file is decoded only once, in blocks of cfg.FILE_SPLITTING_DURATION seconds,
+    and the chunks follow one continuous grid across the block boundaries.
+
+    Args:
+        fpath: Path to the audio file.
+
+    Returns:
+        A generator of raw audio chunks.
+    """
+    blocks = audio.streamAudioFile(fpath, cfg.SAMPLE_RATE, cfg.FILE_SPLITTING_DURATION, cfg.BANDPASS_FMIN, cfg.BANDPASS_FMAX)
+
+    return audio.splitSignalStream(blocks, cfg.SAMPLE_RATE, cfg.SIG_LENGTH, cfg.SIG_OVERLAP, cfg.SIG_MINLEN)
+
+
 def predict(samples):
     """Predicts the classes for the given samples.
 
@@ -300,10 +352,22 @@ def predict(samples):
     Returns:
         The prediction scores.
     """
-    # Prepare sample and pass through model
-    data = np.array(samples, dtype="float32")
+    # Prepare sample and pass through model, batches that are already float32 arrays are not copied
+    data = np.asarray(samples, dtype="float32")
     prediction = model.predict(data)
 
+    return toScores(prediction)
+
+
+def toScores(prediction):
+    """Converts the model outputs into the reported scores.
+
+    Args:
+        prediction: The model outputs.
+
+    Returns:
+        The scores.
+    """
     # Logits or sigmoid activations?
     if cfg.APPLY_SIGMOID:
         prediction = model.flat_sigmoid(np.array(prediction), sensitivity=-cfg.SIGMOID_SENSITIVITY)
@@ -311,9 +375,152 @@ def predict(samples):
     return prediction
 
 
+def loadFileMetadata(path: str, input_path: str):
+    """Reads the location and week of single files from a CSV file.
+
+    The CSV file has a header with the columns file, lat, lon and week.
+    The files are absolute or relative to the input folder, empty or
+    missing lat, lon and week fall back to the settings of the run.
+
+    Args:
+        path: Path to the CSV file.
+        input_path: The input folder.
+
+    Returns:
+        A dict {normalized path: {"lat": ..., "lon": ..., "week": ...}}, see cfg.FILE_METADATA.
+    """
+    metadata = {}
+    folder = input_path if os.path.isdir(input_path) else os.path.dirname(input_path)
+
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            entry = {}
+
+            for k, t in [("lat", float), ("lon", float), ("week", int)]:
+                if row.get(k, "").strip():
+                    entry[k] = t(row[k])
+
+            metadata[os.path.normcase(os.path.abspath(os.path.join(folder, row["file"].strip())))] = entry
+
+    return metadata
+
+
+def getWeekFromFilename(fpath: str):
+    """Finds a recording date like 20230415 or 2023-04-15 in a file name.
+
+    Args:
+        fpath: Path to the audio file.
+
+    Returns:
+        The week of the year in [1, 48] (4 weeks per month) or None if there is no date.
+    """
+    for m in re.finditer(r"(?<!\d)(\d{4})-?(\d{2})-?(\d{2})(?!\d)", os.path.basename(fpath)):
+        try:
+            date = datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        except ValueError:
+            continue
+
+        return (date.month - 1) * 4 + min(4, (date.day - 1) // 7 + 1)
+
+    return None
+
+
+def getFileLocation(fpath: str):
+    """Returns the recording location and week of a file.
+
+    Args:
+        fpath: Path to the audio file.
+
+    Returns:
+        (lat, lon, week) from cfg.FILE_METADATA, the file name or the settings of the run.
+    """
+    entry = cfg.FILE_METADATA.get(os.path.normcase(os.path.abspath(fpath)), {}) if cfg.FILE_METADATA else {}
+    week = entry.get("week")
+
+    if week is None and cfg.WEEK_FROM_FILENAME:
+        week = getWeekFromFilename(fpath)
+
+    return entry.get("lat", cfg.LATITUDE), entry.get("lon", cfg.LONGITUDE), cfg.WEEK if week is None else week
+
+
+@functools.lru_cache(maxsize=1024)
+def _locationMask(lat: float, lon: float, week: int, threshold: float, labels_file: str):
+    """Runs the location filter once per location, week and labels.
+
+    Returns:
+        A boolean vector over cfg.LABELS.
+    """
+    return np.isin(np.array(cfg.LABELS), np.array(species.getSpeciesList(lat, lon, week, threshold)))
+
+
+def getSpeciesMask(fpath: str | None = None):
+    """Makes a boolean mask of the species that may be reported.
+
+    Files with their own location or week, see getFileLocation, get the mask of
+    the location filter. The masks are cached, so files of the same site and week share one.
+
+    Args:
+        fpath: Path to the audio file, None for the species list of the run.
+
+    Returns:
+        A boolean vector over cfg.LABELS or None if there is no species list.
+    """
+    if fpath is not None and (cfg.FILE_METADATA or cfg.WEEK_FROM_FILENAME):
+        lat, lon, week = getFileLocation(fpath)
+
+        if (lat, lon, week) != (cfg.LATITUDE, cfg.LONGITUDE, cfg.WEEK) and not (lat == -1 and lon == -1):
+            return _locationMask(lat, lon, week, cfg.LOCATION_FILTER_THRESHOLD, cfg.LABELS_FILE)
+
+    if not cfg.SPECIES_LIST:
+        return None
+
+    return np.isin(np.array(cfg.LABELS), np.array(cfg.SPECIES_LIST))
+
+
+def extractDetections(scores: np.ndarray, timestamps: np.ndarray, species_mask=None, min_conf=None):
+    """Keeps only the scores that should be reported.
+
+    Selects all scores above cfg.MIN_CONFIDENCE that belong to a species on the species list.
+
+    Args:
+        scores: The scores with shape (windows, classes).
+        timestamps: The (start, end) of each window with shape (windows, 2).
+        species_mask: Boolean vector over the classes, see getSpeciesMask.
+        min_conf: The threshold, defaults to cfg.MIN_CONFIDENCE.
+
+    Returns:
+        The detections as array of DETECTION_DTYPE.
+    """
+    keep = scores > (cfg.MIN_CONFIDENCE if min_conf is None else min_conf)
+
+    if species_mask is not None:
+        keep &= species_mask
+
+    rows, cols = np.nonzero(keep)
+    detections = np.empty(len(rows), dtype=DETECTION_DTYPE)
+    detections["start"] = timestamps[rows, 0]
+    detections["end"] = timestamps[rows, 1]
+    detections["label"] = cols
+    detections["score"] = scores[rows, cols]
+
+    return detections
+
+
+def getResultFileSuffix():
+    """Returns the file name suffix of the result type."""
+    if cfg.RESULT_TYPE == "table":
+        return ".BirdNET.selection.table.txt"
+    elif cfg.RESULT_TYPE == "audacity":
+        return ".BirdNET.results.txt"
+    elif cfg.RESULT_TYPE == "columnar":
+        return columnar.RESULT_FILE_SUFFIX
+    else:
+        return ".BirdNET.results.csv"
+
+
 def get_result_file_name(fpath: str):
     # We have to check if output path is a file or directory
-    if not cfg.OUTPUT_PATH.rsplit(".", 1)[-1].lower() in ["txt", "csv"]:
+    if not cfg.OUTPUT_PATH.rsplit(".", 1)[-1].lower() in ["txt", "csv", "bin"]:
         rpath = fpath.replace(cfg.INPUT_PATH, "")
         rpath = rpath[1:] if rpath[0] in ["/", "\\"] else rpath
 
@@ -322,16 +529,767 @@ def get_result_file_name(fpath: str):
 
         os.makedirs(rdir, exist_ok=True)
 
-        if cfg.RESULT_TYPE == "table":
-            rtype = ".BirdNET.selection.table.txt"
-        elif cfg.RESULT_TYPE == "audacity":
-            rtype = ".BirdNET.results.txt"
+        return os.path.join(cfg.OUTPUT_PATH, rpath.rsplit(".", 1)[0] + getResultFileSuffix())
+
+    return cfg.OUTPUT_PATH
+
+
+def getScoreFileName(fpath: str):
+    """Returns the path of the score file of an audio file.
+
+    The score file is placed next to the result file.
+
+    Args:
+        fpath: Path to the audio file.
+
+    Returns:
+        The path to the score file.
+    """
+    result_file = get_result_file_name(fpath)
+
+    if result_file.endswith(getResultFileSuffix()):
+        return result_file[: -len(getResultFileSuffix())] + scores.SCORE_FILE_SUFFIX
+
+    return os.path.join(os.path.dirname(result_file), os.path.basename(fpath).rsplit(".", 1)[0] + scores.SCORE_FILE_SUFFIX)
+
+
+def _stepSamples():
+    """Returns the number of samples between the starts of two windows, as used by audio.splitSignal."""
+    return int((cfg.SIG_LENGTH - cfg.SIG_OVERLAP) * cfg.SAMPLE_RATE)
+
+
+def _startJob(source):
+    """Prepares the analysis of a single file or shard.
+
+    Args:
+        source: Path to the audio file or a shard (path, first window, number of windows), see planShards.
+
+    Returns:
+        The job state of the file.
+    """
+    if isinstance(source, tuple):
+        # Shards are checked and saved by the caller, see collectShard
+        fpath, first_window, max_windows = source
+        result_file_name = None
+
+        # Status
+        print(f"Analyzing {fpath} from {first_window * (cfg.SIG_LENGTH - cfg.SIG_OVERLAP):.1f}s", flush=True)
+    else:
+        fpath, first_window, max_windows = source, 0, None
+        result_file_name = get_result_file_name(fpath)
+
+        # Status
+        print(f"Analyzing {fpath}", flush=True)
+
+    return {
+        "path": fpath,
+        "result_file": result_file_name,
+        "score_file": getScoreFileName(fpath) if cfg.SAVE_SCORES else None,
+        "score_handle": None,
+        "first_window": first_window,
+        "max_windows": max_windows,
+        "num_windows": 0,
+        "gated_windows": 0,
+        "gate_dropped": 0,
+        "duration": None,
+        "start_time": datetime.datetime.now(),
+        "detections": [],
+        "open_windows": 0,
+        "decoded": False,
+        "failed": False,
+        "saved": False,
+        "finished": False,
+    }
+
+
+def _decodeStage(sources: list, jobs: list, file_queue, block_queue):
+    """Decodes the files and pushes their signal blocks.
+
+    Every file is decoded by one thread, so its blocks arrive in order.
+    The end of a file is marked with a None block, or with the exception if it failed.
+
+    Args:
+        sources: List of audio file paths or shards, see _startJob.
+        jobs: The job states, filled by this stage, see _startJob.
+        file_queue: Queue with the indices of the files to decode.
+        block_queue: Queue for (file index, block).
+    """
+    try:
+        while True:
+            try:
+                job_index = file_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            job = jobs[job_index] = _startJob(sources[job_index])
+            fpath = job["path"]
+            step = _stepSamples()
+
+            # Shards only decode the samples of their windows, counted in samples so they stay on the grid of the file
+            offset = job["first_window"] * step / cfg.SAMPLE_RATE
+            duration = (
+                None
+                if job["max_windows"] is None
+                else ((job["max_windows"] - 1) * step + int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE)) / cfg.SAMPLE_RATE
+            )
+
+            try:
+                for block in audio.streamAudioFile(
+                    fpath, cfg.SAMPLE_RATE, cfg.FILE_SPLITTING_DURATION, cfg.BANDPASS_FMIN, cfg.BANDPASS_FMAX, offset, duration
+                ):
+                    block_queue.put((job_index, block))
+
+                block_queue.put((job_index, None))
+
+            except Exception as ex:
+                # Write error log
+                print(f"Error: Cannot analyze audio file {fpath}.\n", flush=True)
+                utils.writeErrorLog(ex)
+                block_queue.put((job_index, ex))
+    finally:
+        block_queue.put(pipeline.END)
+
+
+def _newBatch(pool):
+    """Starts a batch in a buffer of the pool.
+
+    Args:
+        pool: The pool of sample buffers, see pipeline.BufferPool.
+
+    Returns:
+        {"samples": (cfg.BATCH_SIZE, samples per window) buffer, "windows": [...], "jobs": [...], "size": 0},
+        "windows" holds the window indices within the file and "jobs" the file indices.
+    """
+    return {
+        "samples": pool.get(),
+        "windows": np.zeros(cfg.BATCH_SIZE, dtype="int64"),
+        "jobs": np.zeros(cfg.BATCH_SIZE, dtype="int64"),
+        "size": 0,
+    }
+
+
+def _batchStage(jobs: list, num_decoders: int, block_queue, batch_queue, num_consumers: int, pool):
+    """Splits the signal blocks into windows and collects them into batches.
+
+    Windows of all files share the batches. When a file is done, its number of
+    windows is passed on, so the writer knows when all of its windows are predicted.
+    The windows of a shard continue the window grid of its file.
+    The windows are strided views of the blocks and are copied once, into the batch buffer.
+
+    Args:
+        jobs: The job states, see _startJob.
+        num_decoders: Number of decode threads, each of them ends its stream with pipeline.END.
+        block_queue: Queue with (file index, block), see _decodeStage.
+        batch_queue: Queue for the batches and the ("done", file index, windows, failed, samples) markers.
+        num_consumers: Number of inference threads, each of them gets a pipeline.END.
+        pool: The pool of sample buffers, see pipeline.BufferPool.
+    """
+    batch = _newBatch(pool)
+    splitter = {}
+
+    try:
+        while num_decoders > 0:
+            item = block_queue.get()
+
+            if item is pipeline.END:
+                num_decoders -= 1
+                continue
+
+            job_index, block = item
+            first_window, max_windows = jobs[job_index]["first_window"], jobs[job_index]["max_windows"]
+            buffer, num_windows, num_samples = splitter.pop(job_index, (np.zeros(0, dtype="float32"), 0, 0))
+
+            if isinstance(block, Exception):
+                batch_queue.put(("done", job_index, num_windows, True, num_samples))
+                continue
+
+            if block is None:
+                groups = [
+                    audio.splitSignalTail(
+                        buffer, cfg.SAMPLE_RATE, cfg.SIG_LENGTH, cfg.SIG_OVERLAP, cfg.SIG_MINLEN, first_window + num_windows > 0
+                    )
+                ]
+            else:
+                groups, buffer = audio.splitSignalBlock(buffer, block, cfg.SAMPLE_RATE, cfg.SIG_LENGTH, cfg.SIG_OVERLAP)
+                num_samples += len(block)
+
+            for splits in groups:
+                # The next shard starts with the following window
+                if max_windows is not None:
+                    splits = splits[: max(0, max_windows - num_windows)]
+
+                while len(splits) > 0:
+                    # Copy as many windows as fit into the batch
+                    n = min(len(splits), cfg.BATCH_SIZE - batch["size"])
+                    rows = slice(batch["size"], batch["size"] + n)
+                    batch["samples"][rows] = splits[:n]
+                    batch["windows"][rows] = np.arange(first_window + num_windows, first_window + num_windows + n)
+                    batch["jobs"][rows] = job_index
+                    batch["size"] += n
+                    num_windows += n
+                    splits = splits[n:]
+
+                    # Pass on if batch is full
+                    if batch["size"] >= cfg.BATCH_SIZE:
+                        batch_queue.put(batch)
+                        batch = _newBatch(pool)
+
+            if block is None:
+                batch_queue.put(("done", job_index, num_windows, False, num_samples))
+            else:
+                splitter[job_index] = (buffer, num_windows, num_samples)
+
+        # Pass on the last, incomplete batch
+        if batch["size"] > 0:
+            batch_queue.put(batch)
         else:
-            rtype = ".BirdNET.results.csv"
+            pool.release(batch["samples"])
 
-        return os.path.join(cfg.OUTPUT_PATH, rpath.rsplit(".", 1)[0] + rtype)
+    finally:
+        for _ in range(num_consumers):
+            batch_queue.put(pipeline.END)
+
+
+def _gateWindows(samples: np.ndarray):
+    """Selects the windows that are loud enough for the model.
+
+    Args:
+        samples: The windows with shape (windows, samples).
+
+    Returns:
+        A boolean mask of the windows at or above cfg.ENERGY_GATE_DB, or None if the gate is off.
+    """
+    if cfg.ENERGY_GATE_DB is None:
+        return None
+
+    return audio.windowLevels(samples) >= cfg.ENERGY_GATE_DB
+
+
+def _predictBatch(batch: dict, species_masks: list):
+    """Predicts a batch that can contain windows of several files.
+
+    Windows below the energy gate are not predicted and get GATED_LOGIT,
+    unless cfg.ENERGY_GATE_VALIDATE is set. Their detections are dropped either way.
+    The loud windows are moved to the front of the batch buffer and the model still
+    gets the shape of the batch, so the gate doesn't allocate an interpreter per batch.
+    A batch without loud windows is not predicted at all.
+
+    Args:
+        batch: The batch, see _newBatch.
+        species_masks: Boolean vector over the classes per file, see getSpeciesMask.
+
+    Returns:
+        ("scores", file indices, windows per file, detections per file, (first window, model outputs) per file,
+        gated windows per file, dropped detections per file).
+    """
+    size = batch["size"]
+    step = cfg.SIG_LENGTH - cfg.SIG_OVERLAP
+    samples = batch["samples"][:size]
+    window_index = batch["windows"][:size]
+    job_index = batch["jobs"][:size]
+    timestamps = np.stack((window_index * step, window_index * step + cfg.SIG_LENGTH), axis=1)
+    keep = _gateWindows(samples)
+
+    if keep is None or cfg.ENERGY_GATE_VALIDATE or keep.all():
+        logits = np.asarray(model.predict(samples))
+    else:
+        # Only the loud windows are passed to the model
+        logits = np.full((size, len(cfg.LABELS)), GATED_LOGIT, dtype="float32")
+
+        if keep.any():
+            n = int(keep.sum())
+            samples[:n] = samples[keep]
+            logits[keep] = np.asarray(model.predict(samples))[:n]
+
+    p = toScores(logits)
+    files = np.unique(job_index)
+    windows = []
+    detections = []
+    outputs = []
+    gated = []
+    dropped = []
+
+    for i in files:
+        rows = job_index == i
+        windows.append(int(rows.sum()))
+        outputs.append((int(window_index[int(np.argmax(rows))]), logits[rows]))
+
+        if keep is None:
+            detections.append(extractDetections(p[rows], timestamps[rows], species_masks[i]))
+            gated.append(0)
+            dropped.append(0)
+        else:
+            detections.append(extractDetections(p[rows & keep], timestamps[rows & keep], species_masks[i]))
+            gated.append(int((rows & ~keep).sum()))
+            dropped.append(len(extractDetections(p[rows & ~keep], timestamps[rows & ~keep], species_masks[i])))
+
+    return ("scores", files, windows, detections, outputs, gated, dropped)
+
+
+def _inferenceStage(batch_queue, result_queue, species_masks, pool, slots):
+    """Predicts the batches.
+
+    Each thread takes an interpreter slot, see model.useInterpreterSlot. The interpreters
+    of the slots are kept, so later runs and the tasks of a worker process reuse them.
+    Markers are passed through unchanged.
+
+    Args:
+        batch_queue: Queue with the batches, see _batchStage.
+        result_queue: Queue for the results, see _predictBatch.
+        species_masks: Boolean vector over the classes per file, see getSpeciesMask.
+        pool: The pool of sample buffers, the buffer of a batch is released once it is predicted.
+        slots: Queue with the free slot numbers.
+    """
+    model.useInterpreterSlot(slots.get())
+
+    while True:
+        batch = batch_queue.get()
+
+        if batch is pipeline.END or isinstance(batch, tuple):
+            result_queue.put(batch)
+
+            if batch is pipeline.END:
+                break
+
+            continue
+
+        try:
+            result_queue.put(_predictBatch(batch, species_masks))
+
+        except Exception as ex:
+            utils.writeErrorLog(ex)
+            files, counts = np.unique(batch["jobs"][: batch["size"]], return_counts=True)
+            result_queue.put(("failed", files, counts.tolist(), None, None, None, None))
+
+        finally:
+            pool.release(batch["samples"])
+
+
+def _writeStage(jobs: list, result_queue, num_producers: int, on_finish=None):
+    """Routes the results to their files and saves every file that is complete.
+
+    Args:
+        jobs: The job states, see _startJob.
+        result_queue: Queue with the results, see _inferenceStage.
+        num_producers: Number of inference threads, each of them ends its stream with pipeline.END.
+        on_finish: See _finishJobs.
+    """
+    while num_producers > 0:
+        item = result_queue.get()
+
+        if item is pipeline.END:
+            num_producers -= 1
+            continue
+
+        kind = item[0]
+
+        if kind == "done":
+            _, i, num_windows, failed, num_samples = item
+            jobs[i]["open_windows"] += num_windows
+            jobs[i]["num_windows"] = num_windows
+            jobs[i]["duration"] = num_samples / cfg.SAMPLE_RATE
+            jobs[i]["decoded"] = True
+            jobs[i]["failed"] |= failed
+        else:
+            _, files, windows, detections, outputs, gated, dropped = item
+
+            for n, i in enumerate(files):
+                job = jobs[i]
+                job["open_windows"] -= windows[n]
+
+                if kind == "failed":
+                    if not job["failed"]:
+                        job["failed"] = True
+                        print(f"Error: Cannot analyze audio file {job['path']}.\n", flush=True)
+
+                elif not job["failed"]:
+                    job["detections"].append(detections[n])
+                    job["gated_windows"] += gated[n]
+                    job["gate_dropped"] += dropped[n]
+
+                    if job["score_file"]:
+                        _writeScores(job, *outputs[n])
+
+        _finishJobs(jobs, on_finish)
+
+
+def _writeScores(job: dict, first_window: int, logits: np.ndarray):
+    """Writes the model outputs of consecutive windows to the score file of a job.
+
+    Args:
+        job: The job state, see _startJob.
+        first_window: Index of the first window within the file.
+        logits: The model outputs with shape (windows, classes).
+    """
+    try:
+        if job["score_handle"] is None:
+            job["score_handle"] = scores.openScoreFile(job["score_file"], logits.shape[1])
+
+        scores.writeScores(job["score_handle"], first_window, logits)
+
+    except Exception as ex:
+        # The results are still saved
+        print(f"Error: Cannot save scores for {job['path']}.\n", flush=True)
+        utils.writeErrorLog(ex)
+        job["score_file"] = None
+
+
+def _finishScores(job: dict):
+    """Closes the score file of a job and completes it unless the job is a shard.
+
+    Args:
+        job: The job state, see _startJob.
+    """
+    if job["score_handle"] is not None:
+        job["score_handle"].close()
+        job["score_handle"] = None
+
+    if not job["score_file"] or job["failed"] or job["result_file"] is None:
+        return
+
+    try:
+        scores.finishScoreFile(
+            job["score_file"],
+            job["num_windows"],
+            len(cfg.LABELS),
+            job["path"],
+            audio.get_sample_rate(job["path"]),
+            job["duration"],
+            getFileLocation(job["path"]),
+        )
+
+    except Exception as ex:
+        print(f"Error: Cannot save scores for {job['path']}.\n", flush=True)
+        utils.writeErrorLog(ex)
 
-    return cfg.OUTPUT_PATH
+
+def _finishJobs(jobs: list[dict], on_finish=None):
+    """Saves the results of all files whose windows are all predicted.
+
+    Args:
+        jobs: The job states, see _startJob.
+        on_finish: Function called with the summary of every file that is saved or failed, see _summarizeJob.
+            It runs in the writer thread. Shards are not passed to it.
+    """
+    for job in jobs:
+        if job is None or job["finished"] or not job["decoded"] or job["open_windows"] > 0:
+            continue
+
+        job["finished"] = True
+        _saveJob(job)
+
+        if on_finish is not None and job["result_file"] is not None:
+            on_finish(_summarizeJob(job))
+
+
+def _saveJob(job: dict):
+    """Saves the results of a file whose windows are all predicted.
+
+    Args:
+        job: The job state, see _startJob.
+    """
+    if job["failed"]:
+        _finishScores(job)
+        return
+
+    fpath = job["path"]
+    detections = np.concatenate(job["detections"]) if job["detections"] else np.empty(0, dtype=DETECTION_DTYPE)
+    _finishScores(job)
+
+    # Shards keep their detections for the caller
+    if job["result_file"] is None:
+        job["detections"] = detections
+        job["saved"] = True
+
+        return
+
+    # Save as selection table
+    try:
+        saveResultFile(detections, job["result_file"], fpath, audio.get_sample_rate(fpath), job["duration"])
+
+    except Exception as ex:
+        # Write error log
+        print(f"Error: Cannot save result for {fpath}.\n", flush=True)
+        utils.writeErrorLog(ex)
+        job["failed"] = True
+
+        return
+
+    job["saved"] = True
+    job["detections"] = []
+
+    delta_time = (datetime.datetime.now() - job["start_time"]).total_seconds()
+    print(f"Finished {fpath} in {delta_time:.2f} seconds", flush=True)
+
+
+def _runPipeline(sources: list, on_finish=None):
+    """Analyzes files and shards with a staged pipeline.
+
+    Decode threads feed the signal blocks into a bounded queue, a batching stage splits
+    them into windows and pools the windows of all files into batches of cfg.BATCH_SIZE,
+    inference threads predict the batches and a writer saves each result file as soon as
+    all of its windows are predicted. The stages overlap, so the interpreter does not
+    wait for the decoder and vice versa.
+
+    Args:
+        sources: List of audio file paths or shards, see _startJob.
+        on_finish: See _finishJobs.
+
+    Returns:
+        The job states, see _startJob.
+    """
+    species_mask = getSpeciesMask()
+    jobs = [None] * len(sources)
+
+    # Files can have their own location and week, see getFileLocation
+    if cfg.FILE_METADATA or cfg.WEEK_FROM_FILENAME:
+        species_masks = [getSpeciesMask(source[0] if isinstance(source, tuple) else source) for source in sources]
+    else:
+        species_masks = [species_mask] * len(sources)
+
+    file_queue = queue.Queue()
+    block_queue = pipeline.MeteredQueue("decode", max(1, cfg.DECODE_QUEUE_SIZE))
+    batch_queue = pipeline.MeteredQueue("batch", max(1, cfg.BATCH_QUEUE_SIZE))
+    # Results are small, so the writer never blocks the interpreters
+    result_queue = pipeline.MeteredQueue("result")
+
+    for i in range(len(sources)):
+        file_queue.put(i)
+
+    num_decoders = max(1, min(cfg.DECODE_THREADS, len(sources)))
+    num_interpreters = max(1, cfg.INFERENCE_THREADS)
+
+    # One buffer per queued batch, per interpreter and for the batch that is being filled
+    pool = pipeline.BufferPool(
+        (cfg.BATCH_SIZE, int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE)), "float32", max(1, cfg.BATCH_QUEUE_SIZE) + num_interpreters + 1
+    )
+
+    threads = pipeline.startStage("decode", _decodeStage, num_decoders, sources, jobs, file_queue, block_queue)
+    threads += pipeline.startStage("batch", _batchStage, 1, jobs, num_decoders, block_queue, batch_queue, num_interpreters, pool)
+    # Every inference thread reuses the interpreters of a slot, the first one those of the warm-up
+    slots = queue.Queue()
+
+    for i in range(num_interpreters):
+        slots.put(i)
+
+    threads += pipeline.startStage("inference", _inferenceStage, num_interpreters, batch_queue, result_queue, species_masks, pool, slots)
+    threads += pipeline.startStage("write", _writeStage, 1, jobs, result_queue, num_interpreters, on_finish)
+
+    for t in threads:
+        t.join()
+
+    if cfg.PIPELINE_STATS:
+        print(pipeline.formatStats([block_queue, batch_queue, result_queue]), flush=True)
+
+    return jobs
+
+
+def _refineRanges(detections: np.ndarray, first: int, last, radius: int):
+    """Selects the windows of the second pass around the candidate windows.
+
+    Args:
+        detections: The detections of the first pass with scores above the candidate threshold.
+        first: Index of the first window of the source on the fine grid.
+        last: Index of the window after the source on the fine grid or None for the end of the file.
+        radius: Number of fine windows on each side that share samples with a candidate.
+
+    Returns:
+        A sorted list of disjoint (first window, number of windows) ranges on the fine grid.
+    """
+    step = cfg.SIG_LENGTH - cfg.SIG_OVERLAP
+    ranges = []
+
+    for c in np.unique(np.rint(detections["start"] / step).astype("int64")):
+        lo, hi = max(first, c - radius), c + radius + 1
+
+        if last is not None:
+            hi = min(hi, last)
+
+        # Neighborhoods that touch are merged
+        if ranges and lo <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], hi)
+        elif lo < hi:
+            ranges.append([lo, hi])
+
+    return [(lo, hi - lo) for lo, hi in ranges]
+
+
+def _runRefined(sources: list[tuple]):
+    """Analyzes files or shards in two passes.
+
+    The first pass uses the windows of the fine grid that do not overlap, at every
+    m-th position. Windows where any class scores above cfg.REFINE_CONFIDENCE are the
+    candidates. The second pass predicts all windows of the fine grid that share samples
+    with a candidate. The detections of the first pass outside of these neighborhoods
+    and those of the second pass are merged, all on the timestamps of the fine grid.
+    Nothing is saved, the jobs keep their detections like shards do.
+
+    Args:
+        sources: List of (path, first window, number of windows or None) on the fine grid, see planShards.
+
+    Returns:
+        The merged job states, see _startJob.
+    """
+    overlap, min_conf = cfg.SIG_OVERLAP, cfg.MIN_CONFIDENCE
+    step = cfg.SIG_LENGTH - overlap
+    m = max(1, int(cfg.SIG_LENGTH / step + 1e-9))
+    radius = math.ceil(cfg.SIG_LENGTH / step - 1e-9) - 1
+
+    # Windows that overlap by less than half have no coarser grid
+    if m == 1:
+        return _runPipeline(sources)
+
+    # First windows of the coarse grid
+    coarse = []
+
+    for fpath, first, num in sources:
+        c0 = -(-first // m)
+        coarse.append((fpath, c0, None if num is None else -(-(first + num) // m) - c0))
+
+    # The coarse step is exactly m fine steps in samples, the half sample keeps int() from rounding down
+    fine_samples = _stepSamples()
+
+    try:
+        # First pass, everything above the candidate threshold is kept
+        cfg.SIG_OVERLAP = cfg.SIG_LENGTH - (m * fine_samples + 0.5) / cfg.SAMPLE_RATE
+        cfg.MIN_CONFIDENCE = min(min_conf, cfg.REFINE_CONFIDENCE)
+        jobs = _runPipeline(coarse)
+
+        # Second pass around the candidates
+        cfg.SIG_OVERLAP, cfg.MIN_CONFIDENCE = overlap, min_conf
+        fine = []
+        owners = []
+        refined = {}
+
+        for i, job in enumerate(jobs):
+            if not job["saved"]:
+                continue
+
+            fpath, first, num = sources[i]
+            candidates = job["detections"][job["detections"]["score"] > cfg.REFINE_CONFIDENCE]
+            refined[i] = _refineRanges(candidates, first, None if num is None else first + num, radius)
+            fine += [(fpath, lo, n) for lo, n in refined[i]]
+            owners += [i] * len(refined[i])
+
+        fine_jobs = _runPipeline(fine) if fine else []
+
+    finally:
+        cfg.SIG_OVERLAP, cfg.MIN_CONFIDENCE = overlap, min_conf
+
+    for i, ranges in refined.items():
+        job = jobs[i]
+        detections = job["detections"]
+
+        # The first pass counts on the grid of the source
+        if job["duration"] is not None:
+            job["duration"] += (coarse[i][1] * m - sources[i][1]) * fine_samples / cfg.SAMPLE_RATE
+
+        job["first_window"], job["max_windows"] = sources[i][1], sources[i][2]
+
+        # Keep the first pass outside of the refined neighborhoods, with the timestamps of the fine grid
+        index = np.rint(detections["start"] / step).astype("int64")
+        detections["start"] = index * step
+        detections["end"] = detections["start"] + cfg.SIG_LENGTH
+        keep = detections["score"] > min_conf
+
+        for lo, n in ranges:
+            keep &= (index < lo) | (index >= lo + n)
+
+        job["detections"] = [detections[keep]]
+
+    for owner, fine_job in zip(owners, fine_jobs):
+        job = jobs[owner]
+        job["num_windows"] += fine_job["num_windows"]
+        job["gated_windows"] += fine_job["gated_windows"]
+        job["gate_dropped"] += fine_job["gate_dropped"]
+
+        if fine_job["saved"]:
+            job["detections"].append(fine_job["detections"])
+        else:
+            job["saved"] = False
+            job["failed"] = True
+
+    for job in jobs:
+        if isinstance(job["detections"], list):
+            job["detections"] = np.concatenate(job["detections"]) if job["detections"] else np.empty(0, dtype=DETECTION_DTYPE)
+
+    return jobs
+
+
+def _summarizeJob(job: dict):
+    """Summarizes a finished job for the manifest.
+
+    Args:
+        job: The job state, see _startJob.
+
+    Returns:
+        A dict with path, status, result_file, duration, num_windows, gated_windows, gate_dropped, started and seconds.
+    """
+    return {
+        "path": job["path"],
+        "status": "done" if job["saved"] else "failed",
+        "result_file": job["result_file"],
+        "duration": job["duration"],
+        "num_windows": job["num_windows"],
+        "gated_windows": job["gated_windows"],
+        "gate_dropped": job["gate_dropped"],
+        "started": job["start_time"].isoformat(timespec="seconds"),
+        "seconds": (datetime.datetime.now() - job["start_time"]).total_seconds(),
+    }
+
+
+def analyzeGroup(fpaths: list[str], on_finish=None):
+    """Analyzes several files with shared batches.
+
+    See _runPipeline for the stages.
+
+    Args:
+        fpaths: List of audio file paths.
+        on_finish: Function called with the summary of each file as soon as it is saved or failed, see _finishJobs.
+
+    Returns:
+        A summary for every file, see _summarizeJob.
+    """
+    if cfg.REFINE_CONFIDENCE is None:
+        return [_summarizeJob(job) for job in _runPipeline(fpaths, on_finish)]
+
+    # Save the merged detections of the two passes
+    jobs = _runRefined([(fpath, 0, None) for fpath in fpaths])
+
+    for job in jobs:
+        job["result_file"] = get_result_file_name(job["path"])
+        job["saved"] = job["finished"] = False
+        job["detections"] = [job["detections"]] if not job["failed"] else []
+
+    _finishJobs(jobs, on_finish)
+
+    return [_summarizeJob(job) for job in jobs]
+
+
+def analyzeFiles(fpaths: list[str]):
+    """Analyzes several files with shared batches.
+
+    Args:
+        fpaths: List of audio file paths.
+
+    Returns:
+        A list with `True` for every file that was analyzed successfully.
+    """
+    return [s["status"] == "done" for s in analyzeGroup(fpaths)]
+
+
+def analyzeShard(shard: tuple):
+    """Analyzes a time range of a file.
+
+    Args:
+        shard: (path, first window, number of windows), see planShards.
+
+    Returns:
+        The shard, its detections, which are None if the analysis failed, and its summary, see _summarizeJob.
+    """
+    job = _runPipeline([shard])[0] if cfg.REFINE_CONFIDENCE is None else _runRefined([shard])[0]
+
+    return shard, job["detections"] if job["saved"] else None, _summarizeJob(job)
 
 
 def analyzeFile(item):
@@ -340,98 +1298,198 @@ def analyzeFile(item):
     Predicts the scores for the file and saves the results.
 
     Args:
-        item: Tuple containing (file path, config)
+        item: The file path or a tuple containing (file path, config).
+              Pool workers get the config from workers.initWorker.
 
     Returns:
         The `True` if the file was analyzed successfully.
     """
     # Get file path and restore cfg
-    fpath: str = item[0]
-    cfg.setConfig(item[1])
-
-    # Start time
-    start_time = datetime.datetime.now()
-    offset = 0
-    duration = cfg.FILE_SPLITTING_DURATION
-    start, end = 0, cfg.SIG_LENGTH
-    fileLengthSeconds = audio.getAudioFileLength(fpath, cfg.SAMPLE_RATE)
-    results = {}
-    result_file_name = get_result_file_name(fpath)
-
-    if cfg.SKIP_EXISTING_RESULTS and os.path.exists(result_file_name):
-        print(f"Skipping {fpath} as it has already been analyzed", flush=True)
-        return True
-
-    # Status
-    print(f"Analyzing {fpath}", flush=True)
-
-    # Process each chunk
+    if isinstance(item, tuple):
+        fpath: str = item[0]
+        cfg.setConfig(item[1])
+    else:
+        fpath: str = item
+
+    return analyzeFiles([fpath])[0]
+
+
+def planShards(fpath: str):
+    """Splits a long file into time ranges that can be analyzed in parallel.
+
+    The shards follow the window grid of the whole file, each shard starts with the
+    window after the last window of the previous one. The last shard runs to the end.
+
+    Args:
+        fpath: Path to the audio file.
+
+    Returns:
+        A list of shards (path, first window, number of windows or None),
+        or None if the file is not longer than cfg.SHARD_DURATION.
+    """
+    if cfg.SHARD_DURATION <= 0:
+        return None
+
+    step = cfg.SIG_LENGTH - cfg.SIG_OVERLAP
+    shard_windows = max(1, int(cfg.SHARD_DURATION // step))
+
     try:
-        while offset < fileLengthSeconds:
-            chunks = getRawAudioFromFile(fpath, offset, duration)
-            samples = []
-            timestamps = []
+        num_shards = math.ceil(audio.getAudioFileLength(fpath, cfg.SAMPLE_RATE) / (shard_windows * step))
+    except Exception as ex:
+        # The analysis will report the error
+        utils.writeErrorLog(ex)
 
-            for chunk_index, chunk in enumerate(chunks):
-                # Add to batch
-                samples.append(chunk)
-                timestamps.append([start, end])
+        return None
 
-                # Advance start and end
-                start += cfg.SIG_LENGTH - cfg.SIG_OVERLAP
-                end = start + cfg.SIG_LENGTH
+    if num_shards < 2:
+        return None
 
-                # Check if batch is full or last chunk
-                if len(samples) < cfg.BATCH_SIZE and chunk_index < len(chunks) - 1:
-                    continue
+    return [(fpath, i * shard_windows, shard_windows if i < num_shards - 1 else None) for i in range(num_shards)]
 
-                # Predict
-                p = predict(samples)
 
-                # Add to results
-                for i in range(len(samples)):
-                    # Get timestamp
-                    s_start, s_end = timestamps[i]
+def makeTasks(fpaths: list[str]):
+    """Makes the tasks for the worker processes.
 
-                    # Get prediction
-                    pred = p[i]
+    Files longer than cfg.SHARD_DURATION are split into shards, so a single long
+    recording can use all processes. The other files are grouped by cfg.WORKER_CHUNKSIZE, see workers.getGroupSize.
 
-                    # Assign scores to labels
-                    p_labels = zip(cfg.LABELS, pred)
+    Args:
+        fpaths: List of audio file paths.
 
-                    # Sort by score
-                    p_sorted = sorted(p_labels, key=operator.itemgetter(1), reverse=True)
+    Returns:
+        The list of tasks and a dict with the number of shards per sharded file.
+    """
+    shards = []
+    files = []
+    num_shards = {}
 
-                    # Store top 5 results and advance indices
-                    results[str(s_start) + "-" + str(s_end)] = p_sorted
+    for fpath in fpaths:
+        file_shards = planShards(fpath)
 
-                # Clear batch
-                samples = []
-                timestamps = []
-            offset = offset + duration
+        if file_shards:
+            shards += file_shards
+            num_shards[fpath] = len(file_shards)
+        else:
+            files.append(fpath)
 
-    except Exception as ex:
-        # Write error log
+    # Long files first, they take the longest
+    return shards + workers.groupFiles(files, cfg.WORKER_CHUNKSIZE, cfg.CPU_THREADS), num_shards
+
+
+def analyzeTask(task):
+    """Analyzes a task of makeTasks.
+
+    Args:
+        task: A shard tuple or a list of file paths.
+
+    Returns:
+        See analyzeShard or analyzeGroup.
+    """
+    try:
+        if isinstance(task, tuple):
+            return analyzeShard(task)
+
+        return analyzeGroup(task)
+
+    finally:
+        # The worker may be stopped without running atexit
+        metadata.flush()
+
+
+def collectShard(shard: tuple, detections, summary: dict, num_shards: dict, collected: dict):
+    """Collects the results of a shard and saves the file when all of its shards are done.
+
+    Args:
+        shard: The shard, see planShards.
+        detections: The detections of the shard or None if it failed.
+        summary: The summary of the shard, see _summarizeJob.
+        num_shards: The number of shards per file, see makeTasks.
+        collected: The (detections, summary) of the finished shards per file, updated in place.
+
+    Returns:
+        The summary of the file once all of its shards are done, otherwise None.
+    """
+    fpath = shard[0]
+    parts = collected.setdefault(fpath, {})
+    parts[shard[1]] = (detections, summary)
+
+    if len(parts) < num_shards[fpath]:
+        return None
+
+    del collected[fpath]
+
+    # The file ends with the last shard, which starts on the sample grid of the windows
+    last = max(parts)
+    started = min(s["started"] for _, s in parts.values())
+    result = {
+        "path": fpath,
+        "status": "failed",
+        "result_file": get_result_file_name(fpath),
+        "duration": last * _stepSamples() / cfg.SAMPLE_RATE + parts[last][1]["duration"]
+        if parts[last][1]["duration"] is not None
+        else None,
+        "num_windows": sum(s["num_windows"] for _, s in parts.values()),
+        "gated_windows": sum(s["gated_windows"] for _, s in parts.values()),
+        "gate_dropped": sum(s["gate_dropped"] for _, s in parts.values()),
+        "started": started,
+        "seconds": (datetime.datetime.now() - datetime.datetime.fromisoformat(started)).total_seconds(),
+    }
+
+    if any(d is None for d, _ in parts.values()):
         print(f"Error: Cannot analyze audio file {fpath}.\n", flush=True)
-        utils.writeErrorLog(ex)
 
-        return False
+        return result
+
+    # Stitch in the order of the shards
+    detections = np.concatenate([parts[k][0] for k in sorted(parts)])
 
-    # Save as selection table
     try:
-        saveResultFile(results, result_file_name, fpath)
+        # The shards wrote their rows into the same score file
+        if cfg.SAVE_SCORES:
+            scores.finishScoreFile(
+                getScoreFileName(fpath),
+                result["num_windows"],
+                len(cfg.LABELS),
+                fpath,
+                audio.get_sample_rate(fpath),
+                result["duration"],
+                getFileLocation(fpath),
+            )
+
+        saveResultFile(detections, result["result_file"], fpath, audio.get_sample_rate(fpath), result["duration"])
 
     except Exception as ex:
         # Write error log
         print(f"Error: Cannot save result for {fpath}.\n", flush=True)
         utils.writeErrorLog(ex)
 
-        return False
+        return result
 
-    delta_time = (datetime.datetime.now() - start_time).total_seconds()
-    print(f"Finished {fpath} in {delta_time:.2f} seconds", flush=True)
+    print(f"Finished {fpath} in {result['seconds']:.2f} seconds", flush=True)
+    result["status"] = "done"
+
+    return result
+
+
+def reportEnergyGate(summaries: list[dict]):
+    """Prints how many windows the energy gate kept from the model.
 
-    return True
+    Args:
+        summaries: The summaries of the analyzed files, see _summarizeJob.
+    """
+    num_windows = sum(s["num_windows"] or 0 for s in summaries)
+    gated = sum(s.get("gated_windows", 0) for s in summaries)
+    share = gated / num_windows if num_windows else 0.0
+
+    if cfg.ENERGY_GATE_VALIDATE:
+        dropped = sum(s.get("gate_dropped", 0) for s in summaries)
+        print(
+            f"Energy gate at {cfg.ENERGY_GATE_DB} dBFS: {gated} of {num_windows} windows ({share:.1%}) below the floor, "
+            f"{dropped} detections in them were dropped",
+            flush=True,
+        )
+    else:
+        print(f"Energy gate at {cfg.ENERGY_GATE_DB} dBFS: skipped inference for {gated} of {num_windows} windows ({share:.1%})", flush=True)
 
 
 if __name__ == "__main__":
@@ -454,6 +1512,17 @@ if __name__ == "__main__":
         default=-1,
         help="Week of the year when the recording was made. Values in [1, 48] (4 weeks per month). Set -1 for year-round species list.",
     )
+    parser.add_argument(
+        "--file_metadata",
+        default=None,
+        help="Path to a CSV file with the columns file, lat, lon and week for files recorded at other sites or weeks. "
+        "Files are absolute or relative to --i, empty values and missing files use --lat, --lon and --week. Defaults to None.",
+    )
+    parser.add_argument(
+        "--week_from_filename",
+        action="store_true",
+        help="Take the week from a date in the file name like 20230415_053000.WAV, unless --file_metadata sets it. Defaults to False.",
+    )
     parser.add_argument(
         "--slist",
         default="",
@@ -480,12 +1549,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--rtype",
         default="table",
-        help="Specifies output format. Values in ['table', 'audacity', 'r',  'kaleidoscope', 'csv']. Defaults to 'table' (Raven selection table).",
+        help="Specifies output format. Values in ['table', 'audacity', 'r',  'kaleidoscope', 'csv', 'columnar']. Defaults to 'table' (Raven selection table).",
     )
     parser.add_argument(
         "--output_file",
         default=None,
-        help="Path to combined Raven selection table. If set and rtype is 'table', all results will be combined into this file. Defaults to None.",
+        help="Name of the combined result file in the output folder. If set, all results will be combined into this file. Defaults to None.",
     )
     parser.add_argument(
         "--threads", type=int, default=min(8, max(1, multiprocessing.cpu_count() // 2)), help="Number of CPU threads."
@@ -493,6 +1562,41 @@ if __name__ == "__main__":
     parser.add_argument(
         "--batchsize", type=int, default=1, help="Number of samples to process at the same time. Defaults to 1."
     )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=0,
+        help="Number of files sent to a worker process at once. Their windows share batches, which helps with many short files. "
+        "Set 0 to pick it from the number of files and threads. Defaults to 0.",
+    )
+    parser.add_argument(
+        "--save_scores",
+        action="store_true",
+        help="Save the raw model outputs of every window next to the result files, so render.py can create results with other settings. Defaults to False.",
+    )
+    parser.add_argument(
+        "--shard_duration",
+        type=int,
+        default=cfg.SHARD_DURATION,
+        help=f"Files longer than this are split into shards of this many seconds that are analyzed in parallel. Set 0 to disable. Defaults to {cfg.SHARD_DURATION}.",
+    )
+    parser.add_argument(
+        "--decode_threads",
+        type=int,
+        default=1,
+        help="Number of threads per process that decode audio files. Defaults to 1.",
+    )
+    parser.add_argument(
+        "--inference_threads",
+        type=int,
+        default=1,
+        help="Number of threads per process that run the model, each with its own interpreter. Defaults to 1.",
+    )
+    parser.add_argument(
+        "--pipeline_stats",
+        action="store_true",
+        help="Print the queue depths and waiting times of the pipeline stages. Defaults to False.",
+    )
     parser.add_argument(
         "--locale",
         default="en",
@@ -521,10 +1625,37 @@ if __name__ == "__main__":
         default=cfg.SIG_FMAX,
         help=f"Maximum frequency for bandpass filter in Hz. Defaults to {cfg.SIG_FMAX} Hz.",
     )
+    parser.add_argument(
+        "--resampler",
+        default=cfg.RESAMPLE_TYPE,
+        help=f"Resampler for files that are not at {cfg.SAMPLE_RATE} Hz. Values in ['kaiser_fast', 'polyphase']. Defaults to '{cfg.RESAMPLE_TYPE}'.",
+    )
+    parser.add_argument(
+        "--refine_conf",
+        type=float,
+        default=None,
+        help="Two-pass mode: analyze without overlap first, then with --overlap only around windows that score above this candidate threshold. Values in [0.01, 0.99], below --min_conf. Defaults to None (off).",
+    )
+    parser.add_argument(
+        "--energy_gate",
+        type=float,
+        default=None,
+        help="Windows quieter than this RMS level in dBFS after the bandpass filter are not passed to the model, e.g. -70. Defaults to None (off).",
+    )
+    parser.add_argument(
+        "--energy_gate_validate",
+        action="store_true",
+        help="Run the model on the gated windows anyway and report how many detections the energy gate drops. Defaults to False.",
+    )
     parser.add_argument(
         "--skip_existing_results",
         action="store_true",
-        help="Skip files that have already been analyzed. Defaults to False.",
+        help="Skip files that the manifest lists as analyzed with the same settings and that did not change since. Defaults to False.",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help=f"Path to the SQLite manifest of analyzed files, the durations of the audio files are cached next to it. Defaults to '{manifest.MANIFEST_FILENAME}' in the output folder with --skip_existing_results, otherwise nothing is written.",
     )
 
     args = parser.parse_args()
@@ -543,6 +1674,7 @@ if __name__ == "__main__":
     cfg.LABELS = utils.readLines(cfg.LABELS_FILE)
 
     cfg.SKIP_EXISTING_RESULTS = args.skip_existing_results
+    cfg.SAVE_SCORES = args.save_scores
 
     # Set custom classifier?
     if args.classifier is not None:
@@ -559,6 +1691,8 @@ if __name__ == "__main__":
         args.lat = -1
         args.lon = -1
         args.locale = "en"
+        args.file_metadata = None
+        args.week_from_filename = False
 
     # Load translated labels
     lfile = os.path.join(
@@ -599,6 +1733,13 @@ if __name__ == "__main__":
     cfg.INPUT_PATH = args.i
     cfg.OUTPUT_PATH = args.o
 
+    # Load location and week of single files
+    cfg.FILE_METADATA = loadFileMetadata(args.file_metadata, cfg.INPUT_PATH) if args.file_metadata else {}
+    cfg.WEEK_FROM_FILENAME = args.week_from_filename
+
+    if cfg.FILE_METADATA:
+        print(f"Loaded location and week of {len(cfg.FILE_METADATA)} files")
+
     # Parse input files
     if os.path.isdir(cfg.INPUT_PATH):
         cfg.FILE_LIST = utils.collect_audio_files(cfg.INPUT_PATH)
@@ -615,18 +1756,34 @@ if __name__ == "__main__":
     # Set overlap
     cfg.SIG_OVERLAP = max(0.0, min(2.9, float(args.overlap)))
 
+    # Set candidate threshold of the two-pass mode
+    if args.refine_conf is not None:
+        cfg.REFINE_CONFIDENCE = max(0.01, min(0.99, float(args.refine_conf)))
+
+        # The score files need the model outputs of every window
+        if cfg.SAVE_SCORES:
+            print("Scores are not saved in two-pass mode", flush=True)
+            cfg.SAVE_SCORES = False
+
     # Set bandpass frequency range
     cfg.BANDPASS_FMIN = max(0, min(cfg.SIG_FMAX, int(args.fmin)))
     cfg.BANDPASS_FMAX = max(cfg.SIG_FMIN, min(cfg.SIG_FMAX, int(args.fmax)))
 
+    # Set resampler
+    cfg.RESAMPLE_TYPE = args.resampler.lower()
+
+    # Set energy gate
+    cfg.ENERGY_GATE_DB = args.energy_gate
+    cfg.ENERGY_GATE_VALIDATE = args.energy_gate_validate and args.energy_gate is not None
+
     # Set result type
     cfg.RESULT_TYPE = args.rtype.lower()
 
-    if not cfg.RESULT_TYPE in ["table", "audacity", "r", "kaleidoscope", "csv"]:
+    if not cfg.RESULT_TYPE in ["table", "audacity", "r", "kaleidoscope", "csv", "columnar"]:
         cfg.RESULT_TYPE = "table"
 
     # Set output file
-    if args.output_file is not None and cfg.RESULT_TYPE == "table":
+    if args.output_file is not None:
         cfg.OUTPUT_FILE = args.output_file
     else:
         cfg.OUTPUT_FILE = None
@@ -642,30 +1799,93 @@ if __name__ == "__main__":
     # Set batch size
     cfg.BATCH_SIZE = max(1, int(args.batchsize))
 
-    # Add config items to each file list entry.
-    # We have to do this for Windows which does not
-    # support fork() and thus each process has to
-    # have its own config. USE LINUX!
-    flist = [(f, cfg.getConfig()) for f in cfg.FILE_LIST]
+    # Set number of files per worker task
+    cfg.WORKER_CHUNKSIZE = max(0, int(args.chunksize))
+
+    # Set size of the pipeline stages
+    cfg.DECODE_THREADS = max(1, int(args.decode_threads))
+    cfg.INFERENCE_THREADS = max(1, int(args.inference_threads))
+    cfg.PIPELINE_STATS = args.pipeline_stats
+
+    # Set duration of the shards of long files
+    cfg.SHARD_DURATION = max(0, int(args.shard_duration))
+
+    # Open the manifest, only this process writes to it.
+    # It is only kept on disk when a later run may skip the analyzed files.
+    if args.manifest:
+        cfg.MANIFEST_PATH = args.manifest
+    elif cfg.SKIP_EXISTING_RESULTS:
+        cfg.MANIFEST_PATH = manifest.getDefaultPath(cfg.OUTPUT_PATH)
+    else:
+        cfg.MANIFEST_PATH = None
+
+    db = manifest.connect(cfg.MANIFEST_PATH or manifest.IN_MEMORY)
+    params = manifest.getParameterHash()
+
+    # Durations and sample rates are cached next to the manifest
+    cfg.AUDIO_INFO_CACHE_FILE = (
+        os.path.join(os.path.dirname(cfg.MANIFEST_PATH), metadata.AUDIO_INFO_CACHE_FILENAME) if cfg.MANIFEST_PATH else None
+    )
+
+    # Select new and changed files
+    files, file_stats = manifest.getPendingFiles(db, cfg.FILE_LIST, params, cfg.SKIP_EXISTING_RESULTS)
+
+    # A single long file is sharded over several processes
+    if not os.path.isdir(cfg.INPUT_PATH) and args.threads > 1 and files and planShards(cfg.INPUT_PATH):
+        cfg.CPU_THREADS = max(1, int(args.threads))
+        cfg.TFLITE_THREADS = 1
 
     # Analyze files
-    if cfg.CPU_THREADS < 2 or len(flist) < 2:
-        for entry in flist:
-            analyzeFile(entry)
+    summaries = []
+
+    # Every file is recorded as soon as it is saved, so an interrupted run resumes after it
+    def record(summary):
+        manifest.recordResults(db, [summary], file_stats, params)
+
+    if cfg.CPU_THREADS < 2:
+        summaries = analyzeGroup(files, record)
     else:
-        with Pool(cfg.CPU_THREADS) as p:
-            # Map analyzeFile function to each entry in flist
-            results = p.map_async(analyzeFile, flist)
-            # Wait for all tasks to complete
-            results.wait()
+        # Each task is a group of files that share their batches or a shard of a long file
+        tasks, num_shards = makeTasks(files)
+        collected = {}
+
+        if len(tasks) < 2:
+            for task in tasks:
+                summaries += analyzeGroup(task, record)
+        else:
+            # The workers read the durations that were probed for the tasks
+            metadata.flush()
+
+            # Workers restore the config and load the model once,
+            # which also works on Windows where there is no fork().
+            for result in workers.imapUnordered(analyzeTask, tasks, cfg.CPU_THREADS, cfg.getConfig(), "predict"):
+                # Stitch the shards of long files
+                if isinstance(result, tuple):
+                    summary = collectShard(*result, num_shards, collected)
+                    result = [summary] if summary else []
+
+                manifest.recordResults(db, result, file_stats, params)
+                summaries += result
+
+            workers.shutdown()
+
+    if cfg.ENERGY_GATE_DB is not None:
+        reportEnergyGate(summaries)
 
     # Combine results?
     if not cfg.OUTPUT_FILE is None:
         print(f"Combining results into {cfg.OUTPUT_FILE}...", end="", flush=True)
-        combineResults(cfg.OUTPUT_PATH, cfg.OUTPUT_FILE)
+        combineResults(cfg.OUTPUT_PATH, cfg.OUTPUT_FILE, manifest.getResultFiles(db, params))
         print("done!", flush=True)
 
+    db.close()
+
     # A few examples to test
     # python3 analyze.py --i example/ --o example/ --slist example/ --min_conf 0.5 --threads 4
     # python3 analyze.py --i example/soundscape.wav --o example/soundscape.BirdNET.selection.table.txt --slist example/species_list.txt --threads 8
     # python3 analyze.py --i example/ --o example/ --lat 42.5 --lon -76.45 --week 4 --sensitivity 1.0 --rtype table --locale de
+    # python3 analyze.py --i example/ --o example/ --file_metadata example/sites.csv --week_from_filename
+    # python3 analyze.py --i example/ --o example/ --skip_existing_results --manifest example/BirdNET_manifest.sqlite
+    # python3 analyze.py --i example/ --o example/ --rtype columnar --output_file BirdNET_results.bin
+    # python3 analyze.py --i example/ --o example/ --energy_gate -70 --energy_gate_validate
+    # python3 analyze.py --i example/ --o example/ --overlap 2.0 --refine_conf 0.05
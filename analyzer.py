@@ -0,0 +1,405 @@
+"""Module to embed the analysis in other programs.
+
+An Analyzer holds fixed settings, its own interpreters, the labels and the
+species mask, so signals that are already in memory can be analyzed without
+writing files or touching the global config:
+
+    birdnet = Analyzer(lat=42.5, lon=-76.45, week=4, min_conf=0.25)
+    detections = birdnet.analyzeArray(signal, 44100)
+    print(birdnet.describe(detections))
+"""
+import collections
+import copy
+import itertools
+import json
+import os
+import threading
+import types
+
+import numpy as np
+
+import analyze
+import audio
+import config as cfg
+import metadata
+import model
+import utils
+
+# Paths of the config are relative to this folder
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Analyzer:
+    """Analyzes signals and audio files with fixed settings.
+
+    The model and the species mask are loaded once. Every thread that calls an
+    Analyzer gets its own interpreters, so one Analyzer can be shared by threads.
+    Only TFLite models and classifiers are supported.
+    """
+
+    def __init__(
+        self,
+        lat: float = -1,
+        lon: float = -1,
+        week: int = -1,
+        species_list=None,
+        sensitivity: float = 1.0,
+        min_conf: float = 0.1,
+        overlap: float = 0.0,
+        fmin: int = cfg.SIG_FMIN,
+        fmax: int = cfg.SIG_FMAX,
+        sf_thresh: float = 0.03,
+        locale: str = "en",
+        classifier: str | None = None,
+        batch_size: int = 1,
+        threads: int = 1,
+        resampler: str = cfg.RESAMPLE_TYPE,
+    ):
+        """Loads the model, the labels and the species mask.
+
+        The arguments are those of analyze.py.
+
+        Args:
+            lat: Recording location latitude, -1 to ignore.
+            lon: Recording location longitude, -1 to ignore.
+            week: Week of the year in [1, 48], -1 for the whole year.
+            species_list: List of labels or path to a species list file, used if there is no location.
+            sensitivity: Detection sensitivity in [0.5, 1.5].
+            min_conf: Minimum confidence in [0.0, 0.99], 0.0 keeps all scores.
+            overlap: Overlap of the windows in seconds in [0.0, 2.9].
+            fmin: Minimum frequency of the bandpass filter in Hz.
+            fmax: Maximum frequency of the bandpass filter in Hz.
+            sf_thresh: Threshold of the location filter in [0.01, 0.99].
+            locale: Locale of the translated common names.
+            classifier: Path to a custom TFLite classifier. Location and locale are ignored if set.
+            batch_size: Number of windows predicted at once.
+            threads: Number of threads of each interpreter.
+            resampler: Resampler for signals that are not at cfg.SAMPLE_RATE, see cfg.RESAMPLE_TYPE.
+        """
+        model_path = os.path.join(SCRIPT_DIR, cfg.MODEL_PATH)
+        labels_file = os.path.join(SCRIPT_DIR, cfg.LABELS_FILE)
+
+        if not model_path.endswith(".tflite") or (classifier is not None and not classifier.endswith(".tflite")):
+            raise ValueError("The Analyzer only supports TFLite models.")
+
+        if classifier is not None:
+            labels_file = classifier.replace(".tflite", "_Labels.txt")
+            locale = "en"
+
+        self._model_config = {
+            "MODEL_PATH": model_path,
+            "MDATA_MODEL_PATH": os.path.join(SCRIPT_DIR, cfg.MDATA_MODEL_PATH),
+            "LABELS_FILE": labels_file,
+            "CUSTOM_CLASSIFIER": classifier,
+            "LOCALE": locale,
+            "TFLITE_THREADS": max(1, int(threads)),
+        }
+        self._settings = {
+            "lat": lat,
+            "lon": lon,
+            "week": week,
+            "species_list": species_list,
+            "sensitivity": sensitivity,
+            "min_conf": min_conf,
+            "overlap": overlap,
+            "fmin": fmin,
+            "fmax": fmax,
+            "sf_thresh": sf_thresh,
+            "batch_size": batch_size,
+            "resampler": resampler,
+        }
+        self.config = self._makeConfig(self._settings)
+
+        # Labels
+        self.labels = utils.readLines(labels_file)
+        lfile = os.path.join(
+            SCRIPT_DIR, cfg.TRANSLATED_LABELS_PATH, os.path.basename(labels_file).replace(".txt", f"_{locale}.txt")
+        )
+        self.translated_labels = utils.readLines(lfile) if locale != "en" and os.path.isfile(lfile) else self.labels
+
+        with open(os.path.join(SCRIPT_DIR, cfg.CODES_FILE), "r") as f:
+            self.codes = json.load(f)
+
+        # Interpreters of all threads, see model.getAllocatedInterpreter
+        self._cache = collections.OrderedDict()
+        self._c_cache = collections.OrderedDict()
+        self._input_index, self._output_index = self._loadInterpreter(self._cache, model_path)
+
+        if classifier is not None:
+            self._c_input_index, self._c_output_index = self._loadInterpreter(self._c_cache, classifier)
+            self._c_input_size = next(iter(self._c_cache.values())).get_input_details()[0]["shape"][-1]
+
+        # Location masks of all settings, shared with withSettings
+        self._masks = {}
+        self._masks_lock = threading.Lock()
+
+        self.species_mask = self._loadSpeciesMask(species_list)
+
+    def _makeConfig(self, settings: dict):
+        """Clamps the settings like analyze.py does.
+
+        Args:
+            settings: The arguments of __init__ that are not tied to the model.
+
+        Returns:
+            The read-only config.
+        """
+        lat, lon = settings["lat"], settings["lon"]
+
+        if self._model_config["CUSTOM_CLASSIFIER"] is not None:
+            lat, lon = -1, -1
+
+        return types.MappingProxyType(
+            {
+                **self._model_config,
+                "LATITUDE": lat,
+                "LONGITUDE": lon,
+                "WEEK": settings["week"],
+                "LOCATION_FILTER_THRESHOLD": max(0.01, min(0.99, float(settings["sf_thresh"]))),
+                "SIGMOID_SENSITIVITY": max(0.5, min(1.0 - (float(settings["sensitivity"]) - 1.0), 1.5)),
+                "MIN_CONFIDENCE": max(0.0, min(0.99, float(settings["min_conf"]))),
+                "SIG_OVERLAP": max(0.0, min(2.9, float(settings["overlap"]))),
+                "BANDPASS_FMIN": max(0, min(cfg.SIG_FMAX, int(settings["fmin"]))),
+                "BANDPASS_FMAX": max(cfg.SIG_FMIN, min(cfg.SIG_FMAX, int(settings["fmax"]))),
+                "BATCH_SIZE": max(1, int(settings["batch_size"])),
+                "RESAMPLE_TYPE": settings["resampler"].lower(),
+            }
+        )
+
+    def withSettings(self, **settings):
+        """Returns an Analyzer with other settings that shares the model of this one.
+
+        The interpreters, labels and location masks are shared, so this is cheap
+        enough to be called for every request of a server.
+
+        Args:
+            **settings: Arguments of __init__, except locale, classifier and threads.
+
+        Returns:
+            The new Analyzer.
+        """
+        unknown = set(settings) - set(self._settings)
+
+        if unknown:
+            raise ValueError(f"Cannot change {', '.join(sorted(unknown))} of a loaded Analyzer.")
+
+        other = copy.copy(self)
+        other._settings = {**self._settings, **settings}
+        other.config = other._makeConfig(other._settings)
+        other.species_mask = other._loadSpeciesMask(other._settings["species_list"])
+
+        return other
+
+    def _loadInterpreter(self, cache: collections.OrderedDict, model_path: str):
+        """Loads a model and keeps the interpreter in the cache.
+
+        Args:
+            cache: The interpreter cache.
+            model_path: Path to the TFLite model.
+
+        Returns:
+            The input and output tensor index.
+        """
+        interpreter = model.tflite.Interpreter(model_path=model_path, num_threads=self.config["TFLITE_THREADS"])
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()
+
+        with model.INTERPRETER_LOCK:
+            cache[(model.getInterpreterSlot(), tuple(input_details[0]["shape"]))] = interpreter
+
+        return input_details[0]["index"], interpreter.get_output_details()[0]["index"]
+
+    def _loadSpeciesMask(self, species_list):
+        """Makes the boolean mask of the species that may be reported.
+
+        Args:
+            species_list: List of labels or path to a species list file.
+
+        Returns:
+            A boolean vector over the labels or None if all species may be reported.
+        """
+        c = self.config
+
+        if c["LATITUDE"] != -1 and c["LONGITUDE"] != -1:
+            key = (c["LATITUDE"], c["LONGITUDE"], c["WEEK"], c["LOCATION_FILTER_THRESHOLD"])
+
+            with self._masks_lock:
+                if key not in self._masks:
+                    # Run the location filter once per location
+                    interpreter = model.tflite.Interpreter(model_path=c["MDATA_MODEL_PATH"], num_threads=1)
+                    interpreter.allocate_tensors()
+                    interpreter.set_tensor(
+                        interpreter.get_input_details()[0]["index"], np.array([key[:3]], dtype="float32")
+                    )
+                    interpreter.invoke()
+
+                    self._masks[key] = interpreter.get_tensor(interpreter.get_output_details()[0]["index"])[0] >= key[3]
+
+                return self._masks[key]
+
+        if isinstance(species_list, str):
+            species_list = utils.readLines(species_list)
+
+        if not species_list:
+            return None
+
+        return np.isin(np.array(self.labels), np.array(species_list))
+
+    def _invoke(self, cache, model_path: str, input_index: int, output_index: int, batch: np.ndarray):
+        """Runs a batch through an interpreter of the calling thread.
+
+        Returns:
+            The output tensor.
+        """
+        interpreter = model.getAllocatedInterpreter(
+            cache, model_path, input_index, batch.shape, self.config["TFLITE_THREADS"], cfg.INTERPRETER_CACHE_SIZE
+        )
+        interpreter.set_tensor(input_index, np.ascontiguousarray(batch, dtype="float32"))
+        interpreter.invoke()
+
+        return interpreter.get_tensor(output_index)
+
+    def predict(self, windows: np.ndarray):
+        """Predicts the model outputs of windows.
+
+        Args:
+            windows: The windows with shape (windows, samples) at cfg.SAMPLE_RATE.
+
+        Returns:
+            The logits with shape (windows, classes).
+        """
+        c = self.config
+
+        if c["CUSTOM_CLASSIFIER"] is None:
+            return self._invoke(self._cache, c["MODEL_PATH"], self._input_index, self._output_index, windows)
+
+        # The classifier runs on the embeddings of the model, unless it takes audio
+        if self._c_input_size != windows.shape[1]:
+            windows = self._invoke(self._cache, c["MODEL_PATH"], self._input_index, self._output_index - 1, windows)
+
+        return self._invoke(self._c_cache, c["CUSTOM_CLASSIFIER"], self._c_input_index, self._c_output_index, windows)
+
+    def analyzeArray(self, signal: np.ndarray, rate: int, predict=None, progress=None):
+        """Analyzes a signal.
+
+        Args:
+            signal: The samples, with shape (samples,) or (samples, channels).
+            rate: The sample rate of the signal.
+            predict: Function that returns the logits of windows, defaults to self.predict.
+                     Used by the server to batch the windows of several requests.
+            progress: Function called with the number of analyzed windows and all windows after each batch.
+
+        Returns:
+            The detections as array of analyze.DETECTION_DTYPE, sorted by time and descending score.
+        """
+        c = self.config
+        sig = np.asarray(signal, dtype="float32")
+
+        if sig.ndim == 2:
+            sig = sig.mean(axis=1, dtype="float32")
+
+        sig = audio.resample(sig, rate, cfg.SAMPLE_RATE, c["RESAMPLE_TYPE"])
+        sig = audio.bandpass(sig, cfg.SAMPLE_RATE, c["BANDPASS_FMIN"], c["BANDPASS_FMAX"])
+
+        return self._analyzeBlocks([sig], len(sig), predict, progress)
+
+    def analyzeFile(self, path: str, predict=None, progress=None):
+        """Analyzes an audio file.
+
+        The file is decoded in blocks of cfg.FILE_SPLITTING_DURATION seconds like analyze.py does,
+        so long recordings are never held in memory as a whole.
+
+        Args:
+            path: Path to the audio file.
+            predict: See analyzeArray.
+            progress: See analyzeArray, the number of all windows is estimated from the file header.
+
+        Returns:
+            The detections, see analyzeArray.
+        """
+        c = self.config
+        blocks = audio.streamAudioFile(
+            path, cfg.SAMPLE_RATE, cfg.FILE_SPLITTING_DURATION, c["BANDPASS_FMIN"], c["BANDPASS_FMAX"]
+        )
+
+        return self._analyzeBlocks(blocks, int(metadata.getAudioInfo(path)["duration"] * cfg.SAMPLE_RATE), predict, progress)
+
+    def _analyzeBlocks(self, blocks, num_samples: int, predict, progress):
+        """Analyzes a stream of signal blocks.
+
+        The windows continue across the blocks and are collected into full batches.
+
+        Args:
+            blocks: Iterable of mono blocks at cfg.SAMPLE_RATE, resampled and filtered.
+            num_samples: Length of the whole signal, used for the progress.
+            predict: See analyzeArray.
+            progress: See analyzeArray.
+
+        Returns:
+            The detections, see analyzeArray.
+        """
+        c = self.config
+        predict = self.predict if predict is None else predict
+        step = cfg.SIG_LENGTH - c["SIG_OVERLAP"]
+        minlen = int(cfg.SIG_MINLEN * cfg.SAMPLE_RATE)
+        total = (num_samples - minlen) // int(step * cfg.SAMPLE_RATE) + 1 if num_samples >= minlen else int(num_samples > 0)
+        windows = audio.splitSignalStream(blocks, cfg.SAMPLE_RATE, cfg.SIG_LENGTH, c["SIG_OVERLAP"], cfg.SIG_MINLEN)
+        batch = np.zeros((c["BATCH_SIZE"], int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE)), dtype="float32")
+        size = 0
+        done = 0
+        detections = []
+
+        for window in itertools.chain(windows, [None]):
+            if window is not None:
+                batch[size] = window
+                size += 1
+
+            if size == len(batch) or (window is None and size > 0):
+                p = model.flat_sigmoid(predict(batch[:size]), sensitivity=-c["SIGMOID_SENSITIVITY"])
+                start = np.arange(done, done + size) * step
+                timestamps = np.stack((start, start + cfg.SIG_LENGTH), axis=1)
+                detections.append(analyze.extractDetections(p, timestamps, self.species_mask, c["MIN_CONFIDENCE"]))
+                done += size
+                size = 0
+
+                if progress is not None:
+                    progress(done, max(done, total))
+
+        r = np.concatenate(detections) if detections else np.empty(0, dtype=analyze.DETECTION_DTYPE)
+
+        return r[np.lexsort((-r["score"], r["start"]))]
+
+    def describe(self, detections: np.ndarray):
+        """Adds the names to detections.
+
+        Args:
+            detections: The detections, see analyzeArray.
+
+        Returns:
+            A list of dicts with start, end, scientific name, common name, eBird code and confidence.
+        """
+        return [
+            {
+                "start": start,
+                "end": end,
+                "scientific_name": self.labels[c].split("_", 1)[0],
+                "common_name": self.translated_labels[c].split("_", 1)[-1],
+                "code": self.codes.get(self.labels[c], self.labels[c]),
+                "confidence": round(score, 4),
+            }
+            for start, end, c, score in zip(
+                detections["start"].tolist(), detections["end"].tolist(), detections["label"].tolist(), detections["score"].tolist()
+            )
+        ]
+
+    def release(self):
+        """Removes the interpreters of the calling thread or its slot.
+
+        Should be called by threads that stop using the Analyzer.
+        """
+        slot = model.getInterpreterSlot()
+
+        with model.INTERPRETER_LOCK:
+            for cache in (self._cache, self._c_cache):
+                for key in [k for k in cache if k[0] == slot]:
+                    del cache[key]
@@ -1,8 +1,17 @@
 """Module containing audio helper functions.
 """
+import functools
+import io
+import math
+import os
+import struct
+import subprocess
+import tempfile
+
 import numpy as np
 
 import config as cfg
+import metadata
 
 RANDOM = np.random.RandomState(cfg.RANDOM_SEED)
 
@@ -10,7 +19,9 @@ RANDOM = np.random.RandomState(cfg.RANDOM_SEED)
 def openAudioFile(path: str, sample_rate=48000, offset=0.0, duration=None, fmin=None, fmax=None):
     """Open an audio file.
 
-    Opens an audio file with librosa and the given settings.
+    Formats that libsndfile can read (WAV, FLAC, ...) are read directly and only resampled
+    if they are not at the sample rate already. 16-bit PCM and float WAV files are memory-mapped.
+    Other formats are decoded with librosa.
 
     Args:
         path: Path to the audio file.
@@ -21,10 +32,16 @@ def openAudioFile(path: str, sample_rate=48000, offset=0.0, duration=None, fmin=
     Returns:
         Returns the audio time series and the sampling rate.
     """
-    # Open file with librosa (uses ffmpeg or libav)
-    import librosa
+    native = readAudioFile(path, offset, duration)
 
-    sig, rate = librosa.load(path, sr=sample_rate, offset=offset, duration=duration, mono=True, res_type="kaiser_fast")
+    if native is not None:
+        sig, rate = native
+        sig, rate = resample(sig, rate, sample_rate), sample_rate
+    else:
+        # Open file with librosa (uses ffmpeg or libav)
+        import librosa
+
+        sig, rate = librosa.load(path, sr=sample_rate, offset=offset, duration=duration, mono=True, res_type=cfg.RESAMPLE_TYPE)
 
     # Bandpass filter
     if fmin != None and fmax != None:
@@ -33,16 +50,536 @@ def openAudioFile(path: str, sample_rate=48000, offset=0.0, duration=None, fmin=
 
     return sig, rate
 
-def getAudioFileLength(path, sample_rate=48000):    
-    
-    # Open file with librosa (uses ffmpeg or libav)
+def readAudioFile(path: str, offset=0.0, duration=None):
+    """Reads an audio file at its native sample rate without librosa.
+
+    Reads the same samples as librosa.load with sr=None.
+
+    Args:
+        path: Path to the audio file.
+        offset: The starting offset in seconds.
+        duration: Maximum duration in seconds, None to read until the end.
+
+    Returns:
+        The mono float32 signal and the native sample rate, or None if libsndfile cannot read the file.
+        For mono float WAV files the signal is a read-only view of the file.
+    """
+    mapped = _mapWavFile(path)
+
+    if mapped is not None:
+        frames, rate = mapped
+        start = min(int(offset * rate), len(frames))
+        stop = len(frames) if duration is None else min(len(frames), start + int(duration * rate))
+
+        return _toMono(frames[start:stop]), rate
+
+    import soundfile as sf
+
+    try:
+        sfile = sf.SoundFile(path)
+    except Exception:
+        return None
+
+    with sfile:
+        rate = sfile.samplerate
+
+        if offset > 0:
+            sfile.seek(min(int(offset * rate), sfile.frames))
+
+        frames = -1 if duration is None else int(duration * rate)
+
+        return _toMono(sfile.read(frames, dtype="float32", always_2d=True)), rate
+
+
+def readAudioBuffer(f, ext: str):
+    """Reads an audio file from a file-like object, e.g. an upload, without writing it to disk.
+
+    Formats that libsndfile can read are read with soundfile, others are decoded
+    by piping them through ffmpeg. Reads the same samples as readAudioFile.
+
+    Args:
+        f: The file-like object.
+        ext: The file extension, e.g. '.m4a', only needed if ffmpeg is not installed.
+
+    Returns:
+        The mono float32 signal and the native sample rate.
+    """
+    import soundfile as sf
+
+    f.seek(0)
+
+    try:
+        with sf.SoundFile(f) as sfile:
+            return _toMono(sfile.read(dtype="float32", always_2d=True)), sfile.samplerate
+    except Exception:
+        pass
+
+    f.seek(0)
+    data = f.read()
+
+    try:
+        return _decodePiped(data)
+
+    except FileNotFoundError:
+        # Without ffmpeg, librosa needs a file
+        import librosa
+
+        tmp = tempfile.NamedTemporaryFile(suffix=ext, delete=False)
+
+        try:
+            with tmp:
+                tmp.write(data)
+
+            return librosa.load(tmp.name, sr=None, mono=True)
+        finally:
+            os.unlink(tmp.name)
+
+
+def _decodePiped(data: bytes):
+    """Decodes an audio file with ffmpeg, without temporary files.
+
+    ffmpeg reads the file from stdin and writes a float WAV stream at the native sample rate to stdout.
+
+    Args:
+        data: The content of the audio file.
+
+    Returns:
+        The mono float32 signal and the native sample rate.
+
+    Raises:
+        FileNotFoundError: If ffmpeg is not installed.
+        ValueError: If ffmpeg cannot decode the file.
+    """
+    p = subprocess.run(
+        ["ffmpeg", "-nostdin", "-v", "error", "-i", "pipe:0", "-f", "wav", "-c:a", "pcm_f32le", "pipe:1"],
+        input=data,
+        capture_output=True,
+    )
+
+    header = _readWavHeader(io.BytesIO(p.stdout), len(p.stdout)) if p.returncode == 0 else None
+
+    if header is None:
+        raise ValueError(f"ffmpeg cannot decode the file: {p.stderr.decode(errors='replace').strip()}")
+
+    dtype, data_offset, num_frames, channels, rate = header
+    frames = np.frombuffer(p.stdout, dtype=dtype, count=num_frames * channels, offset=data_offset)
+
+    return _toMono(frames.reshape(num_frames, channels)), rate
+
+
+def _readWavHeader(f, file_size: int):
+    """Finds the samples of a 16-bit PCM or 32-bit float WAV file.
+
+    Args:
+        f: The file, at its start.
+        file_size: Size of the file in bytes.
+
+    Returns:
+        The sample dtype, offset of the samples in bytes, number of frames, channels and sample rate,
+        or None if the file is not a 16-bit PCM or 32-bit float WAV file.
+    """
+    try:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+
+        if riff != b"RIFF" or wave != b"WAVE":
+            return None
+
+        fmt = None
+
+        # Find the format and the data chunk
+        while True:
+            header = f.read(8)
+
+            if len(header) < 8:
+                return None
+
+            chunk_id, size = struct.unpack("<4sI", header)
+
+            if chunk_id == b"fmt ":
+                fmt = f.read(size + (size & 1))
+            elif chunk_id == b"data":
+                data_offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+
+        if fmt is None or len(fmt) < 16:
+            return None
+
+        tag, channels, rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+
+        # WAVE_FORMAT_EXTENSIBLE stores the format tag in the sub format
+        if tag == 0xFFFE and len(fmt) >= 26:
+            tag = struct.unpack("<H", fmt[24:26])[0]
+
+        if (tag, bits) == (1, 16):
+            dtype = "<i2"
+        elif (tag, bits) == (3, 32):
+            dtype = "<f4"
+        else:
+            return None
+
+        # The size in the header can be missing for files that were written as a stream
+        size = min(size, file_size - data_offset)
+        num_frames = size // block_align
+
+        if num_frames == 0 or block_align != channels * bits // 8:
+            return None
+
+        return dtype, data_offset, num_frames, channels, rate
+
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _mapWavFile(path: str):
+    """Maps the samples of an uncompressed WAV file into memory.
+
+    Args:
+        path: Path to the audio file.
+
+    Returns:
+        The frames as memory map with shape (frames, channels) and the sample rate,
+        or None if the file is not a 16-bit PCM or 32-bit float WAV file.
+    """
+    if not path.lower().endswith(".wav"):
+        return None
+
+    try:
+        with open(path, "rb") as f:
+            header = _readWavHeader(f, os.path.getsize(path))
+
+        if header is None:
+            return None
+
+        dtype, data_offset, num_frames, channels, rate = header
+
+        return np.memmap(path, dtype=dtype, mode="r", offset=data_offset, shape=(num_frames, channels)), rate
+
+    except (OSError, ValueError):
+        return None
+
+
+def _toMono(frames: np.ndarray):
+    """Converts frames to a mono float32 signal like soundfile and librosa do.
+
+    Args:
+        frames: The frames with shape (frames, channels), float32 or 16-bit PCM.
+
+    Returns:
+        The mono signal, a view of the frames if they are float32 mono.
+    """
+    if frames.dtype != np.float32:
+        # Same scaling as libsndfile
+        frames = frames.astype("float32") * np.float32(1.0 / 32768)
+
+    if frames.shape[1] > 1:
+        return frames.mean(axis=1)
+
+    return frames[:, 0]
+
+
+def resample(sig: np.ndarray, orig_sr: int, target_sr: int, res_type=None):
+    """Resamples a signal.
+
+    Args:
+        sig: The signal.
+        orig_sr: The original sample rate.
+        target_sr: The target sample rate.
+        res_type: The resampler, defaults to cfg.RESAMPLE_TYPE.
+                  'polyphase' uses scipy's resample_poly, other values are passed to librosa.
+
+    Returns:
+        The float32 signal at the target rate, the signal itself if the rates match.
+    """
+    if orig_sr == target_sr:
+        return sig
+
+    if res_type is None:
+        res_type = cfg.RESAMPLE_TYPE
+
+    if res_type == "polyphase":
+        from scipy.signal import resample_poly
+
+        gcd = math.gcd(orig_sr, target_sr)
+
+        return resample_poly(sig, target_sr // gcd, orig_sr // gcd).astype("float32")
+
     import librosa
 
-    return int(librosa.get_duration(filename=path, sr=sample_rate))
+    return librosa.resample(sig, orig_sr=orig_sr, target_sr=target_sr, res_type=res_type).astype("float32")
+
+
+def streamAudioFile(path: str, sample_rate=48000, block_duration=600, fmin=None, fmax=None, offset=0.0, duration=None):
+    """Decodes an audio file block by block.
+
+    The file is opened and decoded exactly once. Each block is downmixed to mono,
+    resampled and bandpass filtered. Resampler and filter state are carried across
+    block boundaries, so the concatenated blocks match the signal of a single
+    decode of the whole file.
+
+    With an offset or duration only that part of the file is returned. It is decoded
+    with a few seconds of margin on both sides, so resampler and filter have settled
+    and the samples match the same part of the whole-file decode.
+
+    Args:
+        path: Path to the audio file.
+        sample_rate: The sample rate at which the file should be processed.
+        block_duration: Approximate duration of each block in seconds.
+        fmin: Minimum frequency for the bandpass filter.
+        fmax: Maximum frequency for the bandpass filter.
+        offset: The starting offset in seconds.
+        duration: Maximum duration in seconds, None to decode until the end.
+
+    Yields:
+        The processed audio signal, one block at a time.
+    """
+    skip, length = 0, None
+
+    if offset > 0 or duration is not None:
+        rate = get_sample_rate(path)
+        gcd = math.gcd(rate, sample_rate)
+        up, down = sample_rate // gcd, rate // gcd
+        margin = int(_SEEK_MARGIN * sample_rate)
+
+        # Start on a sample that exists in both rates, so the output grid is the same
+        start = int(round(offset * sample_rate))
+        first = max(0, start - margin) // up
+        skip = start - first * up
+        start_frame = first * down
+
+        if duration is not None:
+            length = int(round(duration * sample_rate))
+            stop_frame = -(-(start + length + margin) // up) * down
+        else:
+            stop_frame = None
+
+        blocks, rate = _decodeAudioStream(path, block_duration, start_frame, stop_frame)
+    else:
+        blocks, rate = _decodeAudioStream(path, block_duration)
+
+    if rate != sample_rate:
+        blocks = _resampleStream(blocks, rate, sample_rate)
+
+    if fmin != None and fmax != None:
+        blocks = _bandpassStream(blocks, sample_rate, fmin, fmax)
+
+    if skip or length is not None:
+        blocks = _trimStream(blocks, skip, length)
+
+    for block in blocks:
+        if len(block) > 0:
+            yield block
+
+
+# Seconds decoded before and after a part of a file, see streamAudioFile
+_SEEK_MARGIN = 5.0
+
+
+def _decodeAudioStream(path: str, block_duration, start_frame=0, stop_frame=None):
+    """Opens a decoder for the given file.
+
+    16-bit PCM and float WAV files are memory-mapped, other formats use soundfile
+    if libsndfile can read them and fall back to audioread (ffmpeg, gstreamer or CoreAudio) otherwise.
+
+    Args:
+        path: Path to the audio file.
+        block_duration: Approximate duration of each decoded block in seconds.
+        start_frame: First frame to decode.
+        stop_frame: Frame to stop at, None to decode until the end.
+
+    Returns:
+        A tuple of (generator of mono float32 blocks at the native rate, native sample rate).
+    """
+    import soundfile as sf
+
+    mapped = _mapWavFile(path)
+
+    if mapped is not None:
+        frames, rate = mapped
+        stop = len(frames) if stop_frame is None else min(stop_frame, len(frames))
+        block_frames = int(block_duration * rate)
+
+        def _blocks():
+            for pos in range(min(start_frame, stop), stop, block_frames):
+                yield _toMono(frames[pos : min(pos + block_frames, stop)])
+
+        return _blocks(), rate
+
+    try:
+        sfile = sf.SoundFile(path)
+    except Exception:
+        sfile = None
+
+    if sfile is not None:
+
+        def _blocks():
+            with sfile:
+                if start_frame > 0:
+                    sfile.seek(min(start_frame, sfile.frames))
+
+                frames = -1 if stop_frame is None else max(0, stop_frame - sfile.tell())
+
+                for block in sfile.blocks(
+                    blocksize=int(block_duration * sfile.samplerate), frames=frames, dtype="float32", always_2d=True
+                ):
+                    yield block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+
+        return _blocks(), sfile.samplerate
+
+    import audioread
+    from librosa.util import buf_to_float
+
+    afile = audioread.audio_open(path)
+    block_frames = int(block_duration * afile.samplerate)
+
+    def _blocks():
+        with afile:
+            pending = []
+            num_frames = 0
+            position = 0
+
+            for buf in afile:
+                frame = buf_to_float(buf, dtype=np.float32)
+
+                if afile.channels > 1:
+                    frame = frame.reshape((-1, afile.channels)).mean(axis=1)
+
+                # audioread cannot seek, so frames before the start are decoded and dropped
+                first = max(0, start_frame - position)
+                last = len(frame) if stop_frame is None else max(0, min(len(frame), stop_frame - position))
+                position += len(frame)
+
+                if first < last:
+                    pending.append(frame[first:last])
+                    num_frames += last - first
+
+                if num_frames >= block_frames:
+                    yield np.concatenate(pending)
+                    pending = []
+                    num_frames = 0
+
+                if stop_frame is not None and position >= stop_frame:
+                    break
+
+            if pending:
+                yield np.concatenate(pending)
+
+    return _blocks(), afile.samplerate
+
+
+def _trimStream(blocks, skip, length=None):
+    """Drops samples at the start of a stream and limits its length.
+
+    Args:
+        blocks: Iterable of signal blocks.
+        skip: Number of samples to drop.
+        length: Number of samples to keep, None to keep all.
+
+    Yields:
+        The trimmed blocks.
+    """
+    for block in blocks:
+        if skip >= len(block):
+            skip -= len(block)
+            continue
+
+        block = block[skip:]
+        skip = 0
+
+        if length is not None:
+            block = block[:length]
+            length -= len(block)
+
+        yield block
+
+        if length == 0:
+            break
+
+
+def _resampleStream(blocks, orig_sr: int, target_sr: int):
+    """Resamples a stream of blocks.
+
+    Every block is resampled together with a bit of context from its neighbours,
+    so there are no edge artifacts at the block boundaries. The output lags one
+    context length behind the input, the rest is flushed with the last block.
+
+    Args:
+        blocks: Iterable of signal blocks at the original rate.
+        orig_sr: The original sample rate.
+        target_sr: The target sample rate.
+
+    Yields:
+        The resampled blocks.
+    """
+    # Block boundaries must fall on samples that exist in both rates
+    gcd = math.gcd(orig_sr, target_sr)
+    up, down = target_sr // gcd, orig_sr // gcd
+    context = math.ceil(256 * max(1, orig_sr / target_sr) / down) * down
+
+    pending = np.zeros(0, dtype="float32")
+    left = 0
+
+    for block in blocks:
+        pending = np.concatenate((pending, block))
+        end = (len(pending) - context) // down * down
+
+        if end <= left:
+            continue
+
+        y = resample(pending[: end + context], orig_sr, target_sr)
+
+        yield y[left // down * up : end // down * up]
+
+        # Keep the overlap as left context for the next block
+        pending = pending[end - context :]
+        left = context
+
+    if len(pending) > left:
+        y = resample(pending, orig_sr, target_sr)
+
+        # Trim rounding excess, the output length is ceil(n * target_sr / orig_sr)
+        yield y[left // down * up : -(-len(pending) * up // down)]
+
+
+def _bandpassStream(blocks, rate, fmin, fmax, order=5):
+    """Applies the bandpass filter to a stream of blocks.
+
+    The filter state is carried from one block to the next.
+
+    Args:
+        blocks: Iterable of signal blocks.
+        rate: The sample rate.
+        fmin: Minimum frequency.
+        fmax: Maximum frequency.
+        order: The filter order.
+
+    Yields:
+        The filtered blocks.
+    """
+    sos = _bandpassSOS(rate, fmin, fmax, order)
+
+    if sos is None:
+        yield from blocks
+        return
+
+    from scipy.signal import sosfilt
+
+    zi = np.zeros((len(sos), 2), dtype="float32")
+
+    for block in blocks:
+        sig, zi = sosfilt(sos, np.asarray(block, dtype="float32"), zi=zi)
+
+        yield sig
+
+
+def getAudioFileLength(path, sample_rate=48000):    
+    
+    # Read the header once, see metadata.getAudioInfo
+    return int(metadata.getAudioInfo(path)["duration"])
 
 def get_sample_rate(path: str):
-    import librosa
-    return librosa.get_samplerate(path)
+    return metadata.getAudioInfo(path)["sample_rate"]
 
 
 def saveSignal(sig, fname: str):
@@ -94,6 +631,27 @@ def pad(sig, seconds, srate, amount=None):
     return sig
 
 
+def windowView(sig, rate, seconds, overlap):
+    """Returns the complete windows of a signal without copying it.
+
+    Args:
+        sig: The signal.
+        rate: The sampling rate.
+        seconds: The duration of a window.
+        overlap: The overlapping seconds of windows.
+
+    Returns:
+        A read-only strided view with shape (windows, samples per window).
+    """
+    seg_len = int(seconds * rate)
+    step = int((seconds - overlap) * rate)
+
+    if len(sig) < seg_len:
+        return np.zeros((0, seg_len), dtype=sig.dtype)
+
+    return np.lib.stride_tricks.sliding_window_view(sig, seg_len)[::step]
+
+
 def splitSignal(sig, rate, seconds, overlap, minlen):
     """Split signal with overlap.
 
@@ -105,22 +663,127 @@ def splitSignal(sig, rate, seconds, overlap, minlen):
         minlen: Minimum length of a split.
     
     Returns:
-        A list of splits.
+        The splits with shape (splits, samples per split). If no split has to be padded,
+        this is a view of the signal, otherwise the splits are copied once.
     """
-    sig_splits = []
+    groups, remainder = splitSignalBlock(np.zeros(0, dtype=sig.dtype), sig, rate, seconds, overlap)
+    tail = splitSignalTail(remainder, rate, seconds, overlap, minlen, sum(len(g) for g in groups) > 0)
+
+    if len(tail) == 0 and len(groups) == 1:
+        return groups[0]
 
-    for i in range(0, len(sig), int((seconds - overlap) * rate)):
-        split = sig[i : i + int(seconds * rate)]
+    return np.concatenate(groups + [tail])
+
+
+def splitSignalStream(blocks, rate, seconds, overlap, minlen):
+    """Split a stream of signal blocks with overlap.
+
+    Works like splitSignal, but segments continue seamlessly across
+    block boundaries, so the whole stream is split on one grid.
+
+    Args:
+        blocks: Iterable of signal blocks.
+        rate: The sampling rate.
+        seconds: The duration of a segment.
+        overlap: The overlapping seconds of segments.
+        minlen: Minimum length of a split.
+
+    Yields:
+        The splits.
+    """
+    buffer = np.zeros(0, dtype="float32")
+    has_splits = False
+
+    for block in blocks:
+        groups, buffer = splitSignalBlock(buffer, block, rate, seconds, overlap)
+
+        for splits in groups:
+            has_splits = has_splits or len(splits) > 0
+
+            yield from splits
+
+    yield from splitSignalTail(buffer, rate, seconds, overlap, minlen, has_splits)
+
+
+def splitSignalBlock(buffer, block, rate, seconds, overlap):
+    """Splits the complete segments of the next block of a stream.
+
+    Can be used instead of splitSignalStream when the blocks are pushed
+    by another thread, the caller keeps the remainder between the blocks.
+    Only the few segments that start in the remainder are copied,
+    the segments that start in the block are views of it.
+
+    Args:
+        buffer: The remainder of the previous blocks.
+        block: The next signal block.
+        rate: The sampling rate.
+        seconds: The duration of a segment.
+        overlap: The overlapping seconds of segments.
+
+    Returns:
+        A list of arrays with shape (splits, samples per split), in stream order,
+        and the remainder for the next block.
+    """
+    seg_len = int(seconds * rate)
+    step = int((seconds - overlap) * rate)
+    total = len(buffer) + len(block)
+
+    # Number of complete segments and the start of the next one
+    num_splits = max(0, (total - seg_len) // step + 1)
+    next_start = num_splits * step
+
+    # Segments that start in the remainder
+    num_head = min(num_splits, -(-len(buffer) // step))
+    groups = []
+
+    if num_head > 0:
+        head = np.concatenate((buffer, block[: max(0, (num_head - 1) * step + seg_len - len(buffer))]))
+        groups.append(windowView(head, rate, seconds, overlap)[:num_head])
+
+    # Segments that start in the block
+    if num_splits > num_head:
+        offset = num_head * step - len(buffer)
+        groups.append(windowView(block[offset:], rate, seconds, overlap)[: num_splits - num_head])
+
+    if next_start >= len(buffer):
+        remainder = block[next_start - len(buffer) :]
+    else:
+        remainder = np.concatenate((buffer[next_start:], block))
+
+    return groups, remainder
+
+
+def splitSignalTail(buffer, rate, seconds, overlap, minlen, has_splits):
+    """Splits the remainder at the end of a stream.
+
+    Args:
+        buffer: The remainder of the last block, see splitSignalBlock.
+        rate: The sampling rate.
+        seconds: The duration of a segment.
+        overlap: The overlapping seconds of segments.
+        minlen: Minimum length of a split.
+        has_splits: Whether the stream already had splits.
+
+    Returns:
+        The padded splits with shape (splits, samples per split).
+    """
+    seg_len = int(seconds * rate)
+    step = int((seconds - overlap) * rate)
+    splits = []
+
+    for pos in range(0, len(buffer), step):
+        split = buffer[pos : pos + seg_len]
 
         # End of signal?
-        if len(split) < int(minlen * rate) and len(sig_splits) > 0:
+        if len(split) < int(minlen * rate) and (has_splits or splits):
             break
 
-        split = pad(split, seconds, rate, 0.5)
+        splits.append(pad(split, seconds, rate, 0.5))
 
-        sig_splits.append(split)
+    if not splits:
+        return np.zeros((0, seg_len), dtype="float32")
 
-    return sig_splits
+    return np.array(splits, dtype="float32")
 
 
 def cropCenter(sig, rate, seconds):
@@ -142,38 +805,89 @@ def cropCenter(sig, rate, seconds):
 
     return sig
 
-def bandpass(sig, rate, fmin, fmax, order=5):
 
+def windowLevels(windows: np.ndarray):
+    """Computes the RMS level of each window.
+
+    The windows are already bandpass filtered, so this is the energy
+    in the analyzed frequency band.
+
+    Args:
+        windows: The windows with shape (windows, samples).
+
+    Returns:
+        The level of each window in dBFS, -inf for digital silence.
+    """
+    # Sum of squares per row without a squared copy of the batch
+    power = np.einsum("ij,ij->i", windows, windows, dtype="float64") / max(1, windows.shape[1])
+
+    with np.errstate(divide="ignore"):
+        return 10 * np.log10(power)
+
+
+# FIR filters with more taps are applied with FFT overlap-add instead of lfilter
+FIR_FFT_TAPS = 64
+
+
+@functools.lru_cache(maxsize=32)
+def _bandpassSOS(rate, fmin, fmax, order=5):
+    """Designs the Butterworth filter used by the bandpass.
+
+    The design is cached, streams and repeated calls with the same settings reuse it.
+
+    Args:
+        rate: The sample rate.
+        fmin: Minimum frequency.
+        fmax: Maximum frequency.
+        order: The filter order.
+
+    Returns:
+        The float32 second-order sections or None if no filtering is needed.
+    """
     # Check if we have to bandpass at all
     if fmin == cfg.SIG_FMIN and fmax == cfg.SIG_FMAX or fmin > fmax:
-        return sig
+        return None
 
-    from scipy.signal import butter, lfilter
+    from scipy.signal import butter
     nyquist = 0.5 * rate
 
     # Highpass?
     if fmin > cfg.SIG_FMIN and fmax == cfg.SIG_FMAX:  
         
         low = fmin / nyquist
-        b, a = butter(order, low, btype="high")
-        sig = lfilter(b, a, sig)
+        sos = butter(order, low, btype="high", output="sos")
 
     # Lowpass?
     elif fmin == cfg.SIG_FMIN and fmax < cfg.SIG_FMAX:
 
         high = fmax / nyquist
-        b, a = butter(order, high, btype="low")
-        sig = lfilter(b, a, sig)
+        sos = butter(order, high, btype="low", output="sos")
 
     # Bandpass?
     elif fmin > cfg.SIG_FMIN and fmax < cfg.SIG_FMAX:
 
         low = fmin / nyquist
         high = fmax / nyquist
-        b, a = butter(order, [low, high], btype="band")
-        sig = lfilter(b, a, sig)
+        sos = butter(order, [low, high], btype="band", output="sos")
+
+    else:
+        return None
+
+    sos = sos.astype("float32")
+
+    return sos
+
+def bandpass(sig, rate, fmin, fmax, order=5):
+
+    sos = _bandpassSOS(rate, fmin, fmax, order)
+
+    # Check if we have to bandpass at all
+    if sos is None:
+        return sig
+
+    from scipy.signal import sosfilt
 
-    return sig.astype("float32")
+    return sosfilt(sos, np.asarray(sig, dtype="float32"))
 
 # Raven is using Kaiser window FIR filter, so we try to emulate it.
 # Raven uses the Window method for FIR filter design. 
@@ -181,13 +895,20 @@ def bandpass(sig, rate, fmin, fmax, order=5):
 # the Nyquist frequency and a default stop band attenuation of 100 dB. 
 # For a complete description of this method, see Discrete-Time Signal Processing 
 # (Second Edition), by Alan Oppenheim, Ronald Schafer, and John Buck, Prentice Hall 1998, pp. 474-476.
-def bandpassKaiserFIR(sig, rate, fmin, fmax, width=0.02, stopband_attenuation_db=100):
+@functools.lru_cache(maxsize=32)
+def _kaiserTaps(rate, fmin, fmax, width=0.02, stopband_attenuation_db=100):
+    """Designs the Kaiser window FIR filter used by bandpassKaiserFIR.
 
+    The design is cached like the Butterworth filter.
+
+    Returns:
+        The float32 filter taps or None if no filtering is needed.
+    """
     # Check if we have to bandpass at all
     if fmin == cfg.SIG_FMIN and fmax == cfg.SIG_FMAX or fmin > fmax:
-        return sig
+        return None
 
-    from scipy.signal import kaiserord, firwin, lfilter
+    from scipy.signal import kaiserord, firwin
     nyquist = 0.5 * rate
 
     # Calculate the order and Kaiser parameter for the desired specifications.
@@ -209,9 +930,50 @@ def bandpassKaiserFIR(sig, rate, fmin, fmax, width=0.02, stopband_attenuation_db
         high = fmax / nyquist
         taps = firwin(N, [low, high], window=('kaiser', beta), pass_zero=False)
 
-    # Apply the filter to the signal.
-    sig = lfilter(taps, 1.0, sig)
+    else:
+        return None
+
+    taps = taps.astype("float32")
 
-    return sig.astype("float32")
+    return taps
 
+def firFilter(sig, taps, history=None):
+    """Applies a causal FIR filter like lfilter(taps, 1.0, sig).
 
+    Long filters are applied with FFT overlap-add. The last input samples are
+    returned, so a stream can be filtered block by block without edge effects.
+
+    Args:
+        sig: The signal block.
+        taps: The filter taps.
+        history: The last len(taps) - 1 input samples of the previous block, zeros if None.
+
+    Returns:
+        The filtered float32 block and the history for the next block.
+    """
+    from scipy.signal import lfilter, oaconvolve
+
+    sig = np.asarray(sig, dtype="float32")
+
+    if history is None:
+        history = np.zeros(len(taps) - 1, dtype="float32")
+
+    x = np.concatenate((history, sig))
+
+    if len(taps) > FIR_FFT_TAPS:
+        y = oaconvolve(x, taps, mode="valid")
+    else:
+        y = lfilter(taps, 1.0, x)[len(history) :]
+
+    return y.astype("float32"), x[len(x) - len(history) :]
+
+def bandpassKaiserFIR(sig, rate, fmin, fmax, width=0.02, stopband_attenuation_db=100):
+
+    taps = _kaiserTaps(rate, fmin, fmax, width, stopband_attenuation_db)
+
+    # Check if we have to bandpass at all
+    if taps is None:
+        return sig
+
+    # Apply the filter to the signal.
+    return firFilter(sig, taps)[0]
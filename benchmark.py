@@ -0,0 +1,601 @@
+"""Module with performance benchmarks.
+
+Can be used to measure the speed of individual parts of the analysis.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import audio
+import config as cfg
+
+
+def makeTestRecording(path: str, seconds: int, rate=44100, fmt=None):
+    """Writes a synthetic noise recording.
+
+    The signal is written in one-minute blocks, so long recordings do not have to fit into memory.
+
+    Args:
+        path: The file path.
+        seconds: Length of the recording in seconds.
+        rate: The sample rate of the recording.
+        fmt: The soundfile format, e.g. 'WAV', 'FLAC' or 'MP3'. Derived from the extension if None.
+    """
+    import soundfile as sf
+
+    rng = np.random.default_rng(cfg.RANDOM_SEED)
+
+    with sf.SoundFile(path, "w", samplerate=rate, channels=1, format=fmt) as f:
+        for offset in range(0, seconds, 60):
+            f.write((rng.standard_normal(rate * min(60, seconds - offset)) * 0.1).astype("float32"))
+
+
+def _bandpassBlockwise(sig, rate: int, fmin: int, fmax: int, order=5):
+    """Filters a signal the way audio.bandpass did before streaming.
+
+    The Butterworth filter is designed again for every call and applied as transfer function.
+
+    Args:
+        sig: The signal.
+        rate: The sample rate.
+        fmin: Minimum frequency.
+        fmax: Maximum frequency.
+        order: The filter order.
+
+    Returns:
+        The filtered signal.
+    """
+    from scipy.signal import butter, lfilter
+
+    # Check if we have to bandpass at all
+    if fmin == cfg.SIG_FMIN and fmax == cfg.SIG_FMAX or fmin > fmax:
+        return sig
+
+    nyquist = 0.5 * rate
+
+    if fmin > cfg.SIG_FMIN and fmax == cfg.SIG_FMAX:
+        b, a = butter(order, fmin / nyquist, btype="high")
+    elif fmin == cfg.SIG_FMIN and fmax < cfg.SIG_FMAX:
+        b, a = butter(order, fmax / nyquist, btype="low")
+    else:
+        b, a = butter(order, [fmin / nyquist, fmax / nyquist], btype="band")
+
+    return lfilter(b, a, sig)
+
+
+def _decodeBlockwise(path: str, block_duration: int):
+    """Decodes a file the way analyzeFile did before streaming.
+
+    Every block re-opens the file with librosa, seeks to its offset and is resampled
+    with kaiser_fast and filtered on its own. The old code is kept here, so the
+    baseline doesn't change with audio.openAudioFile.
+
+    Args:
+        path: Path to the audio file.
+        block_duration: Duration of each block in seconds.
+
+    Returns:
+        The number of decoded samples.
+    """
+    import librosa
+
+    num_samples = 0
+    offset = 0
+    duration = audio.getAudioFileLength(path, cfg.SAMPLE_RATE)
+
+    while offset < duration:
+        sig, rate = librosa.load(path, sr=cfg.SAMPLE_RATE, offset=offset, duration=block_duration, mono=True, res_type="kaiser_fast")
+        sig = _bandpassBlockwise(sig, rate, cfg.BANDPASS_FMIN, cfg.BANDPASS_FMAX)
+        num_samples += len(sig)
+        offset += block_duration
+
+    return num_samples
+
+
+def _decodeStreaming(path: str, block_duration: int):
+    """Decodes a file with a single streaming pass.
+
+    Args:
+        path: Path to the audio file.
+        block_duration: Duration of each block in seconds.
+
+    Returns:
+        The number of decoded samples.
+    """
+    return sum(len(b) for b in audio.streamAudioFile(path, cfg.SAMPLE_RATE, block_duration, cfg.BANDPASS_FMIN, cfg.BANDPASS_FMAX))
+
+
+def benchmarkDecoding(lengths: list[int], formats: list[str], block_duration: int):
+    """Compares the decode time of block-wise re-opening and streaming.
+
+    Prints one row per format and recording length.
+
+    Args:
+        lengths: Recording lengths in minutes.
+        formats: File formats to test, e.g. ['wav', 'flac', 'mp3'].
+        block_duration: Duration of each block in seconds.
+    """
+    print(f"{'format':<8}{'minutes':>8}{'blockwise (s)':>16}{'streaming (s)':>16}{'speedup':>10}", flush=True)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for fmt in formats:
+            for minutes in lengths:
+                path = os.path.join(tmpdir, f"test_{minutes}.{fmt}")
+
+                try:
+                    makeTestRecording(path, minutes * 60, fmt=fmt.upper())
+                except Exception as e:
+                    print(f"{fmt:<8}{minutes:>8}  cannot write test file: {e}", flush=True)
+                    continue
+
+                t = time.perf_counter()
+                _decodeBlockwise(path, block_duration)
+                t_blockwise = time.perf_counter() - t
+
+                t = time.perf_counter()
+                _decodeStreaming(path, block_duration)
+                t_streaming = time.perf_counter() - t
+
+                print(f"{fmt:<8}{minutes:>8}{t_blockwise:>16.2f}{t_streaming:>16.2f}{t_blockwise / t_streaming:>9.1f}x", flush=True)
+
+                os.remove(path)
+
+
+def _syntheticScores(num_windows: int, num_classes: int, rng):
+    """Creates sigmoid scores that look like a typical soundscape.
+
+    Most classes score close to zero, only a few per window get high scores.
+
+    Args:
+        num_windows: Number of windows.
+        num_classes: Number of classes.
+        rng: The numpy random generator.
+
+    Returns:
+        The scores with shape (num_windows, num_classes).
+    """
+    import model
+
+    logits = rng.normal(-8.0, 2.5, (num_windows, num_classes)).astype("float32")
+
+    return model.flat_sigmoid(logits).astype("float32")
+
+
+def benchmarkResultStore(hours: float, num_classes: int, batch_size: int, sample_windows: int):
+    """Compares sorted label lists per window with the detection array.
+
+    Both stores are fed the same synthetic score stream for a recording of the given length.
+    The sorted label lists are only measured on a sample of windows and extrapolated,
+    a full day would not fit into memory.
+
+    Args:
+        hours: Length of the simulated recording in hours.
+        num_classes: Number of classes.
+        batch_size: Number of windows per batch.
+        sample_windows: Number of windows used to measure the sorted label lists.
+    """
+    import operator
+    import tracemalloc
+
+    import analyze
+
+    rng = np.random.default_rng(cfg.RANDOM_SEED)
+    num_windows = int(hours * 3600 / (cfg.SIG_LENGTH - cfg.SIG_OVERLAP))
+    labels = [f"Species{i}_Common {i}" for i in range(num_classes)]
+    batch = _syntheticScores(batch_size, num_classes, rng)
+    timestamps = np.array([[i * cfg.SIG_LENGTH, (i + 1) * cfg.SIG_LENGTH] for i in range(batch_size)], dtype="float64")
+
+    # Sorted label lists per window
+    tracemalloc.start()
+    t = time.perf_counter()
+    results = {}
+
+    for i in range(sample_windows):
+        results[str(i)] = sorted(zip(labels, batch[i % batch_size]), key=operator.itemgetter(1), reverse=True)
+
+    t_sorted = (time.perf_counter() - t) * num_windows / sample_windows
+    m_sorted = tracemalloc.get_traced_memory()[0] * num_windows / sample_windows
+    tracemalloc.stop()
+    del results
+
+    # Detection array
+    tracemalloc.start()
+    t = time.perf_counter()
+    detections = []
+
+    for _ in range(0, num_windows, batch_size):
+        detections.append(analyze.extractDetections(batch, timestamps))
+
+    detections = np.concatenate(detections)
+    t_array = time.perf_counter() - t
+    m_array = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f"{num_windows} windows x {num_classes} classes, min_conf {cfg.MIN_CONFIDENCE}, {len(detections)} detections", flush=True)
+    print(f"{'store':<24}{'time (s)':>12}{'memory (MB)':>14}", flush=True)
+    print(f"{'sorted label lists':<24}{t_sorted:>12.2f}{m_sorted / 1e6:>14.1f}  (extrapolated from {sample_windows} windows)", flush=True)
+    print(f"{'detection array':<24}{t_array:>12.2f}{m_array / 1e6:>14.1f}", flush=True)
+
+
+def benchmarkAllocation(batch_size: int, iterations: int):
+    """Measures the tensor allocation cost that the interpreter cache removes.
+
+    Alternates full batches with a partial batch, like the last batch of every file.
+    Once the tensors are reallocated on every call, like model.predict used to do,
+    and once the interpreters come from model.getAllocatedInterpreter.
+
+    Args:
+        batch_size: The full batch size, the partial batch has half the size.
+        iterations: Number of calls.
+    """
+    import model
+
+    model.loadModel()
+
+    full = np.zeros((batch_size, int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE)), dtype="float32")
+    shapes = [list(full.shape), [max(1, batch_size // 2), full.shape[1]]]
+
+    # Resize and allocate on every call
+    t = time.perf_counter()
+
+    for i in range(iterations):
+        model.INTERPRETER.resize_tensor_input(model.INPUT_LAYER_INDEX, shapes[i % 2])
+        model.INTERPRETER.allocate_tensors()
+
+    t_realloc = time.perf_counter() - t
+
+    # Interpreter cache
+    t = time.perf_counter()
+
+    for i in range(iterations):
+        model.getAllocatedInterpreter(model.INTERPRETER_CACHE, cfg.MODEL_PATH, model.INPUT_LAYER_INDEX, shapes[i % 2])
+
+    t_cached = time.perf_counter() - t
+
+    # Inference for reference
+    t = time.perf_counter()
+
+    for i in range(iterations):
+        model.predict(full[: shapes[i % 2][0]])
+
+    t_predict = time.perf_counter() - t
+
+    print(f"batch size {batch_size}/{shapes[1][0]}, {iterations} calls", flush=True)
+    print(f"{'':<28}{'ms per call':>12}", flush=True)
+    print(f"{'resize + allocate':<28}{t_realloc / iterations * 1000:>12.2f}", flush=True)
+    print(f"{'interpreter cache':<28}{t_cached / iterations * 1000:>12.2f}", flush=True)
+    print(f"{'predict (cached)':<28}{t_predict / iterations * 1000:>12.2f}", flush=True)
+
+
+def benchmarkReading(minutes: int, formats: list[str]):
+    """Compares librosa.load with the native-rate reader of audio.openAudioFile.
+
+    Prints one row per test file: 48 kHz and 44.1 kHz recordings in each format,
+    the 44.1 kHz files with both resamplers.
+
+    Args:
+        minutes: Length of the recordings in minutes.
+        formats: File formats to test, e.g. ['wav', 'flac', 'mp3'].
+    """
+    import librosa
+
+    # Compile the resampler first, so the first file is not slower
+    librosa.resample(np.zeros(44100, dtype="float32"), orig_sr=44100, target_sr=cfg.SAMPLE_RATE, res_type="kaiser_fast")
+
+    print(f"{'file':<18}{'librosa (s)':>14}{'kaiser_fast (s)':>17}{'polyphase (s)':>15}{'speedup':>10}", flush=True)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for fmt in formats:
+            for rate in [48000, 44100]:
+                name = f"{fmt} {rate / 1000:g} kHz"
+                path = os.path.join(tmpdir, f"test_{rate}.{fmt}")
+
+                try:
+                    makeTestRecording(path, minutes * 60, rate, fmt=fmt.upper())
+                except Exception as e:
+                    print(f"{name:<18}  cannot write test file: {e}", flush=True)
+                    continue
+
+                t = time.perf_counter()
+                librosa.load(path, sr=cfg.SAMPLE_RATE, mono=True, res_type="kaiser_fast")
+                t_librosa = time.perf_counter() - t
+
+                timings = []
+
+                for res_type in ["kaiser_fast", "polyphase"]:
+                    cfg.RESAMPLE_TYPE = res_type
+                    t = time.perf_counter()
+                    audio.openAudioFile(path, cfg.SAMPLE_RATE)
+                    timings.append(time.perf_counter() - t)
+
+                print(f"{name:<18}{t_librosa:>14.2f}{timings[0]:>17.2f}{timings[1]:>15.2f}{t_librosa / min(timings):>9.1f}x", flush=True)
+
+                os.remove(path)
+
+
+def _bandpassLegacy(sig, rate, fmin, fmax, fir=False):
+    """Filters a block the way audio.bandpass did before the filter cache.
+
+    The filter is designed on every call and applied with lfilter in float64.
+
+    Args:
+        sig: The signal block.
+        rate: The sample rate.
+        fmin: Minimum frequency.
+        fmax: Maximum frequency.
+        fir: Use the Kaiser window FIR filter instead of the Butterworth filter.
+
+    Returns:
+        The filtered block.
+    """
+    from scipy.signal import butter, firwin, kaiserord, lfilter
+
+    nyquist = 0.5 * rate
+
+    if fir:
+        N, beta = kaiserord(100, 0.02)
+        taps = firwin(N, [fmin / nyquist, fmax / nyquist], window=("kaiser", beta), pass_zero=False)
+
+        return lfilter(taps, 1.0, sig).astype("float32")
+
+    b, a = butter(5, [fmin / nyquist, fmax / nyquist], btype="band")
+
+    return lfilter(b, a, sig).astype("float32")
+
+
+def benchmarkFiltering(minutes: int, repeats: int, fmin: int, fmax: int):
+    """Compares the previous bandpass filters with the cached float32 filters.
+
+    Each filter is applied to the same block a few times, like the blocks of a long recording.
+
+    Args:
+        minutes: Length of a block in minutes.
+        repeats: Number of blocks.
+        fmin: Minimum frequency of the bandpass.
+        fmax: Maximum frequency of the bandpass.
+    """
+    rng = np.random.default_rng(cfg.RANDOM_SEED)
+    sig = (rng.standard_normal(minutes * 60 * cfg.SAMPLE_RATE) * 0.1).astype("float32")
+
+    print(f"{repeats} blocks of {minutes} minutes, bandpass {fmin}-{fmax} Hz", flush=True)
+    print(f"{'filter':<14}{'previous (s)':>14}{'cached (s)':>12}{'speedup':>10}{'max diff':>12}", flush=True)
+
+    for name, fir in [("butterworth", False), ("kaiser fir", True)]:
+        t = time.perf_counter()
+
+        for _ in range(repeats):
+            y_old = _bandpassLegacy(sig, cfg.SAMPLE_RATE, fmin, fmax, fir)
+
+        t_old = time.perf_counter() - t
+        t = time.perf_counter()
+
+        for _ in range(repeats):
+            if fir:
+                y_new = audio.bandpassKaiserFIR(sig, cfg.SAMPLE_RATE, fmin, fmax)
+            else:
+                y_new = audio.bandpass(sig, cfg.SAMPLE_RATE, fmin, fmax)
+
+        t_new = time.perf_counter() - t
+
+        print(f"{name:<14}{t_old:>14.2f}{t_new:>12.2f}{t_old / t_new:>9.1f}x{np.abs(y_old - y_new).max():>12.2e}", flush=True)
+
+
+def _batchesFromLists(sig: np.ndarray, batch_size: int):
+    """Batches the windows of a signal the way the analysis did before the strided views.
+
+    The windows are sliced in a Python loop and collected in a list, the batch is copied
+    into a new array and model.predict copied it once more.
+
+    Args:
+        sig: The signal.
+        batch_size: Number of windows per batch.
+
+    Returns:
+        The number of windows.
+    """
+    seg_len = int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE)
+    step = int((cfg.SIG_LENGTH - cfg.SIG_OVERLAP) * cfg.SAMPLE_RATE)
+    samples = []
+    num_windows = 0
+
+    for i in range(0, len(sig), step):
+        split = sig[i : i + seg_len]
+
+        if len(split) < int(cfg.SIG_MINLEN * cfg.SAMPLE_RATE) and num_windows > 0:
+            break
+
+        samples.append(audio.pad(split, cfg.SIG_LENGTH, cfg.SAMPLE_RATE, 0.5))
+        num_windows += 1
+
+        if len(samples) == batch_size:
+            np.array(np.array(samples, dtype="float32"), dtype="float32")
+            samples = []
+
+    if samples:
+        np.array(np.array(samples, dtype="float32"), dtype="float32")
+
+    return num_windows
+
+
+def _batchesFromViews(sig: np.ndarray, batch_size: int):
+    """Batches the windows of a signal with strided views and a reused batch buffer.
+
+    Args:
+        sig: The signal.
+        batch_size: Number of windows per batch.
+
+    Returns:
+        The number of windows.
+    """
+    batch = np.empty((batch_size, int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE)), dtype="float32")
+    groups, remainder = audio.splitSignalBlock(np.zeros(0, dtype="float32"), sig, cfg.SAMPLE_RATE, cfg.SIG_LENGTH, cfg.SIG_OVERLAP)
+    groups.append(audio.splitSignalTail(remainder, cfg.SAMPLE_RATE, cfg.SIG_LENGTH, cfg.SIG_OVERLAP, cfg.SIG_MINLEN, len(groups) > 0))
+    num_windows = 0
+
+    for windows in groups:
+        for i in range(0, len(windows), batch_size):
+            n = len(windows[i : i + batch_size])
+            batch[:n] = windows[i : i + n]
+            np.ascontiguousarray(batch[:n], dtype="float32")
+            num_windows += n
+
+    return num_windows
+
+
+def benchmarkWindowing(minutes: int, overlaps: list[float], batch_size: int):
+    """Compares list-based windowing with strided views written into a batch buffer.
+
+    Both feed the batches up to the point where model.predict hands them to the interpreter.
+
+    Args:
+        minutes: Length of the synthetic signal in minutes.
+        overlaps: Window overlaps in seconds.
+        batch_size: Number of windows per batch.
+    """
+    import tracemalloc
+
+    rng = np.random.default_rng(cfg.RANDOM_SEED)
+    sig = (rng.standard_normal(minutes * 60 * cfg.SAMPLE_RATE) * 0.1).astype("float32")
+    seg_bytes = int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE) * 4
+
+    print(f"{minutes} minutes, batch size {batch_size}", flush=True)
+    print(f"{'overlap':>8}{'windows':>10}{'lists (s)':>12}{'views (s)':>12}{'speedup':>10}{'lists peak (MB)':>18}{'views peak (MB)':>18}", flush=True)
+
+    for overlap in overlaps:
+        cfg.SIG_OVERLAP = overlap
+        results = []
+
+        for fn in [_batchesFromLists, _batchesFromViews]:
+            tracemalloc.start()
+            t = time.perf_counter()
+            num_windows = fn(sig, batch_size)
+            results.append((time.perf_counter() - t, tracemalloc.get_traced_memory()[1]))
+            tracemalloc.stop()
+
+        (t_lists, m_lists), (t_views, m_views) = results
+        print(
+            f"{overlap:>8.1f}{num_windows:>10}{t_lists:>12.2f}{t_views:>12.2f}{t_lists / t_views:>9.1f}x{m_lists / 1e6:>18.1f}{m_views / 1e6:>18.1f}",
+            flush=True,
+        )
+
+    print(f"(one window is {seg_bytes / 1e3:.0f} kB, the lists copy every window three times, the views once)", flush=True)
+
+
+def benchmarkServer(host: str, port: int, seconds: int, levels: list[int], num_requests: int):
+    """Measures the latency of a running server under concurrent requests.
+
+    Every request uploads the same synthetic recording to /analyze.
+
+    Args:
+        host: Host of the server.
+        port: Port of the server.
+        seconds: Length of the uploaded recording in seconds.
+        levels: Numbers of concurrent clients.
+        num_requests: Requests per level.
+    """
+    import concurrent.futures
+
+    import requests
+
+    url = f"http://{host}:{port}/analyze"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "upload.wav")
+        makeTestRecording(path, seconds)
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+    def send(_):
+        t = time.perf_counter()
+        r = requests.post(url, files={"audio": ("upload.wav", data)}, data={"meta": "{}"}, timeout=600)
+        ok = r.ok and r.json().get("msg") == "success"
+
+        return time.perf_counter() - t, ok
+
+    # The first request may still load lazily
+    send(0)
+
+    print(f"{num_requests} requests of {seconds} s", flush=True)
+    print(f"{'clients':>8}{'p50 (s)':>10}{'p99 (s)':>10}{'max (s)':>10}{'req/s':>10}{'errors':>8}", flush=True)
+
+    for level in levels:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=level) as pool:
+            t = time.perf_counter()
+            results = list(pool.map(send, range(num_requests)))
+            elapsed = time.perf_counter() - t
+
+        latencies = np.array([r[0] for r in results])
+        errors = sum(not r[1] for r in results)
+        p50, p99 = np.percentile(latencies, [50, 99])
+
+        print(
+            f"{level:>8}{p50:>10.3f}{p99:>10.3f}{latencies.max():>10.3f}{num_requests / elapsed:>10.1f}{errors:>8}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Benchmark parts of the BirdNET analysis.")
+    parser.add_argument("--mode", default="decode", help="Benchmark to run. Values in ['decode', 'read', 'filter', 'results', 'allocation', 'windowing', 'server']. Defaults to 'decode'.")
+    parser.add_argument(
+        "--lengths", default="5,15,30,60", help="Comma-separated recording lengths in minutes. Defaults to '5,15,30,60'."
+    )
+    parser.add_argument(
+        "--formats", default="wav,flac,mp3", help="Comma-separated file formats. Defaults to 'wav,flac,mp3'."
+    )
+    parser.add_argument(
+        "--block",
+        type=int,
+        default=cfg.FILE_SPLITTING_DURATION,
+        help=f"Block duration in seconds. Defaults to {cfg.FILE_SPLITTING_DURATION}.",
+    )
+    parser.add_argument("--hours", type=float, default=24, help="Simulated recording length for 'results'. Defaults to 24.")
+    parser.add_argument(
+        "--batchsize", type=int, default=100, help="Windows per batch for 'results' and 'allocation'. Defaults to 100."
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=50, help="Number of calls for 'allocation', blocks for 'filter' or requests per level for 'server'. Defaults to 50."
+    )
+    parser.add_argument("--fmin", type=int, default=500, help="Minimum bandpass frequency for 'filter'. Defaults to 500.")
+    parser.add_argument("--fmax", type=int, default=8000, help="Maximum bandpass frequency for 'filter'. Defaults to 8000.")
+    parser.add_argument(
+        "--overlaps", default="0,1.5,2.5", help="Comma-separated window overlaps in seconds for 'windowing'. Defaults to '0,1.5,2.5'."
+    )
+    parser.add_argument("--host", default="localhost", help="Host of the running server for 'server'. Defaults to 'localhost'.")
+    parser.add_argument("--port", type=int, default=8080, help="Port of the running server for 'server'. Defaults to 8080.")
+    parser.add_argument("--clip", type=int, default=15, help="Length of the uploads in seconds for 'server'. Defaults to 15.")
+    parser.add_argument(
+        "--concurrency", default="1,4,16", help="Comma-separated numbers of concurrent clients for 'server'. Defaults to '1,4,16'."
+    )
+
+    args = parser.parse_args()
+
+    if args.mode == "decode":
+        benchmarkDecoding([int(l) for l in args.lengths.split(",")], args.formats.split(","), args.block)
+    elif args.mode == "read":
+        benchmarkReading(int(args.lengths.split(",")[0]), args.formats.split(","))
+    elif args.mode == "filter":
+        benchmarkFiltering(int(args.lengths.split(",")[0]), max(1, args.iterations), args.fmin, args.fmax)
+    elif args.mode == "results":
+        benchmarkResultStore(args.hours, 6522, max(1, args.batchsize), 1000)
+    elif args.mode == "allocation":
+        benchmarkAllocation(max(2, args.batchsize), max(1, args.iterations))
+    elif args.mode == "windowing":
+        benchmarkWindowing(int(args.lengths.split(",")[0]), [float(o) for o in args.overlaps.split(",")], max(1, args.batchsize))
+    elif args.mode == "server":
+        benchmarkServer(args.host, args.port, max(1, args.clip), [max(1, int(c)) for c in args.concurrency.split(",")], max(1, args.iterations))
+
+    # A few examples to test
+    # python3 benchmark.py --mode decode
+    # python3 benchmark.py --mode decode --lengths 10,60,240 --formats mp3 --block 60
+    # python3 benchmark.py --mode read --lengths 10 --formats wav,flac,mp3
+    # python3 benchmark.py --mode filter --lengths 10 --iterations 3
+    # python3 benchmark.py --mode results --hours 24
+    # python3 benchmark.py --mode allocation --batchsize 16
+    # python3 benchmark.py --mode windowing --lengths 60 --batchsize 32
+    # python3 benchmark.py --mode server --port 8080 --concurrency 1,4,16 --iterations 100
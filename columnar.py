@@ -0,0 +1,356 @@
+"""Module to read and write results in a columnar binary format.
+
+A result file holds the detections of one or more audio files as typed columns
+(file id, start, end, class index, score), written in row groups.
+It can be read with NumPy alone:
+
+    [magic][row group 0]...[row group n][JSON footer][footer size (uint32)][magic]
+
+Each row group stores its columns one after another, the footer lists the
+audio files with their location and week, the labels, the analysis settings and the offset and size of
+every row group. Files can be converted to the text formats of analyze.py.
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+import config as cfg
+import utils
+
+MAGIC = b"BNRES1"
+
+RESULT_FILE_SUFFIX = ".BirdNET.results.bin"
+
+# Maximum number of detections per row group
+ROW_GROUP_SIZE = 65536
+
+# The columns in the order they are stored in a row group
+COLUMNS = [("file", "<i4"), ("start", "<f8"), ("end", "<f8"), ("label", "<i4"), ("score", "<f4")]
+
+# Settings of the analysis that the text formats need
+SETTING_KEYS = [
+    "MODEL_PATH",
+    "LATITUDE",
+    "LONGITUDE",
+    "WEEK",
+    "SIG_OVERLAP",
+    "SIGMOID_SENSITIVITY",
+    "MIN_CONFIDENCE",
+    "SPECIES_LIST_FILE",
+    "BANDPASS_FMIN",
+    "BANDPASS_FMAX",
+]
+
+RESULT_DTYPE = np.dtype(COLUMNS)
+
+
+class ResultWriter:
+    """Writes a result file one row group at a time.
+
+    Usage:
+        with ResultWriter(path) as w:
+            w.addFile(afile_path, sample_rate, detections)
+    """
+
+    def __init__(self, path: str, labels=None, translated_labels=None, codes=None, settings=None):
+        """Opens the result file.
+
+        Args:
+            path: Path to the result file.
+            labels: The labels the class indices refer to, defaults to cfg.LABELS.
+            translated_labels: The translated labels, defaults to cfg.TRANSLATED_LABELS.
+            codes: The eBird codes, defaults to cfg.CODES.
+            settings: The analysis settings, defaults to SETTING_KEYS of the config.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.labels = list(cfg.LABELS if labels is None else labels)
+        self.translated_labels = list(cfg.TRANSLATED_LABELS if translated_labels is None else translated_labels)
+        self.codes = cfg.CODES if codes is None else codes
+        self.settings = settings if settings is not None else {k: getattr(cfg, k) for k in SETTING_KEYS}
+        self.files = []
+        self.row_groups = []
+        self._f = open(path, "wb")
+        self._f.write(MAGIC)
+
+    def addFile(self, afile_path: str, sample_rate, detections: np.ndarray, duration=None, location=None):
+        """Appends the detections of an audio file.
+
+        Args:
+            afile_path: Path to the audio file.
+            sample_rate: Native sample rate of the audio file or None.
+            detections: The detections with start, end, label and score fields, see analyze.DETECTION_DTYPE.
+            duration: Duration of the audio file in seconds or None.
+            location: The (lat, lon, week) of the recording or None, see analyze.getFileLocation.
+
+        Returns:
+            The file id of the audio file.
+        """
+        file_id = len(self.files)
+        self.files.append({"path": afile_path, "sample_rate": sample_rate, "duration": duration})
+
+        if location is not None:
+            self.files[-1].update(zip(["lat", "lon", "week"], location))
+
+        for i in range(0, len(detections), ROW_GROUP_SIZE):
+            chunk = detections[i : i + ROW_GROUP_SIZE]
+            self.writeRowGroup(np.full(len(chunk), file_id), chunk["start"], chunk["end"], chunk["label"], chunk["score"])
+
+        return file_id
+
+    def writeRowGroup(self, *columns):
+        """Writes a row group.
+
+        Args:
+            *columns: One array per entry of COLUMNS, all of the same length.
+        """
+        offset = self._f.tell()
+
+        for (_, dtype), values in zip(COLUMNS, columns):
+            self._f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+        self.row_groups.append({"offset": offset, "rows": len(columns[0])})
+
+    def close(self):
+        """Writes the footer and closes the file."""
+        if self._f.closed:
+            return
+
+        footer = {
+            "version": 1,
+            "columns": COLUMNS,
+            "files": self.files,
+            "labels": self.labels,
+            "translated_labels": self.translated_labels,
+            "codes": {l: self.codes[l] for l in self.labels if l in self.codes},
+            "settings": self.settings,
+            "row_groups": self.row_groups,
+        }
+        footer = json.dumps(footer).encode("utf-8")
+
+        self._f.write(footer)
+        self._f.write(struct.pack("<I", len(footer)))
+        self._f.write(MAGIC)
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def saveResultFile(r: np.ndarray, path: str, afile_path: str, sample_rate=None, duration=None, location=None):
+    """Saves the detections of an audio file as columnar result file.
+
+    Args:
+        r: The detections as array of analyze.DETECTION_DTYPE.
+        path: The path where the result should be saved.
+        afile_path: The path to the audio file.
+        sample_rate: Native sample rate of the audio file or None.
+        duration: Duration of the audio file in seconds or None.
+        location: The (lat, lon, week) of the recording or None.
+    """
+    with ResultWriter(path) as w:
+        w.addFile(afile_path, sample_rate, r, duration, location)
+
+
+def readFooter(path: str):
+    """Reads the footer of a result file.
+
+    Args:
+        path: Path to the result file.
+
+    Returns:
+        The footer as dict.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a BirdNET result file.")
+
+        f.seek(-(len(MAGIC) + 4), os.SEEK_END)
+        size = struct.unpack("<I", f.read(4))[0]
+
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is incomplete.")
+
+        f.seek(-(len(MAGIC) + 4 + size), os.SEEK_END)
+
+        return json.loads(f.read(size).decode("utf-8"))
+
+
+def iterRowGroups(path: str, footer=None):
+    """Reads the row groups of a result file.
+
+    Args:
+        path: Path to the result file.
+        footer: The footer, read from the file if None.
+
+    Yields:
+        The detections of a row group as array of RESULT_DTYPE.
+    """
+    if footer is None:
+        footer = readFooter(path)
+
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+
+    for group in footer["row_groups"]:
+        rows = np.empty(group["rows"], dtype=RESULT_DTYPE)
+        offset = group["offset"]
+
+        for name, dtype in footer["columns"]:
+            size = group["rows"] * np.dtype(dtype).itemsize
+            rows[name] = np.frombuffer(data[offset : offset + size], dtype=dtype)
+            offset += size
+
+        yield rows
+
+
+def loadResultFile(path: str):
+    """Loads a result file.
+
+    Args:
+        path: Path to the result file.
+
+    Returns:
+        The footer and all detections as array of RESULT_DTYPE.
+    """
+    footer = readFooter(path)
+    groups = list(iterRowGroups(path, footer))
+
+    return footer, np.concatenate(groups) if groups else np.empty(0, dtype=RESULT_DTYPE)
+
+
+def combineResults(files: list[str], output_file: str):
+    """Combines result files into one, renumbering the file ids.
+
+    All files have to use the same labels.
+
+    Args:
+        files: Paths to the result files.
+        output_file: Path to the combined result file.
+    """
+    writer = None
+
+    try:
+        for rfile in files:
+            footer = readFooter(rfile)
+
+            if writer is None:
+                writer = ResultWriter(output_file, footer["labels"], footer["translated_labels"], footer["codes"], footer["settings"])
+            elif footer["labels"] != writer.labels:
+                raise ValueError(f"{rfile} uses other labels than {files[0]}.")
+
+            # Row groups are copied as they are, only the file ids change
+            file_offset = len(writer.files)
+            writer.files.extend(footer["files"])
+
+            for rows in iterRowGroups(rfile, footer):
+                writer.writeRowGroup(*[rows[name] + (file_offset if name == "file" else 0) for name, _ in COLUMNS])
+
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def convertResultFile(path: str, output_path: str, rtype: str):
+    """Converts a result file to one of the text formats of analyze.py.
+
+    Args:
+        path: Path to the result file.
+        output_path: Output folder, the text files are named after the audio files.
+                     Can be a file if the result file holds a single audio file.
+        rtype: The result type, see cfg.RESULT_TYPE.
+
+    Returns:
+        The paths of the written files.
+    """
+    import analyze
+
+    footer, rows = loadResultFile(path)
+
+    # Restore the analysis settings
+    cfg.RESULT_TYPE = rtype
+    cfg.LABELS = footer["labels"]
+    cfg.TRANSLATED_LABELS = footer["translated_labels"]
+    cfg.CODES = footer["codes"]
+
+    for k, v in footer["settings"].items():
+        setattr(cfg, k, v)
+
+    # Group the rows by file
+    rows = rows[np.argsort(rows["file"], kind="stable")]
+    bounds = np.searchsorted(rows["file"], np.arange(len(footer["files"]) + 1))
+    single = output_path.rsplit(".", 1)[-1].lower() in ["txt", "csv"]
+
+    # Keep the folder structure of the audio files
+    paths = [afile["path"] for afile in footer["files"]]
+    root = os.path.commonpath(paths) if len(paths) > 1 else os.path.dirname(paths[0]) if paths else ""
+    written = []
+
+    for i, afile in enumerate(footer["files"]):
+        detections = np.empty(bounds[i + 1] - bounds[i], dtype=analyze.DETECTION_DTYPE)
+
+        for name in detections.dtype.names:
+            detections[name] = rows[name][bounds[i] : bounds[i + 1]]
+
+        if single:
+            rfile = output_path
+        else:
+            rpath = os.path.relpath(afile["path"], root) if root else os.path.basename(afile["path"])
+            rfile = os.path.join(output_path, rpath.rsplit(".", 1)[0] + analyze.getResultFileSuffix())
+
+        # Files of older versions have only the location of the run
+        location = (afile["lat"], afile["lon"], afile["week"]) if "lat" in afile else None
+        analyze.saveResultFile(detections, rfile, afile["path"], afile["sample_rate"], afile.get("duration"), location)
+        written.append(rfile)
+
+    return written
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Convert columnar result files to text formats.")
+    parser.add_argument("--i", default="example/", help="Path to result file or folder.")
+    parser.add_argument("--o", default="example/", help="Path to output folder, or file if --i is a file of a single audio file.")
+    parser.add_argument(
+        "--rtype",
+        default="table",
+        help="Output format. Values in ['table', 'audacity', 'r',  'kaleidoscope', 'csv']. Defaults to 'table' (Raven selection table).",
+    )
+    parser.add_argument("--combine", default=None, help="Combine all result files into this columnar file instead of converting them.")
+
+    args = parser.parse_args()
+
+    script_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
+    cfg.ERROR_LOG_FILE = os.path.join(script_dir, cfg.ERROR_LOG_FILE)
+
+    if os.path.isdir(args.i):
+        files = utils.collect_all_files(args.i, ["bin"], pattern=RESULT_FILE_SUFFIX[1:])
+        print(f"Found {len(files)} result files")
+    else:
+        files = [args.i]
+
+    if args.combine:
+        combineResults(files, args.combine)
+        print(f"Combined {len(files)} result files into {args.combine}", flush=True)
+    else:
+        for rfile in files:
+            try:
+                convertResultFile(rfile, args.o, args.rtype.lower())
+                print(f"Converted {rfile}", flush=True)
+
+            except Exception as ex:
+                print(f"Error: Cannot convert {rfile}.\n", flush=True)
+                utils.writeErrorLog(ex)
+
+    # A few examples to test
+    # python3 analyze.py --i example/ --o example/ --rtype columnar
+    # python3 columnar.py --i example/ --o example/ --rtype csv
+    # python3 columnar.py --i example/ --combine example/BirdNET_results.bin
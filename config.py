@@ -52,6 +52,20 @@ SIG_FMAX: int = 15000
 BANDPASS_FMIN: int = 0
 BANDPASS_FMAX: int = 15000
 
+# Resampler for recordings that are not at SAMPLE_RATE.
+# 'kaiser_fast' uses resampy like librosa, 'polyphase' uses scipy's resample_poly,
+# which is much faster for rates like 44.1 kHz -> 48 kHz.
+# Other librosa res_type values work as well.
+RESAMPLE_TYPE: str = "kaiser_fast"
+
+# Windows whose RMS level after the bandpass filter is below this many dBFS
+# are not passed to the model and have no detections. None disables the gate.
+ENERGY_GATE_DB: float | None = None
+
+# Whether to run the model on the gated windows anyway and report how many
+# detections the gate drops. The gated detections are still not saved.
+ENERGY_GATE_VALIDATE: bool = False
+
 #####################
 # Metadata settings #
 #####################
@@ -61,6 +75,13 @@ LONGITUDE: float = -1
 WEEK: int = -1
 LOCATION_FILTER_THRESHOLD: float = 0.03
 
+# Location and week of single files, {path: {'lat': ..., 'lon': ..., 'week': ...}}.
+# Files that are not listed use LATITUDE, LONGITUDE and WEEK.
+FILE_METADATA: dict = {}
+
+# Whether to take the week from a date in the file name, e.g. 20230415_053000.WAV
+WEEK_FROM_FILENAME: bool = False
+
 ######################
 # Inference settings #
 ######################
@@ -83,6 +104,33 @@ ALLOWED_FILETYPES: list[str] = ["wav", "flac", "mp3", "ogg", "m4a", "wma", "aiff
 CPU_THREADS: int = 8
 TFLITE_THREADS: int = 1
 
+# Number of files handed to a worker process at once.
+# The windows of these files share their batches, so larger values
+# fill batches of short recordings and reduce scheduling overhead.
+# Smaller values balance the load between the processes and record
+# finished files in the manifest sooner. Set 0 to pick the size from
+# the number of files and processes, see workers.getGroupSize.
+WORKER_CHUNKSIZE: int = 0
+
+# Files longer than this many seconds are split into shards on the window grid,
+# which are analyzed by different processes and stitched into one result file.
+# Set 0 to analyze every file in one process.
+SHARD_DURATION: int = 3600
+
+# Each process runs the analysis as a pipeline of stages connected by bounded queues:
+# decode threads -> batching -> inference threads -> result writer.
+# Every inference thread has its own interpreters.
+DECODE_THREADS: int = 1
+INFERENCE_THREADS: int = 1
+
+# Maximum number of decoded blocks (of FILE_SPLITTING_DURATION seconds) and batches
+# waiting between the stages. Larger values use more memory.
+DECODE_QUEUE_SIZE: int = 2
+BATCH_QUEUE_SIZE: int = 4
+
+# Whether to print the queue depths and waiting times of the stages
+PIPELINE_STATS: bool = False
+
 # False will output logits, True will convert to sigmoid activations
 APPLY_SIGMOID: bool = True
 SIGMOID_SENSITIVITY: float = 1.0
@@ -92,11 +140,20 @@ SIGMOID_SENSITIVITY: float = 1.0
 # probabilities and needs to be adjusted)
 MIN_CONFIDENCE: float = 0.1
 
+# Candidate threshold of the two-pass analysis. If set, the files are first
+# analyzed without overlap and only the neighborhoods of windows with a score
+# above this threshold are analyzed again with SIG_OVERLAP. None disables it.
+REFINE_CONFIDENCE: float | None = None
+
 # Number of samples to process at the same time. Higher values can increase
 # processing speed, but will also increase memory usage.
 # Might only be useful for GPU inference.
 BATCH_SIZE: int = 1
 
+# Number of TFLite interpreters kept allocated for different batch shapes.
+# With 2, the full batches and the last, partial batch of a file
+# don't have to reallocate the tensors of each other.
+INTERPRETER_CACHE_SIZE: int = 2
 
 # Number of seconds to load from a file at a time
 # Files will be loaded into memory in segments that are only as long as this value
@@ -113,10 +170,21 @@ USE_NOISE: bool = False
 RESULT_TYPE: str = "table"
 OUTPUT_FILENAME: str = "BirdNET_SelectionTable.txt" # this is for combined Raven selection tables only
 
+# Whether to save the raw model outputs of every window next to the results.
+# render.py can create new results from them without running the model again.
+SAVE_SCORES: bool = False
+
 # Whether to skip existing results in the output path
 # If set to False, existing files will not be overwritten
 SKIP_EXISTING_RESULTS: bool = False
 
+# Path to the SQLite manifest of analyzed files, defaults to the output folder
+MANIFEST_PATH: str | None = None
+
+# Path to the SQLite cache of audio file durations and sample rates,
+# defaults to the folder of the manifest. None keeps the cache in memory.
+AUDIO_INFO_CACHE_FILE: str | None = None
+
 #####################
 # Training settings #
 #####################
@@ -221,10 +289,15 @@ def getConfig():
         'SIG_FMAX': SIG_FMAX,
         'BANDPASS_FMIN': BANDPASS_FMIN,
         'BANDPASS_FMAX': BANDPASS_FMAX,
+        'RESAMPLE_TYPE': RESAMPLE_TYPE,
+        'ENERGY_GATE_DB': ENERGY_GATE_DB,
+        'ENERGY_GATE_VALIDATE': ENERGY_GATE_VALIDATE,
         'LATITUDE': LATITUDE,
         'LONGITUDE': LONGITUDE,
         'WEEK': WEEK,
         'LOCATION_FILTER_THRESHOLD': LOCATION_FILTER_THRESHOLD,
+        'FILE_METADATA': FILE_METADATA,
+        'WEEK_FROM_FILENAME': WEEK_FROM_FILENAME,
         'CODES_FILE': CODES_FILE,
         'SPECIES_LIST_FILE': SPECIES_LIST_FILE,
         'ALLOWED_FILETYPES': ALLOWED_FILETYPES,
@@ -232,11 +305,21 @@ def getConfig():
         'OUTPUT_PATH': OUTPUT_PATH,
         'CPU_THREADS': CPU_THREADS,
         'TFLITE_THREADS': TFLITE_THREADS,
+        'WORKER_CHUNKSIZE': WORKER_CHUNKSIZE,
+        'SHARD_DURATION': SHARD_DURATION,
+        'DECODE_THREADS': DECODE_THREADS,
+        'INFERENCE_THREADS': INFERENCE_THREADS,
+        'DECODE_QUEUE_SIZE': DECODE_QUEUE_SIZE,
+        'BATCH_QUEUE_SIZE': BATCH_QUEUE_SIZE,
+        'PIPELINE_STATS': PIPELINE_STATS,
         'APPLY_SIGMOID': APPLY_SIGMOID,
         'SIGMOID_SENSITIVITY': SIGMOID_SENSITIVITY,
         'MIN_CONFIDENCE': MIN_CONFIDENCE,
+        'REFINE_CONFIDENCE': REFINE_CONFIDENCE,
         'BATCH_SIZE': BATCH_SIZE,
+        'INTERPRETER_CACHE_SIZE': INTERPRETER_CACHE_SIZE,
         'RESULT_TYPE': RESULT_TYPE,
+        'SAVE_SCORES': SAVE_SCORES,
         'OUTPUT_FILENAME': OUTPUT_FILENAME,
         'TRAIN_DATA_PATH': TRAIN_DATA_PATH,
         'SAMPLE_CROP_MODE': SAMPLE_CROP_MODE,
@@ -263,6 +346,8 @@ def getConfig():
         'FILE_LIST': FILE_LIST,
         'FILE_STORAGE_PATH': FILE_STORAGE_PATH,
         'SKIP_EXISTING_RESULTS': SKIP_EXISTING_RESULTS,
+        'MANIFEST_PATH': MANIFEST_PATH,
+        'AUDIO_INFO_CACHE_FILE': AUDIO_INFO_CACHE_FILE,
         'USE_NOISE': USE_NOISE
     }
 
@@ -285,10 +370,15 @@ def setConfig(c):
     global SIG_FMAX
     global BANDPASS_FMIN
     global BANDPASS_FMAX
+    global RESAMPLE_TYPE
+    global ENERGY_GATE_DB
+    global ENERGY_GATE_VALIDATE
     global LATITUDE
     global LONGITUDE
     global WEEK
     global LOCATION_FILTER_THRESHOLD
+    global FILE_METADATA
+    global WEEK_FROM_FILENAME
     global CODES_FILE
     global SPECIES_LIST_FILE
     global ALLOWED_FILETYPES
@@ -296,11 +386,21 @@ def setConfig(c):
     global OUTPUT_PATH
     global CPU_THREADS
     global TFLITE_THREADS
+    global WORKER_CHUNKSIZE
+    global SHARD_DURATION
+    global DECODE_THREADS
+    global INFERENCE_THREADS
+    global DECODE_QUEUE_SIZE
+    global BATCH_QUEUE_SIZE
+    global PIPELINE_STATS
     global APPLY_SIGMOID
     global SIGMOID_SENSITIVITY
     global MIN_CONFIDENCE
+    global REFINE_CONFIDENCE
     global BATCH_SIZE
+    global INTERPRETER_CACHE_SIZE
     global RESULT_TYPE
+    global SAVE_SCORES
     global OUTPUT_FILENAME
     global TRAIN_DATA_PATH
     global SAMPLE_CROP_MODE
@@ -327,6 +427,8 @@ def setConfig(c):
     global FILE_LIST
     global FILE_STORAGE_PATH
     global SKIP_EXISTING_RESULTS
+    global MANIFEST_PATH
+    global AUDIO_INFO_CACHE_FILE
     global USE_NOISE
 
     RANDOM_SEED = c['RANDOM_SEED']
@@ -345,10 +447,15 @@ def setConfig(c):
     SIG_FMAX = c['SIG_FMAX']
     BANDPASS_FMIN = c['BANDPASS_FMIN']
     BANDPASS_FMAX = c['BANDPASS_FMAX']
+    RESAMPLE_TYPE = c['RESAMPLE_TYPE']
+    ENERGY_GATE_DB = c['ENERGY_GATE_DB']
+    ENERGY_GATE_VALIDATE = c['ENERGY_GATE_VALIDATE']
     LATITUDE = c['LATITUDE']
     LONGITUDE = c['LONGITUDE']
     WEEK = c['WEEK']
     LOCATION_FILTER_THRESHOLD = c['LOCATION_FILTER_THRESHOLD']
+    FILE_METADATA = c['FILE_METADATA']
+    WEEK_FROM_FILENAME = c['WEEK_FROM_FILENAME']
     CODES_FILE = c['CODES_FILE']
     SPECIES_LIST_FILE = c['SPECIES_LIST_FILE']
     ALLOWED_FILETYPES = c['ALLOWED_FILETYPES']
@@ -356,11 +463,21 @@ def setConfig(c):
     OUTPUT_PATH = c['OUTPUT_PATH']
     CPU_THREADS = c['CPU_THREADS']
     TFLITE_THREADS = c['TFLITE_THREADS']
+    WORKER_CHUNKSIZE = c['WORKER_CHUNKSIZE']
+    SHARD_DURATION = c['SHARD_DURATION']
+    DECODE_THREADS = c['DECODE_THREADS']
+    INFERENCE_THREADS = c['INFERENCE_THREADS']
+    DECODE_QUEUE_SIZE = c['DECODE_QUEUE_SIZE']
+    BATCH_QUEUE_SIZE = c['BATCH_QUEUE_SIZE']
+    PIPELINE_STATS = c['PIPELINE_STATS']
     APPLY_SIGMOID = c['APPLY_SIGMOID']
     SIGMOID_SENSITIVITY = c['SIGMOID_SENSITIVITY']
     MIN_CONFIDENCE = c['MIN_CONFIDENCE']
+    REFINE_CONFIDENCE = c['REFINE_CONFIDENCE']
     BATCH_SIZE = c['BATCH_SIZE']
+    INTERPRETER_CACHE_SIZE = c['INTERPRETER_CACHE_SIZE']
     RESULT_TYPE = c['RESULT_TYPE']
+    SAVE_SCORES = c['SAVE_SCORES']
     OUTPUT_FILENAME = c['OUTPUT_FILENAME']
     TRAIN_DATA_PATH = c['TRAIN_DATA_PATH']
     SAMPLE_CROP_MODE = c['SAMPLE_CROP_MODE']
@@ -387,4 +504,6 @@ def setConfig(c):
     FILE_LIST = c['FILE_LIST']
     FILE_STORAGE_PATH = c['FILE_STORAGE_PATH']
     SKIP_EXISTING_RESULTS = c['SKIP_EXISTING_RESULTS']
+    MANIFEST_PATH = c['MANIFEST_PATH']
+    AUDIO_INFO_CACHE_FILE = c['AUDIO_INFO_CACHE_FILE']
     USE_NOISE = c['USE_NOISE']
@@ -4,15 +4,14 @@ import argparse
 import datetime
 import os
 import sys
-from multiprocessing import Pool
 
 import numpy as np
 
 import analyze
-import audio
 import config as cfg
 import model
 import utils
+import workers
 
 
 def writeErrorLog(msg):
@@ -32,19 +31,42 @@ def saveAsEmbeddingsFile(results: dict[str], fpath: str):
             f.write(timestamp.replace("-", "\t") + "\t" + ",".join(map(str, results[timestamp])) + "\n")
 
 
+def addEmbeddings(results: dict[str], samples, timestamps):
+    """Extracts the embeddings for a batch and adds them to the results.
+
+    Args:
+        results: A dictionary containing the embeddings at timestamp.
+        samples: The batch of raw audio chunks.
+        timestamps: The [start, end] of each chunk.
+    """
+    # Prepare sample and pass through model, the batch buffer is not copied
+    data = np.asarray(samples, dtype="float32")
+    e = model.embeddings(data)
+
+    # Add to results
+    for i in range(len(samples)):
+        # Get timestamp
+        s_start, s_end = timestamps[i]
+
+        # Store embeddings
+        results[f"{s_start}-{s_end}"] = e[i]
+
+
 def analyzeFile(item):
     """Extracts the embeddings for a file.
 
     Args:
-        item: (filepath, config)
+        item: The file path or (filepath, config).
+              Pool workers get the config from workers.initWorker.
     """
     # Get file path and restore cfg
-    fpath: str = item[0]
-    cfg.setConfig(item[1])
+    if isinstance(item, tuple):
+        fpath: str = item[0]
+        cfg.setConfig(item[1])
+    else:
+        fpath: str = item
 
-    offset = 0
-    duration = cfg.FILE_SPLITTING_DURATION
-    fileLengthSeconds = audio.getAudioFileLength(fpath, cfg.SAMPLE_RATE)
+    start, end = 0, cfg.SIG_LENGTH
     results = {}
 
     # Start time
@@ -55,45 +77,34 @@ def analyzeFile(item):
 
     # Process each chunk
     try:
-        while offset < fileLengthSeconds:
-            chunks = analyze.getRawAudioFromFile(fpath, offset, duration)
-            start, end = offset, cfg.SIG_LENGTH + offset
-            samples = []
-            timestamps = []
-
-            for c in range(len(chunks)):
-                # Add to batch
-                samples.append(chunks[c])
-                timestamps.append([start, end])
-
-                # Advance start and end
-                start += cfg.SIG_LENGTH - cfg.SIG_OVERLAP
-                end = start + cfg.SIG_LENGTH
+        # The chunks are copied into one reused batch buffer
+        samples = np.empty((cfg.BATCH_SIZE, int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE)), dtype="float32")
+        size = 0
+        timestamps = []
 
-                # Check if batch is full or last chunk
-                if len(samples) < cfg.BATCH_SIZE and c < len(chunks) - 1:
-                    continue
+        for chunk in analyze.getRawAudioChunks(fpath):
+            # Add to batch
+            samples[size] = chunk
+            size += 1
+            timestamps.append([start, end])
 
-                # Prepare sample and pass through model
-                data = np.array(samples, dtype="float32")
-                e = model.embeddings(data)
+            # Advance start and end
+            start += cfg.SIG_LENGTH - cfg.SIG_OVERLAP
+            end = start + cfg.SIG_LENGTH
 
-                # Add to results
-                for i in range(len(samples)):
-                    # Get timestamp
-                    s_start, s_end = timestamps[i]
+            # Check if batch is full
+            if size < cfg.BATCH_SIZE:
+                continue
 
-                    # Get prediction
-                    embeddings = e[i]
+            addEmbeddings(results, samples, timestamps)
 
-                    # Store embeddings
-                    results[f"{s_start}-{s_end}"] = embeddings
+            # Reset batch
+            size = 0
+            timestamps = []
 
-                # Reset batch
-                samples = []
-                timestamps = []
-            
-            offset = offset + duration
+        # Last, incomplete batch
+        if size:
+            addEmbeddings(results, samples[:size], timestamps)
 
     except Exception as ex:
         # Write error log
@@ -193,19 +204,18 @@ if __name__ == "__main__":
     # Set batch size
     cfg.BATCH_SIZE = max(1, int(args.batchsize))
 
-    # Add config items to each file list entry.
-    # We have to do this for Windows which does not
-    # support fork() and thus each process has to
-    # have its own config. USE LINUX!
-    flist = [(f, cfg.getConfig()) for f in cfg.FILE_LIST]
-
     # Analyze files
     if cfg.CPU_THREADS < 2:
-        for entry in flist:
-            analyzeFile(entry)
+        for fpath in cfg.FILE_LIST:
+            analyzeFile(fpath)
     else:
-        with Pool(cfg.CPU_THREADS) as p:
-            p.map(analyzeFile, flist)
+        # Workers restore the config and load the model once
+        chunksize = workers.getGroupSize(len(cfg.FILE_LIST), cfg.CPU_THREADS, cfg.WORKER_CHUNKSIZE)
+
+        for _ in workers.imapUnordered(analyzeFile, cfg.FILE_LIST, cfg.CPU_THREADS, cfg.getConfig(), "embeddings", chunksize):
+            pass
+
+        workers.shutdown()
 
     # A few examples to test
     # python3 embeddings.py --i example/ --o example/ --threads 4
@@ -1,4 +1,3 @@
-import concurrent.futures
 import os
 import sys
 from pathlib import Path
@@ -31,9 +30,12 @@ import librosa
 import webview
 
 import analyze
+import manifest
+import metadata
 import segments
 import species
 import utils
+import workers
 from train import trainModel
 
 _WINDOW: webview.Window
@@ -43,13 +45,22 @@ OUTPUT_TYPE_MAP = {
     "R": "r",
     "CSV": "csv",
     "Kaleidoscope": "kaleidoscope",
+    "Columnar (binary)": "columnar",
 }
 ORIGINAL_LABELS_FILE = cfg.LABELS_FILE
 ORIGINAL_TRANSLATED_LABELS_PATH = cfg.TRANSLATED_LABELS_PATH
 
 
-def analyzeFile_wrapper(entry):
-    return (entry[0], analyze.analyzeFile(entry))
+def analyzeFile_wrapper(fpath):
+    return analyze.analyzeGroup([fpath])[0]
+
+
+def analyzeFiles_wrapper(fpaths):
+    try:
+        return analyze.analyzeGroup(fpaths)
+    finally:
+        # The pool keeps its workers, so atexit runs late or not at all
+        metadata.flush()
 
 
 def extractSegments_wrapper(entry):
@@ -335,7 +346,7 @@ def runAnalysis(
     # Set result type
     cfg.RESULT_TYPE = OUTPUT_TYPE_MAP[output_type] if output_type in OUTPUT_TYPE_MAP else output_type.lower()
 
-    if not cfg.RESULT_TYPE in ["table", "audacity", "r", "csv", "kaleidoscope"]:
+    if not cfg.RESULT_TYPE in ["table", "audacity", "r", "csv", "kaleidoscope", "columnar"]:
         cfg.RESULT_TYPE = "table"
 
     # Set output filename
@@ -355,12 +366,21 @@ def runAnalysis(
     # Set batch size
     cfg.BATCH_SIZE = max(1, int(batch_size))
 
-    flist = []
+    # Open the manifest in the output folder, it is only kept when files may be skipped
+    cfg.MANIFEST_PATH = manifest.getDefaultPath(cfg.OUTPUT_PATH) if cfg.SKIP_EXISTING_RESULTS else None
+    db = manifest.connect(cfg.MANIFEST_PATH or manifest.IN_MEMORY)
+    params = manifest.getParameterHash()
 
-    for f in cfg.FILE_LIST:
-        flist.append((f, cfg.getConfig()))
+    # Durations and sample rates are cached next to the manifest
+    cfg.AUDIO_INFO_CACHE_FILE = (
+        os.path.join(os.path.dirname(cfg.MANIFEST_PATH), metadata.AUDIO_INFO_CACHE_FILENAME) if cfg.MANIFEST_PATH else None
+    )
 
-    result_list = []
+    flist, file_stats = manifest.getPendingFiles(db, cfg.FILE_LIST, params, cfg.SKIP_EXISTING_RESULTS)
+
+    # Skipped files were analyzed before
+    pending = set(flist)
+    result_list = [(fpath, True) for fpath in cfg.FILE_LIST if fpath not in pending]
 
     if progress is not None:
         progress(0, desc="Starting ...")
@@ -368,25 +388,33 @@ def runAnalysis(
     # Analyze files
     if cfg.CPU_THREADS < 2:
         for entry in flist:
-            result = analyzeFile_wrapper(entry)
+            summary = analyzeFile_wrapper(entry)
+            manifest.recordResults(db, [summary], file_stats, params)
 
-            result_list.append(result)
+            result_list.append((summary["path"], summary["status"] == "done"))
     else:
-        with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CPU_THREADS) as executor:
-            futures = (executor.submit(analyzeFile_wrapper, arg) for arg in flist)
-            for i, f in enumerate(concurrent.futures.as_completed(futures), start=1):
-                if progress is not None:
-                    progress((i, len(flist)), total=len(flist), unit="files")
-                result = f.result()
+        # The pool stays alive between runs with the same settings,
+        # so the workers don't have to load the model again
+        results = workers.imapUnordered(
+            analyzeFiles_wrapper, workers.groupFiles(flist, cfg.WORKER_CHUNKSIZE, cfg.CPU_THREADS), cfg.CPU_THREADS, cfg.getConfig(), "predict"
+        )
 
-                result_list.append(result)
+        for group in results:
+            manifest.recordResults(db, group, file_stats, params)
+            result_list.extend((s["path"], s["status"] == "done") for s in group)
+
+            if progress is not None:
+                progress((len(result_list), len(cfg.FILE_LIST)), total=len(cfg.FILE_LIST), unit="files")
 
     # Combine results?
     if not cfg.OUTPUT_FILE is None:
         print(f"Combining results into {cfg.OUTPUT_FILE}...", end="", flush=True)
-        analyze.combineResults(cfg.OUTPUT_PATH, cfg.OUTPUT_FILE)
+        analyze.combineResults(cfg.OUTPUT_PATH, cfg.OUTPUT_FILE, manifest.getResultFiles(db, params))
         print("done!", flush=True)
 
+    db.close()
+    metadata.flush()
+
     return [[os.path.relpath(r[0], input_dir), r[1]] for r in result_list] if input_dir else cfg.OUTPUT_PATH
 
 
@@ -676,11 +704,8 @@ def extract_segments(audio_dir, result_dir, output_dir, min_conf, num_seq, seq_l
     # Parse file list and make list of segments
     cfg.FILE_LIST = segments.parseFiles(cfg.FILE_LIST, max(1, int(num_seq)))
 
-    # Add config items to each file list entry.
-    # We have to do this for Windows which does not
-    # support fork() and thus each process has to
-    # have its own config. USE LINUX!
-    flist = [(entry, max(cfg.SIG_LENGTH, float(seq_length)), cfg.getConfig()) for entry in cfg.FILE_LIST]
+    # Add segment length to each file list entry
+    flist = [(entry, max(cfg.SIG_LENGTH, float(seq_length))) for entry in cfg.FILE_LIST]
 
     result_list = []
 
@@ -693,14 +718,13 @@ def extract_segments(audio_dir, result_dir, output_dir, min_conf, num_seq, seq_l
             if progress is not None:
                 progress((i, len(flist)), total=len(flist), unit="files")
     else:
-        with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CPU_THREADS) as executor:
-            futures = (executor.submit(extractSegments_wrapper, arg) for arg in flist)
-            for i, f in enumerate(concurrent.futures.as_completed(futures), start=1):
-                if progress is not None:
-                    progress((i, len(flist)), total=len(flist), unit="files")
-                result = f.result()
-
-                result_list.append(result)
+        results = workers.imapUnordered(extractSegments_wrapper, flist, cfg.CPU_THREADS, cfg.getConfig())
+
+        for i, result in enumerate(results, start=1):
+            if progress is not None:
+                progress((i, len(flist)), total=len(flist), unit="files")
+
+            result_list.append(result)
 
     return [[os.path.relpath(r[0], audio_dir), r[1]] for r in result_list]
 
@@ -0,0 +1,247 @@
+"""Module to keep track of analyzed files.
+
+The manifest is a SQLite database with one row per audio file and parameter set.
+A re-run only schedules files that are new, changed or were analyzed with other settings.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+
+import config as cfg
+
+MANIFEST_FILENAME = "BirdNET_manifest.sqlite"
+
+# A manifest that only lives for one run, used when no files are skipped
+IN_MEMORY = ":memory:"
+
+# Settings that change the content or location of the results
+PARAMETER_KEYS = [
+    "MODEL_VERSION",
+    "MODEL_PATH",
+    "CUSTOM_CLASSIFIER",
+    "LABELS",
+    "TRANSLATED_LABELS",
+    "SIG_LENGTH",
+    "SIG_OVERLAP",
+    "SIG_MINLEN",
+    "BANDPASS_FMIN",
+    "BANDPASS_FMAX",
+    "RESAMPLE_TYPE",
+    "ENERGY_GATE_DB",
+    "APPLY_SIGMOID",
+    "SIGMOID_SENSITIVITY",
+    "MIN_CONFIDENCE",
+    "REFINE_CONFIDENCE",
+    "LATITUDE",
+    "LONGITUDE",
+    "WEEK",
+    "LOCATION_FILTER_THRESHOLD",
+    "FILE_METADATA",
+    "WEEK_FROM_FILENAME",
+    "SPECIES_LIST",
+    "RESULT_TYPE",
+    "INPUT_PATH",
+    "OUTPUT_PATH",
+    "SAVE_SCORES",
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis (
+    path TEXT NOT NULL,
+    params TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    status TEXT,
+    result_file TEXT,
+    duration REAL,
+    num_windows INTEGER,
+    started TEXT,
+    seconds REAL,
+    PRIMARY KEY (path, params)
+)
+"""
+
+
+def getDefaultPath(output_path: str):
+    """Returns the default location of the manifest for an output path.
+
+    Args:
+        output_path: The output folder or file of the analysis.
+
+    Returns:
+        The path to the manifest file.
+    """
+    if output_path.rsplit(".", 1)[-1].lower() in ["txt", "csv", "bin"]:
+        output_path = os.path.dirname(output_path)
+
+    return os.path.join(output_path, MANIFEST_FILENAME)
+
+
+def getParameterHash():
+    """Hashes the current settings that change the results.
+
+    Returns:
+        A hex string.
+    """
+    c = cfg.getConfig()
+    values = json.dumps({k: c[k] for k in PARAMETER_KEYS}, sort_keys=True, default=str)
+
+    return hashlib.sha1(values.encode("utf-8")).hexdigest()[:16]
+
+
+def connect(path: str):
+    """Opens the manifest and creates it if needed.
+
+    Only the main process should write to it, workers report their results back.
+    Within the process, the writer thread of the pipeline records the files
+    while the main thread waits, see analyze.analyzeGroup.
+
+    Args:
+        path: Path to the manifest file or IN_MEMORY.
+
+    Returns:
+        The database connection.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    db.execute(_SCHEMA)
+    db.commit()
+
+    return db
+
+
+def getPendingFiles(db: sqlite3.Connection, fpaths: list[str], params: str, skip_done=True):
+    """Selects the files that have to be analyzed.
+
+    A file is skipped if it was analyzed successfully with the same settings
+    and its size and modification time did not change. Every audio file is only
+    stat'ed once, the result files are not touched.
+
+    Args:
+        db: The manifest, see connect.
+        fpaths: List of audio file paths.
+        params: The parameter hash, see getParameterHash.
+        skip_done: Schedule all files if False.
+
+    Returns:
+        The list of files to analyze and a dict with (size, mtime) of every file.
+    """
+    done = {}
+
+    if skip_done:
+        for path, size, mtime in db.execute("SELECT path, size, mtime FROM analysis WHERE params = ? AND status = 'done'", (params,)):
+            done[path] = (size, mtime)
+
+    pending = []
+    stats = {}
+
+    for fpath in fpaths:
+        try:
+            st = os.stat(fpath)
+            stats[fpath] = (st.st_size, st.st_mtime)
+        except OSError:
+            stats[fpath] = (None, None)
+
+        if done.get(fpath) == stats[fpath]:
+            print(f"Skipping {fpath} as it has already been analyzed", flush=True)
+        else:
+            pending.append(fpath)
+
+    return pending, stats
+
+
+def recordResults(db: sqlite3.Connection, summaries: list[dict], stats: dict, params: str):
+    """Stores the outcome of analyzed files.
+
+    Args:
+        db: The manifest, see connect.
+        summaries: One dict per file with path, status, result_file, duration, num_windows, started and seconds.
+        stats: The (size, mtime) of the files, see getPendingFiles.
+        params: The parameter hash, see getParameterHash.
+    """
+    rows = [
+        (
+            s["path"],
+            params,
+            *stats.get(s["path"], (None, None)),
+            s["status"],
+            s.get("result_file"),
+            s.get("duration"),
+            s.get("num_windows"),
+            s.get("started"),
+            s.get("seconds"),
+        )
+        for s in summaries
+    ]
+
+    db.executemany("INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    db.commit()
+
+
+def getResultFiles(db: sqlite3.Connection, params: str):
+    """Returns the result files of the analyzed files with their recorded durations.
+
+    Args:
+        db: The manifest, see connect.
+        params: The parameter hash, see getParameterHash.
+
+    Returns:
+        A list of (result file, audio file, duration in seconds) sorted by audio file.
+    """
+    query = "SELECT result_file, path, duration FROM analysis WHERE status = 'done' AND params = ? ORDER BY path"
+
+    return db.execute(query, (params,)).fetchall()
+
+
+def report(db: sqlite3.Connection, params: str | None = None):
+    """Summarizes the manifest.
+
+    Args:
+        db: The manifest, see connect.
+        params: Only files analyzed with this parameter hash, all files if None.
+
+    Returns:
+        A list of text lines.
+    """
+    query = "SELECT status, COUNT(*), SUM(duration), SUM(seconds) FROM analysis"
+    args = ()
+
+    if params is not None:
+        query += " WHERE params = ?"
+        args = (params,)
+
+    lines = [f"{'status':<10}{'files':>10}{'audio (h)':>12}{'time (h)':>12}{'speed':>10}"]
+
+    for status, count, duration, seconds in db.execute(query + " GROUP BY status ORDER BY status", args):
+        speed = f"{duration / seconds:.1f}x" if duration and seconds else "-"
+        lines.append(f"{status:<10}{count:>10}{(duration or 0) / 3600:>12.2f}{(seconds or 0) / 3600:>12.2f}{speed:>10}")
+
+    return lines
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Show the status of the files in an analysis manifest.")
+    parser.add_argument(
+        "--db", default=os.path.join("example", MANIFEST_FILENAME), help=f"Path to the manifest. Defaults to 'example/{MANIFEST_FILENAME}'."
+    )
+    parser.add_argument("--failed", action="store_true", help="List the files that failed.")
+
+    args = parser.parse_args()
+
+    db = connect(args.db)
+
+    for line in report(db):
+        print(line)
+
+    if args.failed:
+        for (path,) in db.execute("SELECT DISTINCT path FROM analysis WHERE status = 'failed' ORDER BY path"):
+            print(path)
+
+    # A few examples to test
+    # python3 manifest.py --db example/BirdNET_manifest.sqlite
+    # python3 manifest.py --db example/BirdNET_manifest.sqlite --failed
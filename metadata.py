@@ -0,0 +1,198 @@
+"""Module to read and cache the metadata of audio files.
+
+Duration, native sample rate and channels are read from the file header once
+and cached by path, size and modification time. With cfg.AUDIO_INFO_CACHE_FILE
+set, the cache is kept in a SQLite file and reused by later runs. New entries
+are written in batches, see flush.
+"""
+import atexit
+import os
+import sqlite3
+import threading
+
+import config as cfg
+
+AUDIO_INFO_CACHE_FILENAME = "BirdNET_audio_info.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audio_info (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER
+)
+"""
+
+# path -> ((size, mtime), info) of this process
+_CACHE = {}
+_LOCK = threading.Lock()
+
+# The cache files that were already read by this process
+_LOADED = set()
+
+# Number of new entries that are written to the cache file at once
+FLUSH_SIZE = 256
+
+# cache file -> new entries of this process that are not written yet
+_PENDING = {}
+
+# (cache file, process id) -> connection, forked processes open their own
+_CONNECTIONS = {}
+_DB_LOCK = threading.Lock()
+
+
+def probe(path: str):
+    """Reads the metadata of an audio file from its header.
+
+    Uses soundfile for the formats of libsndfile and a single audioread
+    (ffmpeg, gstreamer or CoreAudio) pass without decoding for the others,
+    like librosa.get_duration does.
+
+    Args:
+        path: Path to the audio file.
+
+    Returns:
+        A dict with duration in seconds, sample_rate and channels.
+    """
+    import soundfile as sf
+
+    try:
+        info = sf.info(path)
+
+        return {"duration": info.duration, "sample_rate": info.samplerate, "channels": info.channels}
+
+    except Exception:
+        pass
+
+    import audioread
+
+    with audioread.audio_open(path) as f:
+        return {"duration": f.duration, "sample_rate": f.samplerate, "channels": f.channels}
+
+
+def _connect(cache_file: str):
+    """Returns the connection of this process to the persistent cache and creates the file if needed.
+
+    The connection is kept open for the process and needs _DB_LOCK. The cache uses
+    write-ahead logging, so reading processes don't block the one that writes.
+
+    Args:
+        cache_file: Path to the cache file.
+
+    Returns:
+        The database connection.
+    """
+    key = (cache_file, os.getpid())
+    db = _CONNECTIONS.get(key)
+
+    if db is None:
+        if os.path.dirname(cache_file):
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+        db = sqlite3.connect(cache_file, timeout=30, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(_SCHEMA)
+        _CONNECTIONS[key] = db
+
+    return db
+
+
+def _loadCacheFile(cache_file: str):
+    """Reads all entries of the persistent cache into the cache of this process.
+
+    Args:
+        cache_file: Path to the cache file.
+    """
+    _LOADED.add(cache_file)
+
+    try:
+        with _DB_LOCK:
+            rows = _connect(cache_file).execute("SELECT path, size, mtime, duration, sample_rate, channels FROM audio_info").fetchall()
+
+    # The cache is only an optimization, the files are probed instead
+    except sqlite3.Error:
+        return
+
+    for path, size, mtime, duration, sample_rate, channels in rows:
+        _CACHE.setdefault(path, ((size, mtime), {"duration": duration, "sample_rate": sample_rate, "channels": channels}))
+
+
+def _storeCacheFile(cache_file: str, rows: list[tuple]):
+    """Writes entries to the persistent cache in one transaction.
+
+    Args:
+        cache_file: Path to the cache file.
+        rows: The (path, size, mtime, duration, sample_rate, channels) of the audio files.
+    """
+    try:
+        with _DB_LOCK:
+            db = _connect(cache_file)
+            db.executemany("INSERT OR REPLACE INTO audio_info VALUES (?, ?, ?, ?, ?, ?)", rows)
+            db.commit()
+
+    except sqlite3.Error:
+        pass
+
+
+def flush():
+    """Writes the new entries of this process to the cache files.
+
+    Should be called before worker processes start and when a task or run ends,
+    the entries are written at exit otherwise.
+    """
+    with _LOCK:
+        pending = list(_PENDING.items())
+        _PENDING.clear()
+
+    for cache_file, rows in pending:
+        _storeCacheFile(cache_file, rows)
+
+
+atexit.register(flush)
+
+
+def getAudioInfo(path: str):
+    """Returns the metadata of an audio file.
+
+    The file is stat'ed on every call, its header is only read
+    if it is new or changed since it was cached.
+
+    Args:
+        path: Path to the audio file.
+
+    Returns:
+        A dict with duration in seconds, sample_rate and channels.
+    """
+    st = os.stat(path)
+    key = (st.st_size, st.st_mtime)
+    cache_file = cfg.AUDIO_INFO_CACHE_FILE
+
+    with _LOCK:
+        if cache_file and cache_file not in _LOADED:
+            _loadCacheFile(cache_file)
+
+        cached = _CACHE.get(path)
+
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+    info = probe(path)
+    rows = None
+
+    with _LOCK:
+        _CACHE[path] = (key, info)
+
+        if cache_file:
+            pending = _PENDING.setdefault(cache_file, [])
+            pending.append((path, *key, info["duration"], info["sample_rate"], info["channels"]))
+
+            if len(pending) >= FLUSH_SIZE:
+                rows = _PENDING.pop(cache_file)
+
+    # Written outside of the lock, so the other threads keep reading the cache
+    if rows:
+        _storeCacheFile(cache_file, rows)
+
+    return info
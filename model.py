@@ -1,6 +1,8 @@
 """Contains functions to use the BirdNET models.
 """
+import collections
 import os
+import threading
 import warnings
 
 import numpy as np
@@ -30,6 +32,34 @@ M_INTERPRETER: tflite.Interpreter = None
 PBMODEL = None
 C_PBMODEL = None
 
+# Interpreters with allocated tensors, keyed by (slot, input shape), least recently used first.
+# TFLite interpreters must not be shared, so every thread gets its own slot, see useInterpreterSlot.
+INTERPRETER_CACHE = collections.OrderedDict()
+C_INTERPRETER_CACHE = collections.OrderedDict()
+INTERPRETER_LOCK = threading.RLock()
+
+# The slot of the calling thread
+_SLOT = threading.local()
+
+
+def useInterpreterSlot(slot: int):
+    """Lets the calling thread use the interpreters of a slot.
+
+    Threads without a slot have their own interpreters. Slot 0 holds those of
+    the main thread, e.g. the ones loaded by the warm-up of a worker process.
+    The inference threads of every pipeline run take the same slots, so the
+    interpreters outlive the threads. A slot must only be used by one thread at a time.
+
+    Args:
+        slot: The slot number.
+    """
+    _SLOT.key = threading.main_thread().ident if slot == 0 else ("slot", slot)
+
+
+def getInterpreterSlot():
+    """Returns the cache key of the interpreters of the calling thread."""
+    return getattr(_SLOT, "key", threading.get_ident())
+
 
 def loadModel(class_output=True):
     """Initializes the BirdNET Model.
@@ -55,6 +85,11 @@ def loadModel(class_output=True):
         # Get input tensor index
         INPUT_LAYER_INDEX = input_details[0]["index"]
 
+        # Remember the allocated input shape
+        with INTERPRETER_LOCK:
+            INTERPRETER_CACHE.clear()
+            INTERPRETER_CACHE[(getInterpreterSlot(), tuple(input_details[0]["shape"]))] = INTERPRETER
+
         # Get classification output or feature embeddings
         if class_output:
             OUTPUT_LAYER_INDEX = output_details[0]["index"]
@@ -90,6 +125,11 @@ def loadCustomClassifier():
 
         C_INPUT_SIZE = input_details[0]["shape"][-1]
 
+        # Remember the allocated input shape
+        with INTERPRETER_LOCK:
+            C_INTERPRETER_CACHE.clear()
+            C_INTERPRETER_CACHE[(getInterpreterSlot(), tuple(input_details[0]["shape"]))] = C_INTERPRETER
+
         # Get classification output
         C_OUTPUT_LAYER_INDEX = output_details[0]["index"]
     else:
@@ -100,6 +140,64 @@ def loadCustomClassifier():
         C_PBMODEL = tf.saved_model.load(cfg.CUSTOM_CLASSIFIER)
 
 
+def getAllocatedInterpreter(cache: collections.OrderedDict, model_path: str, input_index: int, shape, num_threads=None, cache_size=None):
+    """Returns an interpreter with tensors allocated for the given input shape.
+
+    Resizing the input and allocating the tensors is expensive, so we keep up to
+    cfg.INTERPRETER_CACHE_SIZE interpreters per slot, one per input shape. A full batch
+    and the last, partial batch of a file then don't reallocate each other's tensors.
+    If the cache is full, the least recently used interpreter of the slot is resized.
+
+    Args:
+        cache: INTERPRETER_CACHE or C_INTERPRETER_CACHE, filled by the load function.
+        model_path: Path to the tflite model, used to create further interpreters.
+        input_index: Index of the input tensor.
+        shape: The input shape of the batch.
+        num_threads: Threads of new interpreters, defaults to cfg.TFLITE_THREADS.
+        cache_size: Interpreters per slot, defaults to cfg.INTERPRETER_CACHE_SIZE.
+
+    Returns:
+        The interpreter.
+    """
+    thread = getInterpreterSlot()
+    key = (thread, tuple(int(s) for s in shape))
+
+    with INTERPRETER_LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+
+            return cache[key]
+
+        own = [k for k in cache if k[0] == thread]
+
+        if len(own) < max(1, cfg.INTERPRETER_CACHE_SIZE if cache_size is None else cache_size):
+            interpreter = tflite.Interpreter(model_path=model_path, num_threads=cfg.TFLITE_THREADS if num_threads is None else num_threads)
+        else:
+            interpreter = cache.pop(own[0])
+
+    # Allocation happens outside the lock, the interpreter belongs to this slot only
+    interpreter.resize_tensor_input(input_index, list(key[1]))
+    interpreter.allocate_tensors()
+
+    with INTERPRETER_LOCK:
+        cache[key] = interpreter
+
+    return interpreter
+
+
+def releaseInterpreters():
+    """Removes the interpreters of the calling thread or its slot from the caches.
+
+    Should be called by threads without a slot before they exit.
+    """
+    thread = getInterpreterSlot()
+
+    with INTERPRETER_LOCK:
+        for cache in (INTERPRETER_CACHE, C_INTERPRETER_CACHE):
+            for key in [k for k in cache if k[0] == thread]:
+                del cache[key]
+
+
 def loadMetaModel():
     """Loads the model for species prediction.
 
@@ -539,18 +637,18 @@ def predict(sample):
     global INTERPRETER
 
     # Does interpreter or keras model exist?
-    if INTERPRETER == None and PBMODEL == None:
-        loadModel()
+    with INTERPRETER_LOCK:
+        if INTERPRETER == None and PBMODEL == None:
+            loadModel()
 
     if PBMODEL == None:
-        # Reshape input tensor
-        INTERPRETER.resize_tensor_input(INPUT_LAYER_INDEX, [len(sample), *sample[0].shape])
-        INTERPRETER.allocate_tensors()
+        # Get interpreter for the input shape
+        interpreter = getAllocatedInterpreter(INTERPRETER_CACHE, cfg.MODEL_PATH, INPUT_LAYER_INDEX, [len(sample), *sample[0].shape])
 
         # Make a prediction (Audio only for now)
-        INTERPRETER.set_tensor(INPUT_LAYER_INDEX, np.array(sample, dtype="float32"))
-        INTERPRETER.invoke()
-        prediction = INTERPRETER.get_tensor(OUTPUT_LAYER_INDEX)
+        interpreter.set_tensor(INPUT_LAYER_INDEX, np.ascontiguousarray(sample, dtype="float32"))
+        interpreter.invoke()
+        prediction = interpreter.get_tensor(OUTPUT_LAYER_INDEX)
 
         return prediction
 
@@ -575,20 +673,20 @@ def predictWithCustomClassifier(sample):
     global C_PBMODEL
 
     # Does interpreter exist?
-    if C_INTERPRETER == None and C_PBMODEL == None:
-        loadCustomClassifier()
+    with INTERPRETER_LOCK:
+        if C_INTERPRETER == None and C_PBMODEL == None:
+            loadCustomClassifier()
 
     if C_PBMODEL == None:
         vector = embeddings(sample) if C_INPUT_SIZE != 144000 else sample
 
-        # Reshape input tensor
-        C_INTERPRETER.resize_tensor_input(C_INPUT_LAYER_INDEX, [len(vector), *vector[0].shape])
-        C_INTERPRETER.allocate_tensors()
+        # Get interpreter for the input shape
+        interpreter = getAllocatedInterpreter(C_INTERPRETER_CACHE, cfg.CUSTOM_CLASSIFIER, C_INPUT_LAYER_INDEX, [len(vector), *vector[0].shape])
 
         # Make a prediction
-        C_INTERPRETER.set_tensor(C_INPUT_LAYER_INDEX, np.array(vector, dtype="float32"))
-        C_INTERPRETER.invoke()
-        prediction = C_INTERPRETER.get_tensor(C_OUTPUT_LAYER_INDEX)
+        interpreter.set_tensor(C_INPUT_LAYER_INDEX, np.array(vector, dtype="float32"))
+        interpreter.invoke()
+        prediction = interpreter.get_tensor(C_OUTPUT_LAYER_INDEX)
 
         return prediction
     else:
@@ -609,16 +707,16 @@ def embeddings(sample):
     global INTERPRETER
 
     # Does interpreter exist?
-    if INTERPRETER == None:
-        loadModel(False)
+    with INTERPRETER_LOCK:
+        if INTERPRETER == None:
+            loadModel(False)
 
-    # Reshape input tensor
-    INTERPRETER.resize_tensor_input(INPUT_LAYER_INDEX, [len(sample), *sample[0].shape])
-    INTERPRETER.allocate_tensors()
+    # Get interpreter for the input shape
+    interpreter = getAllocatedInterpreter(INTERPRETER_CACHE, cfg.MODEL_PATH, INPUT_LAYER_INDEX, [len(sample), *sample[0].shape])
 
     # Extract feature embeddings
-    INTERPRETER.set_tensor(INPUT_LAYER_INDEX, np.array(sample, dtype="float32"))
-    INTERPRETER.invoke()
-    features = INTERPRETER.get_tensor(OUTPUT_LAYER_INDEX)
+    interpreter.set_tensor(INPUT_LAYER_INDEX, np.ascontiguousarray(sample, dtype="float32"))
+    interpreter.invoke()
+    features = interpreter.get_tensor(OUTPUT_LAYER_INDEX)
 
     return features
@@ -0,0 +1,140 @@
+"""Module with the building blocks of the staged analysis pipeline.
+
+The stages run in threads and are connected by bounded queues,
+so decoding, batching, inference and writing overlap.
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+# Marks the end of the stream of a stage
+END = None
+
+
+class MeteredQueue(queue.Queue):
+    """A bounded queue that records its depth and the waiting times.
+
+    A queue that is mostly full means the consumer is the bottleneck,
+    a queue that is mostly empty means the producer is the bottleneck.
+    """
+
+    def __init__(self, name: str, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.name = name
+        self._stats_lock = threading.Lock()
+        self.puts = 0
+        self.depth_sum = 0
+        self.max_depth = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        t = time.perf_counter()
+        super().put(item, block, timeout)
+        wait = time.perf_counter() - t
+        depth = self.qsize()
+
+        with self._stats_lock:
+            self.puts += 1
+            self.depth_sum += depth
+            self.max_depth = max(self.max_depth, depth)
+            self.put_wait += wait
+
+    def get(self, block=True, timeout=None):
+        t = time.perf_counter()
+        item = super().get(block, timeout)
+
+        with self._stats_lock:
+            self.get_wait += time.perf_counter() - t
+
+        return item
+
+    def stats(self):
+        """Returns the metrics of the queue.
+
+        Returns:
+            A dict with the number of items, the mean and max depth seen by the producers
+            and the seconds the producers and consumers spent waiting.
+        """
+        with self._stats_lock:
+            return {
+                "name": self.name,
+                "size": self.maxsize,
+                "items": self.puts,
+                "mean_depth": self.depth_sum / self.puts if self.puts else 0.0,
+                "max_depth": self.max_depth,
+                "put_wait": self.put_wait,
+                "get_wait": self.get_wait,
+            }
+
+
+class BufferPool:
+    """A fixed set of preallocated arrays that are handed from stage to stage.
+
+    The producer fills a buffer, the consumer releases it when done, so
+    the batches are written in place instead of allocated for every batch.
+    get() blocks while all buffers are in use.
+    """
+
+    def __init__(self, shape: tuple, dtype, count: int):
+        self._free = queue.Queue()
+
+        for _ in range(max(1, count)):
+            self._free.put(np.empty(shape, dtype=dtype))
+
+    def get(self):
+        """Returns a free buffer."""
+        return self._free.get()
+
+    def release(self, buffer: np.ndarray):
+        """Returns a buffer to the pool.
+
+        Args:
+            buffer: A buffer from get().
+        """
+        self._free.put(buffer)
+
+
+def startStage(name: str, target, num_threads: int, *args):
+    """Starts the threads of a stage.
+
+    Args:
+        name: Name of the stage, used for the thread names.
+        target: The function run by each thread.
+        num_threads: Number of threads.
+        *args: Arguments for the function.
+
+    Returns:
+        The list of started threads.
+    """
+    threads = [
+        threading.Thread(target=target, args=args, name=f"{name}-{i}", daemon=True) for i in range(max(1, num_threads))
+    ]
+
+    for t in threads:
+        t.start()
+
+    return threads
+
+
+def formatStats(queues: list[MeteredQueue]):
+    """Formats the metrics of the queues for the log.
+
+    Args:
+        queues: The queues of the pipeline.
+
+    Returns:
+        One line per queue.
+    """
+    lines = []
+
+    for q in queues:
+        s = q.stats()
+        lines.append(
+            f"{s['name']:<10} items {s['items']:>6}  depth mean {s['mean_depth']:5.1f} max {s['max_depth']:>3}/{s['size'] or '-'}"
+            f"  producers waited {s['put_wait']:7.2f}s  consumers waited {s['get_wait']:7.2f}s"
+        )
+
+    return "\n".join(lines)
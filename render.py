@@ -0,0 +1,522 @@
+"""Module to create result files from saved scores.
+
+Renders the score files written by analyze.py --save_scores with new settings
+for confidence, sensitivity, species list or result type, without decoding audio or running the model.
+A sweep renders many such settings from one pass over the scores.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import analyze
+import config as cfg
+import model
+import scores
+import species
+import utils
+
+# Number of windows that are thresholded at a time
+CHUNK_SIZE = 4096
+
+# The settings a sweep configuration can change
+SWEEP_KEYS = [
+    "MIN_CONFIDENCE",
+    "SIGMOID_SENSITIVITY",
+    "LATITUDE",
+    "LONGITUDE",
+    "WEEK",
+    "LOCATION_FILTER_THRESHOLD",
+    "SPECIES_LIST_FILE",
+    "SPECIES_LIST",
+]
+
+
+def loadLabels(labels_file: str, locale: str):
+    """Loads the labels that belong to a score file.
+
+    Args:
+        labels_file: The labels file from the header of the score file.
+        locale: Locale for translated species common names.
+    """
+    if labels_file.endswith(".csv"):
+        # Labels of a custom classifier in the protobuf format
+        cfg.LABELS = [line.split(",")[1] for line in utils.readLines(labels_file)]
+    else:
+        cfg.LABELS = utils.readLines(labels_file)
+
+    cfg.LABELS_FILE = labels_file
+
+    lfile = os.path.join(cfg.TRANSLATED_LABELS_PATH, os.path.basename(labels_file).replace(".txt", f"_{locale}.txt"))
+
+    if not locale in ["en"] and os.path.isfile(lfile):
+        cfg.TRANSLATED_LABELS = utils.readLines(lfile)
+    else:
+        cfg.TRANSLATED_LABELS = cfg.LABELS
+
+
+def loadSpeciesList(lat: float, lon: float, week: int, slist: str, sf_thresh: float, script_dir: str):
+    """Loads the species list from the location filter or a file.
+
+    Args:
+        lat: The latitude or -1.
+        lon: The longitude or -1.
+        week: The week of the year or -1.
+        slist: Path to species list file or folder, relative to the script, or "".
+        sf_thresh: Threshold of the location filter.
+        script_dir: Folder of the script.
+
+    Returns:
+        The species list file or None and the species list.
+    """
+    if lat == -1 and lon == -1:
+        if not slist:
+            return None, []
+
+        slist_file = os.path.join(script_dir, slist)
+
+        if os.path.isdir(slist_file):
+            slist_file = os.path.join(slist_file, "species_list.txt")
+
+        return slist_file, utils.readLines(slist_file)
+
+    return None, species.getSpeciesList(lat, lon, week, sf_thresh)
+
+
+def loadSweep(path: str, args, script_dir: str):
+    """Reads the configurations of a sweep.
+
+    The sweep file is a JSON list of objects with any of the keys name, sensitivity,
+    min_conf, slist, lat, lon, week and sf_thresh. Missing keys default to the command line arguments.
+
+    Args:
+        path: Path to the sweep file.
+        args: The parsed command line arguments.
+        script_dir: Folder of the script.
+
+    Returns:
+        A list of dicts with the name and the SWEEP_KEYS settings of each configuration.
+    """
+    with open(path, "r") as f:
+        entries = json.load(f)
+
+    configs = []
+    species_lists = {}
+
+    for i, entry in enumerate(entries):
+        e = {k: entry.get(k, getattr(args, k)) for k in ["sensitivity", "min_conf", "slist", "lat", "lon", "week", "sf_thresh"]}
+        sf_thresh = max(0.01, min(0.99, float(e["sf_thresh"])))
+
+        # The location filter runs once per location
+        key = (e["lat"], e["lon"], e["week"], e["slist"], sf_thresh)
+
+        if key not in species_lists:
+            species_lists[key] = loadSpeciesList(e["lat"], e["lon"], e["week"], e["slist"], sf_thresh, script_dir)
+
+        configs.append(
+            {
+                "name": str(entry.get("name", f"config_{i + 1}")),
+                "MIN_CONFIDENCE": max(0.01, min(0.99, float(e["min_conf"]))),
+                "SIGMOID_SENSITIVITY": max(0.5, min(1.0 - (float(e["sensitivity"]) - 1.0), 1.5)),
+                "LATITUDE": e["lat"],
+                "LONGITUDE": e["lon"],
+                "WEEK": e["week"],
+                "LOCATION_FILTER_THRESHOLD": sf_thresh,
+                "SPECIES_LIST_FILE": species_lists[key][0],
+                "SPECIES_LIST": species_lists[key][1],
+            }
+        )
+
+    if len({c["name"] for c in configs}) < len(configs):
+        raise ValueError(f"The configurations in {path} need unique names.")
+
+    return configs
+
+
+def getSweepOutputPath(output_path: str, name: str):
+    """Returns the output path of a sweep configuration.
+
+    Each configuration writes into a subfolder named after it.
+
+    Args:
+        output_path: The output path of the sweep.
+        name: Name of the configuration.
+
+    Returns:
+        The output folder, or file if output_path is a file.
+    """
+    if output_path.rsplit(".", 1)[-1].lower() in ["txt", "csv", "bin"]:
+        return os.path.join(os.path.dirname(output_path), name, os.path.basename(output_path))
+
+    return os.path.join(output_path, name)
+
+
+def getResultFileName(score_path: str):
+    """Returns the path of the result file for a score file.
+
+    Args:
+        score_path: Path to the score file.
+
+    Returns:
+        The path to the result file.
+    """
+    # Output path is a file?
+    if cfg.OUTPUT_PATH.rsplit(".", 1)[-1].lower() in ["txt", "csv", "bin"]:
+        return cfg.OUTPUT_PATH
+
+    if os.path.isdir(cfg.INPUT_PATH):
+        rpath = os.path.relpath(score_path, cfg.INPUT_PATH)
+    else:
+        rpath = os.path.basename(score_path)
+
+    return os.path.join(cfg.OUTPUT_PATH, rpath[: -len(scores.SCORE_FILE_SUFFIX)] + analyze.getResultFileSuffix())
+
+
+def loadScores(score_path: str):
+    """Reads a score file and sets the settings of its analysis that show up in the results.
+
+    Args:
+        score_path: Path to the score file.
+
+    Returns:
+        The header and the memory-mapped logits, see scores.loadScoreFile.
+    """
+    header, logits = scores.loadScoreFile(score_path)
+
+    if logits.shape[1] != len(cfg.LABELS):
+        raise ValueError(f"Score file has {logits.shape[1]} classes, but {cfg.LABELS_FILE} has {len(cfg.LABELS)} labels.")
+
+    cfg.SIG_LENGTH = header["sig_length"]
+    cfg.SIG_OVERLAP = header["sig_overlap"]
+    cfg.BANDPASS_FMIN = header["bandpass_fmin"]
+    cfg.BANDPASS_FMAX = header["bandpass_fmax"]
+    cfg.MODEL_PATH = header["model"]
+
+    return header, logits
+
+
+def getLocation(header: dict):
+    """Returns the location and week of the recording of a score file.
+
+    Args:
+        header: The header of the score file.
+
+    Returns:
+        The (lat, lon, week) or None if the score file is older than the stored location.
+    """
+    return (header["lat"], header["lon"], header["week"]) if "lat" in header else None
+
+
+def getFileSpeciesMask(header: dict, species_mask, lat: float, lon: float, threshold: float):
+    """Selects the species mask of a score file like analyze.getSpeciesMask does for an audio file.
+
+    A recording with a location in its score header gets the mask of the location filter,
+    unless the settings have a location of their own.
+
+    Args:
+        header: The header of the score file.
+        species_mask: Boolean vector over the classes of the settings or None.
+        lat: The latitude of the settings or -1.
+        lon: The longitude of the settings or -1.
+        threshold: Threshold of the location filter.
+
+    Returns:
+        A boolean vector over cfg.LABELS or None if there is no species list.
+    """
+    location = getLocation(header)
+
+    if location is None or lat != -1 or lon != -1 or (location[0] == -1 and location[1] == -1):
+        return species_mask
+
+    return analyze._locationMask(*location, threshold, cfg.LABELS_FILE)
+
+
+def renderFile(score_path: str, species_mask=None):
+    """Creates the result file of a score file with the current settings.
+
+    The location and week of the recording are taken from the score header, see getFileSpeciesMask.
+
+    Args:
+        score_path: Path to the score file.
+        species_mask: Boolean vector over the classes, see analyze.getSpeciesMask.
+
+    Returns:
+        The (result file, audio file, duration) of the rendered file, see analyze.combineResults, or None if it failed.
+    """
+    try:
+        header, logits = loadScores(score_path)
+        species_mask = getFileSpeciesMask(header, species_mask, cfg.LATITUDE, cfg.LONGITUDE, cfg.LOCATION_FILTER_THRESHOLD)
+        detections = []
+
+        for i in range(0, len(logits), CHUNK_SIZE):
+            chunk = np.asarray(logits[i : i + CHUNK_SIZE])
+
+            # Sigmoid and sensitivity are applied now
+            if header["apply_sigmoid"]:
+                chunk = model.flat_sigmoid(chunk, sensitivity=-cfg.SIGMOID_SENSITIVITY)
+
+            detections.append(
+                analyze.extractDetections(chunk, scores.getTimestamps(header, i, len(chunk)), species_mask)
+            )
+
+        detections = np.concatenate(detections) if detections else np.empty(0, dtype=analyze.DETECTION_DTYPE)
+
+        result_file = getResultFileName(score_path)
+        duration = header.get("duration")
+        analyze.saveResultFile(detections, result_file, header["audio_file"], header["sample_rate"], duration, getLocation(header))
+
+    except Exception as ex:
+        # Write error log
+        print(f"Error: Cannot render scores of {score_path}.\n", flush=True)
+        utils.writeErrorLog(ex)
+
+        return None
+
+    print(f"Rendered {header['audio_file']}", flush=True)
+
+    return result_file, header["audio_file"], duration
+
+
+def renderSweep(score_path: str, configs: list[dict], species_masks: list, output_path: str):
+    """Creates the result files of a score file for every configuration of a sweep.
+
+    The scores are read once. The sigmoid is computed once per distinct sensitivity
+    for all of them at the same time, every configuration then applies its threshold and species mask.
+    The settings of the configurations are only set while their result files are saved.
+
+    Args:
+        score_path: Path to the score file.
+        configs: The configurations, see loadSweep.
+        species_masks: Boolean vector over the classes or None per configuration.
+        output_path: The output path of the sweep, see getSweepOutputPath.
+
+    Returns:
+        The (result file, audio file, duration) of every configuration, or None if it failed.
+    """
+    previous = {k: getattr(cfg, k) for k in SWEEP_KEYS}
+
+    try:
+        header, logits = loadScores(score_path)
+        species_masks = [
+            getFileSpeciesMask(header, species_masks[n], c["LATITUDE"], c["LONGITUDE"], c["LOCATION_FILTER_THRESHOLD"])
+            for n, c in enumerate(configs)
+        ]
+        sensitivities = sorted({c["SIGMOID_SENSITIVITY"] for c in configs}) if header["apply_sigmoid"] else [None]
+        sensitivity_index = [sensitivities.index(c["SIGMOID_SENSITIVITY"] if header["apply_sigmoid"] else None) for c in configs]
+        chunk_size = max(1, CHUNK_SIZE // len(sensitivities))
+        detections = [[] for _ in configs]
+
+        for i in range(0, len(logits), chunk_size):
+            chunk = np.asarray(logits[i : i + chunk_size])
+            timestamps = scores.getTimestamps(header, i, len(chunk))
+
+            # (sensitivities, windows, classes)
+            if header["apply_sigmoid"]:
+                p = model.flat_sigmoid(chunk[np.newaxis], sensitivity=-np.array(sensitivities, dtype=chunk.dtype)[:, np.newaxis, np.newaxis])
+            else:
+                p = chunk[np.newaxis]
+
+            for n, c in enumerate(configs):
+                detections[n].append(
+                    analyze.extractDetections(p[sensitivity_index[n]], timestamps, species_masks[n], c["MIN_CONFIDENCE"])
+                )
+
+        duration = header.get("duration")
+        entries = []
+
+        for n, c in enumerate(configs):
+            for k in SWEEP_KEYS:
+                setattr(cfg, k, c[k])
+
+            cfg.OUTPUT_PATH = getSweepOutputPath(output_path, c["name"])
+            result_file = getResultFileName(score_path)
+            d = np.concatenate(detections[n]) if detections[n] else np.empty(0, dtype=analyze.DETECTION_DTYPE)
+            analyze.saveResultFile(d, result_file, header["audio_file"], header["sample_rate"], duration, getLocation(header))
+            entries.append((result_file, header["audio_file"], duration))
+
+    except Exception as ex:
+        # Write error log
+        print(f"Error: Cannot render scores of {score_path}.\n", flush=True)
+        utils.writeErrorLog(ex)
+
+        return None
+
+    finally:
+        cfg.OUTPUT_PATH = output_path
+
+        for k, v in previous.items():
+            setattr(cfg, k, v)
+
+    print(f"Rendered {header['audio_file']} with {len(configs)} configurations", flush=True)
+
+    return entries
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Create result files from scores saved by analyze.py --save_scores.")
+    parser.add_argument("--i", default="example/", help="Path to score file or folder. If this is a file, --o needs to be a file too.")
+    parser.add_argument("--o", default="example/", help="Path to output file or folder. If this is a file, --i needs to be a file too.")
+    parser.add_argument("--lat", type=float, default=-1, help="Recording location latitude. Set -1 to ignore.")
+    parser.add_argument("--lon", type=float, default=-1, help="Recording location longitude. Set -1 to ignore.")
+    parser.add_argument(
+        "--week",
+        type=int,
+        default=-1,
+        help="Week of the year when the recording was made. Values in [1, 48] (4 weeks per month). Set -1 for year-round species list.",
+    )
+    parser.add_argument(
+        "--slist",
+        default="",
+        help='Path to species list file or folder. If folder is provided, species list needs to be named "species_list.txt". If lat and lon are provided, this list will be ignored.',
+    )
+    parser.add_argument(
+        "--sensitivity",
+        type=float,
+        default=1.0,
+        help="Detection sensitivity; Higher values result in higher sensitivity. Values in [0.5, 1.5]. Defaults to 1.0.",
+    )
+    parser.add_argument(
+        "--min_conf",
+        type=float,
+        default=0.1,
+        help="Minimum confidence threshold. Values in [0.01, 0.99]. Defaults to 0.1.",
+    )
+    parser.add_argument(
+        "--rtype",
+        default="table",
+        help="Specifies output format. Values in ['table', 'audacity', 'r',  'kaleidoscope', 'csv', 'columnar']. Defaults to 'table' (Raven selection table).",
+    )
+    parser.add_argument(
+        "--output_file",
+        default=None,
+        help="Name of the combined result file in the output folder. If set, all results will be combined into this file. Defaults to None.",
+    )
+    parser.add_argument(
+        "--locale",
+        default="en",
+        help="Locale for translated species common names. Values in ['af', 'en_UK', 'de', 'it', ...] Defaults to 'en' (US English).",
+    )
+    parser.add_argument(
+        "--sf_thresh",
+        type=float,
+        default=0.03,
+        help="Minimum species occurrence frequency threshold for location filter. Values in [0.01, 0.99]. Defaults to 0.03.",
+    )
+    parser.add_argument(
+        "--sweep",
+        default=None,
+        help="Path to a JSON list of configurations with any of the keys name, sensitivity, min_conf, slist, lat, lon, week and sf_thresh. "
+        "All of them are rendered from one pass over the scores, each into a subfolder of --o named after it. Defaults to None.",
+    )
+
+    args = parser.parse_args()
+
+    # Set paths relative to script path
+    script_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
+    cfg.MDATA_MODEL_PATH = os.path.join(script_dir, cfg.MDATA_MODEL_PATH)
+    cfg.CODES_FILE = os.path.join(script_dir, cfg.CODES_FILE)
+    cfg.TRANSLATED_LABELS_PATH = os.path.join(script_dir, cfg.TRANSLATED_LABELS_PATH)
+    cfg.ERROR_LOG_FILE = os.path.join(script_dir, cfg.ERROR_LOG_FILE)
+
+    # Load eBird codes
+    cfg.CODES = analyze.loadCodes()
+
+    # Set input and output path
+    cfg.INPUT_PATH = args.i
+    cfg.OUTPUT_PATH = args.o
+
+    # Parse input files
+    if os.path.isdir(cfg.INPUT_PATH):
+        cfg.FILE_LIST = utils.collect_all_files(cfg.INPUT_PATH, ["npy"], pattern=scores.SCORE_FILE_SUFFIX[1:])
+        print(f"Found {len(cfg.FILE_LIST)} score files to render")
+    else:
+        cfg.FILE_LIST = [cfg.INPUT_PATH]
+
+    # Set confidence threshold
+    cfg.MIN_CONFIDENCE = max(0.01, min(0.99, float(args.min_conf)))
+
+    # Set sensitivity
+    cfg.SIGMOID_SENSITIVITY = max(0.5, min(1.0 - (float(args.sensitivity) - 1.0), 1.5))
+
+    # Set result type
+    cfg.RESULT_TYPE = args.rtype.lower()
+
+    if not cfg.RESULT_TYPE in ["table", "audacity", "r", "kaleidoscope", "csv", "columnar"]:
+        cfg.RESULT_TYPE = "table"
+
+    # Set output file
+    if args.output_file is not None:
+        cfg.OUTPUT_FILE = args.output_file
+    else:
+        cfg.OUTPUT_FILE = None
+
+    # Load species list from location filter or provided list
+    cfg.LATITUDE, cfg.LONGITUDE, cfg.WEEK = args.lat, args.lon, args.week
+    cfg.LOCATION_FILTER_THRESHOLD = max(0.01, min(0.99, float(args.sf_thresh)))
+
+    cfg.SPECIES_LIST_FILE, cfg.SPECIES_LIST = loadSpeciesList(
+        cfg.LATITUDE, cfg.LONGITUDE, cfg.WEEK, args.slist, cfg.LOCATION_FILTER_THRESHOLD, script_dir
+    )
+
+    # Load the configurations of the sweep
+    configs = loadSweep(args.sweep, args, script_dir) if args.sweep else None
+
+    # Render files, the labels can differ between models
+    labels_file = None
+    rendered = []
+    swept = {c["name"]: [] for c in configs} if configs else None
+
+    for score_path in cfg.FILE_LIST:
+        try:
+            header = scores.loadScoreFile(score_path)[0]
+
+        except Exception as ex:
+            print(f"Error: Cannot read score file {score_path}.\n", flush=True)
+            utils.writeErrorLog(ex)
+            continue
+
+        if header["labels_file"] != labels_file:
+            labels_file = header["labels_file"]
+            loadLabels(labels_file, args.locale)
+            species_mask = analyze.getSpeciesMask()
+
+            if configs:
+                species_masks = [np.isin(np.array(cfg.LABELS), np.array(c["SPECIES_LIST"])) if c["SPECIES_LIST"] else None for c in configs]
+
+        if configs:
+            entries = renderSweep(score_path, configs, species_masks, args.o)
+
+            for c, entry in zip(configs, entries or []):
+                swept[c["name"]].append(entry)
+
+            continue
+
+        entry = renderFile(score_path, species_mask)
+
+        if entry is not None:
+            rendered.append(entry)
+
+    # Combine results?
+    if not cfg.OUTPUT_FILE is None:
+        if configs:
+            for c in configs:
+                for k in SWEEP_KEYS:
+                    setattr(cfg, k, c[k])
+
+                print(f"Combining results of {c['name']} into {cfg.OUTPUT_FILE}...", end="", flush=True)
+                output_path = getSweepOutputPath(args.o, c["name"])
+                analyze.combineResults(output_path, cfg.OUTPUT_FILE, sorted(swept[c["name"]], key=lambda e: e[1]))
+                print("done!", flush=True)
+        else:
+            print(f"Combining results into {cfg.OUTPUT_FILE}...", end="", flush=True)
+            analyze.combineResults(cfg.OUTPUT_PATH, cfg.OUTPUT_FILE, sorted(rendered, key=lambda e: e[1]))
+            print("done!", flush=True)
+
+    # A few examples to test
+    # python3 analyze.py --i example/ --o example/ --save_scores
+    # python3 render.py --i example/ --o example/ --min_conf 0.5 --rtype csv
+    # python3 render.py --i example/ --o example/ --lat 42.5 --lon -76.45 --week 4 --sensitivity 1.25 --rtype r
+    # python3 render.py --i example/ --o example/sweep/ --sweep example/sweep.json --output_file BirdNET_results.txt
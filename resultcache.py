@@ -0,0 +1,215 @@
+"""Module to cache the results of the server by file content and settings.
+
+Results are kept in a bounded in-memory LRU and, with a cache file, in a
+SQLite file that is shared by restarts and other server processes. Entries
+expire after a time to live.
+"""
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    created REAL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS results_created ON results (created);
+"""
+
+# Bytes hashed at once
+_CHUNK_SIZE = 1 << 20
+
+
+def makeKey(f, params: dict):
+    """Hashes the content of a file together with the settings of its analysis.
+
+    Args:
+        f: The file-like object, read from its start. The position is restored.
+        params: The settings that change the results, must be JSON serializable.
+
+    Returns:
+        The key as hex string.
+    """
+    h = hashlib.sha256()
+    position = f.tell()
+    f.seek(0)
+
+    for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+        h.update(chunk)
+
+    f.seek(position)
+    h.update(json.dumps(params, sort_keys=True).encode())
+
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Caches JSON serializable results by key.
+
+    Thread-safe. The statistics count memory and disk hits, misses, entries
+    that were evicted from memory and entries that expired.
+    """
+
+    def __init__(self, max_entries=1000, cache_file=None, ttl=7 * 24 * 3600):
+        """Creates the cache and removes the expired entries of the cache file.
+
+        Args:
+            max_entries: Maximum number of entries in memory.
+            cache_file: Path to the SQLite file, None to cache in memory only.
+            ttl: Time to live of the entries in seconds.
+        """
+        self.max_entries = max(0, int(max_entries))
+        self.cache_file = cache_file
+        self.ttl = float(ttl)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+        if cache_file:
+            self._purge()
+
+    def get(self, key: str):
+        """Returns the value of a key.
+
+        Args:
+            key: The key, see makeKey.
+
+        Returns:
+            The value or None if it is not cached or expired.
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+
+                    return entry[1]
+
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+        entry = self._load(key) if self.cache_file else None
+
+        if entry is not None and now - entry[0] < self.ttl:
+            with self._lock:
+                self._stats["disk_hits"] += 1
+                self._remember(key, entry)
+
+            return entry[1]
+
+        with self._lock:
+            self._stats["misses"] += 1
+
+        return None
+
+    def put(self, key: str, value):
+        """Caches a value.
+
+        Args:
+            key: The key, see makeKey.
+            value: The value.
+        """
+        entry = (time.time(), value)
+
+        with self._lock:
+            self._remember(key, entry)
+
+        if self.cache_file:
+            self._store(key, entry)
+
+    def getStats(self):
+        """Returns the hits, misses, evictions and the number of entries in memory."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                **{k: self._stats[k] for k in ["memory_hits", "disk_hits", "misses", "evicted", "expired"]},
+            }
+
+    def _remember(self, key: str, entry: tuple):
+        """Adds an entry to the memory and evicts the least recently used ones. Needs the lock."""
+        if self.max_entries == 0:
+            return
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evicted"] += 1
+
+    def _connect(self):
+        """Opens the cache file and creates it if needed.
+
+        Returns:
+            The database connection.
+        """
+        if os.path.dirname(self.cache_file):
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+
+        db = sqlite3.connect(self.cache_file, timeout=30)
+        db.executescript(_SCHEMA)
+
+        return db
+
+    def _load(self, key: str):
+        """Reads an entry from the cache file.
+
+        Returns:
+            The (created, value) or None.
+        """
+        try:
+            db = self._connect()
+
+            try:
+                row = db.execute("SELECT created, value FROM results WHERE key = ?", (key,)).fetchone()
+            finally:
+                db.close()
+
+        # The cache is only an optimization, the file is analyzed instead
+        except sqlite3.Error:
+            return None
+
+        return (row[0], json.loads(row[1])) if row else None
+
+    def _store(self, key: str, entry: tuple):
+        """Writes an entry to the cache file and removes the expired ones."""
+        try:
+            db = self._connect()
+
+            try:
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, entry[0], json.dumps(entry[1])))
+                expired = db.execute("DELETE FROM results WHERE created < ?", (entry[0] - self.ttl,)).rowcount
+                db.commit()
+            finally:
+                db.close()
+
+        except sqlite3.Error:
+            return
+
+        with self._lock:
+            self._stats["expired"] += expired
+
+    def _purge(self):
+        """Removes the expired entries from the cache file."""
+        try:
+            db = self._connect()
+
+            try:
+                expired = db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,)).rowcount
+                db.commit()
+            finally:
+                db.close()
+
+        except sqlite3.Error:
+            return
+
+        self._stats["expired"] += expired
@@ -0,0 +1,170 @@
+"""Module to cache the raw model outputs of the analysis.
+
+The scores of a file are stored as .npy array with one row per window, which
+can be memory-mapped, and a small JSON header with the analysis settings.
+Result files can then be rendered again with other settings without inference.
+"""
+import datetime
+import json
+import os
+import struct
+
+import numpy as np
+
+import config as cfg
+
+# Fixed size of the .npy header, so rows can be written before the number of windows is known
+NPY_HEADER_SIZE = 128
+
+SCORE_FILE_SUFFIX = ".BirdNET.scores.npy"
+
+
+def getHeaderPath(path: str):
+    """Returns the path of the JSON header of a score file.
+
+    Args:
+        path: Path to the score file.
+
+    Returns:
+        The path to the header.
+    """
+    return path.rsplit(".", 1)[0] + ".json"
+
+
+def _npyHeader(num_windows: int, num_classes: int):
+    """Makes a .npy header of NPY_HEADER_SIZE bytes for a float32 array.
+
+    Args:
+        num_windows: Number of rows.
+        num_classes: Number of columns.
+
+    Returns:
+        The header bytes.
+    """
+    header = repr({"descr": "<f4", "fortran_order": False, "shape": (num_windows, num_classes)})
+    header = header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def openScoreFile(path: str, num_classes: int):
+    """Opens a score file for writing.
+
+    Several processes can write the rows of different shards into the same file.
+    The header is only completed by finishScoreFile, until then the file looks empty.
+
+    Args:
+        path: Path to the score file.
+        num_classes: Number of classes.
+
+    Returns:
+        The opened file.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # A header left from an earlier analysis would mark the file as complete
+    if os.path.exists(getHeaderPath(path)):
+        os.remove(getHeaderPath(path))
+
+    # Open without truncating, the rows of other shards may already be written
+    f = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)), "r+b")
+    f.write(_npyHeader(0, num_classes))
+
+    return f
+
+
+def writeScores(f, first_window: int, scores: np.ndarray):
+    """Writes consecutive rows into a score file.
+
+    Args:
+        f: The file, see openScoreFile.
+        first_window: Index of the first row.
+        scores: The scores with shape (windows, classes).
+    """
+    scores = np.ascontiguousarray(scores, dtype="<f4")
+
+    f.seek(NPY_HEADER_SIZE + first_window * scores.shape[1] * 4)
+    f.write(scores.tobytes())
+
+
+def finishScoreFile(
+    path: str, num_windows: int, num_classes: int, afile_path: str, sample_rate: int, duration=None, location=None
+):
+    """Completes a score file and writes its header.
+
+    Args:
+        path: Path to the score file.
+        num_windows: Number of windows of the file.
+        num_classes: Number of classes.
+        afile_path: Path to the audio file.
+        sample_rate: Native sample rate of the audio file.
+        duration: Duration of the audio file in seconds.
+        location: The (lat, lon, week) of the recording or None, see analyze.getFileLocation.
+    """
+    with open(path, "r+b") as f:
+        f.write(_npyHeader(num_windows, num_classes))
+        f.truncate(NPY_HEADER_SIZE + num_windows * num_classes * 4)
+
+    header = {
+        "version": 1,
+        "audio_file": afile_path,
+        "sample_rate": sample_rate,
+        "duration": duration,
+        "model_version": cfg.MODEL_VERSION,
+        "model": os.path.basename(cfg.MODEL_PATH),
+        "custom_classifier": cfg.CUSTOM_CLASSIFIER,
+        "labels_file": cfg.LABELS_FILE,
+        "num_classes": num_classes,
+        "apply_sigmoid": cfg.APPLY_SIGMOID,
+        "sig_length": cfg.SIG_LENGTH,
+        "sig_overlap": cfg.SIG_OVERLAP,
+        "sig_minlen": cfg.SIG_MINLEN,
+        "bandpass_fmin": cfg.BANDPASS_FMIN,
+        "bandpass_fmax": cfg.BANDPASS_FMAX,
+        "num_windows": num_windows,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+
+    if location is not None:
+        header.update(zip(["lat", "lon", "week"], location))
+
+    with open(getHeaderPath(path), "w") as f:
+        json.dump(header, f, indent=2)
+
+
+def loadScoreFile(path: str):
+    """Loads a score file.
+
+    Args:
+        path: Path to the score file.
+
+    Returns:
+        The header and the memory-mapped scores with shape (windows, classes).
+    """
+    with open(getHeaderPath(path), "r") as f:
+        header = json.load(f)
+
+    return header, np.load(path, mmap_mode="r")
+
+
+def getTimestamps(header: dict, first_window=0, num_windows=None):
+    """Computes the (start, end) of the windows of a score file.
+
+    The windows follow the grid of the analysis, see analyze._batchStage.
+
+    Args:
+        header: The header, see loadScoreFile.
+        first_window: Index of the first window.
+        num_windows: Number of windows, defaults to all remaining windows.
+
+    Returns:
+        The timestamps with shape (windows, 2).
+    """
+    if num_windows is None:
+        num_windows = header["num_windows"] - first_window
+
+    step = header["sig_length"] - header["sig_overlap"]
+    start = np.arange(first_window, first_window + num_windows) * step
+
+    return np.stack((start, start + header["sig_length"]), axis=1)
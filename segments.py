@@ -5,13 +5,13 @@ Can be used to save the segments of the audio files for each detection.
 import argparse
 import multiprocessing
 import os
-from multiprocessing import Pool
 
 import numpy as np
 
 import audio
 import config as cfg
 import utils
+import workers
 
 # Set numpy random seed
 np.random.seed(cfg.RANDOM_SEED)
@@ -201,13 +201,16 @@ def extractSegments(item: tuple[tuple[str, list[dict]], float, dict[str]]):
     Creates an audio file for each species segment.
 
     Args:
-        item: A tuple that contains ((audio file path, segments), segment length, config)
+        item: A tuple that contains ((audio file path, segments), segment length[, config]).
+              Pool workers get the config from workers.initWorker.
     """
     # Paths and config
     afile = item[0][0]
     segments = item[0][1]
     seg_length = item[1]
-    cfg.setConfig(item[2])
+
+    if len(item) > 2:
+        cfg.setConfig(item[2])
 
     # Status
     print(f"Extracting segments from {afile}")
@@ -288,19 +291,19 @@ if __name__ == "__main__":
     # Parse file list and make list of segments
     cfg.FILE_LIST = parseFiles(cfg.FILE_LIST, max(1, int(args.max_segments)))
 
-    # Add config items to each file list entry.
-    # We have to do this for Windows which does not
-    # support fork() and thus each process has to
-    # have its own config. USE LINUX!
-    flist = [(entry, max(cfg.SIG_LENGTH, float(args.seg_length)), cfg.getConfig()) for entry in cfg.FILE_LIST]
+    # Add segment length to each file list entry
+    flist = [(entry, max(cfg.SIG_LENGTH, float(args.seg_length))) for entry in cfg.FILE_LIST]
 
     # Extract segments
     if cfg.CPU_THREADS < 2:
         for entry in flist:
             extractSegments(entry)
     else:
-        with Pool(cfg.CPU_THREADS) as p:
-            p.map(extractSegments, flist)
+        # Workers restore the config once, no model needed
+        for _ in workers.imapUnordered(extractSegments, flist, cfg.CPU_THREADS, cfg.getConfig()):
+            pass
+
+        workers.shutdown()
 
     # A few examples to test
     # python3 segments.py --audio example/ --results example/ --o example/segments/
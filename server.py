@@ -3,25 +3,286 @@
 Can be used to start up a server and feed it classification requests.
 """
 import argparse
+import collections
+import concurrent.futures
 import json
 import os
+import queue
+import shutil
+import socketserver
 import tempfile
+import threading
+import time
+import uuid
 from datetime import date, datetime
 from multiprocessing import freeze_support
+from wsgiref import simple_server
 
 import bottle
+import numpy as np
 
-import analyze
+import audio
 import config as cfg
-import species
+import resultcache
 import utils
+from analyzer import Analyzer
 
 
-def resultPooling(lines: list[str], num_results=5, pmode="avg"):
-    """Parses the results into list of (species, score).
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, simple_server.WSGIServer):
+    """WSGI server that handles every connection in its own thread."""
+
+    daemon_threads = True
+
+
+# The preloaded Analyzer, the pool that runs the analyses, the optional batcher and the job queue, set by the main function
+ANALYZER = None
+POOL = None
+BATCHER = None
+JOBS = None
+
+# Folder of the files that jobs may analyze by path, None to allow uploads only
+JOB_ROOT = None
+
+# Number of finished jobs whose results are kept
+MAX_FINISHED_JOBS = 1000
+
+# The cache of the results of /analyze, None to analyze every request
+RESULTS = None
+
+# Analyzer settings that change the results, part of the cache key
+CACHE_KEYS = [
+    "MODEL_PATH",
+    "CUSTOM_CLASSIFIER",
+    "LOCALE",
+    "LATITUDE",
+    "LONGITUDE",
+    "WEEK",
+    "LOCATION_FILTER_THRESHOLD",
+    "SIGMOID_SENSITIVITY",
+    "MIN_CONFIDENCE",
+    "SIG_OVERLAP",
+    "BANDPASS_FMIN",
+    "BANDPASS_FMAX",
+    "RESAMPLE_TYPE",
+]
+
+
+def warmUp(analyzer, barrier: threading.Barrier):
+    """Loads the interpreters of a worker of the pool.
+
+    Waits for the other workers, so every worker gets one call.
+
+    Args:
+        analyzer: The Analyzer of the server.
+        barrier: Barrier for all workers.
+    """
+    analyzer.predict(np.zeros((analyzer.config["BATCH_SIZE"], int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE)), dtype="float32"))
+    barrier.wait()
+
+
+def startPool(analyzer, workers: int):
+    """Starts the workers and loads their interpreters before the first request.
+
+    Args:
+        analyzer: The Analyzer of the server.
+        workers: Number of workers.
+
+    Returns:
+        The executor.
+    """
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+    barrier = threading.Barrier(workers)
+
+    for f in [pool.submit(warmUp, analyzer, barrier) for _ in range(workers)]:
+        f.result()
+
+    return pool
+
+
+class MicroBatcher:
+    """Runs the windows of concurrent requests through the model in shared batches.
+
+    Requests hand their windows to predict, which blocks until the logits are ready.
+    Each inference thread takes the queued windows of all requests, up to max_batch_size
+    windows, and waits at most max_delay seconds for more after the first ones arrived.
+    The windows are copied into a buffer of max_batch_size windows and the whole buffer
+    is predicted, so the interpreters keep their input shape.
+    """
+
+    def __init__(self, analyzer, max_batch_size: int, max_delay: float, workers=1):
+        """Starts the inference threads and loads their interpreters.
+
+        Args:
+            analyzer: The Analyzer of the server.
+            max_batch_size: Maximum number of windows per batch.
+            max_delay: Maximum time in seconds that windows wait for others.
+            workers: Number of inference threads.
+        """
+        self.analyzer = analyzer
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_delay = max(0.0, float(max_delay))
+
+        # Number of batches and windows so far
+        self.batches = 0
+        self.windows = 0
+
+        self._queue = queue.Queue()
+
+        # Only one thread collects a batch at a time, the item that did not fit is kept for the next one
+        self._lock = threading.Lock()
+        self._pending = None
+
+        barrier = threading.Barrier(max(1, workers) + 1)
+        self._threads = [
+            threading.Thread(target=self._run, args=(barrier,), name=f"batcher-{i}", daemon=True) for i in range(max(1, workers))
+        ]
+
+        for t in self._threads:
+            t.start()
+
+        barrier.wait()
+
+    def predict(self, windows: np.ndarray):
+        """Predicts the logits of windows together with those of other requests.
+
+        Args:
+            windows: The windows with shape (windows, samples).
+
+        Returns:
+            The logits with shape (windows, classes).
+        """
+        futures = []
+
+        for i in range(0, len(windows), self.max_batch_size):
+            f = concurrent.futures.Future()
+            self._queue.put((windows[i : i + self.max_batch_size], f))
+            futures.append(f)
+
+        return np.concatenate([f.result() for f in futures])
+
+    def close(self):
+        """Stops the inference threads after the queued windows."""
+        self._queue.put(None)
+
+        for t in self._threads:
+            t.join()
+
+    def _collect(self):
+        """Waits for the windows of the next batch.
+
+        Returns:
+            A list of (windows, future) or None if the batcher was closed.
+        """
+        with self._lock:
+            item = self._pending or self._queue.get()
+            self._pending = None
+
+            # Leave the stop signal for the other threads
+            if item is None:
+                self._queue.put(None)
+
+                return None
+
+            items = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + self.max_delay
+
+            while size < self.max_batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+                if item is None:
+                    self._queue.put(None)
+
+                    break
+
+                if size + len(item[0]) > self.max_batch_size:
+                    self._pending = item
+
+                    break
+
+                items.append(item)
+                size += len(item[0])
+
+            self.batches += 1
+            self.windows += size
+
+            return items
+
+    def _run(self, barrier: threading.Barrier):
+        """Predicts batches until the batcher is closed.
+
+        Args:
+            barrier: Barrier for all threads and the constructor.
+        """
+        # Load the interpreters of this thread
+        batch = np.zeros((self.max_batch_size, int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE)), dtype="float32")
+        self.analyzer.predict(batch)
+        barrier.wait()
+
+        while True:
+            items = self._collect()
+
+            if items is None:
+                break
+
+            # Rows after the windows are left from earlier batches, their logits are not used
+            offset = 0
+
+            for w, _ in items:
+                batch[offset : offset + len(w)] = w
+                offset += len(w)
+
+            try:
+                logits = self.analyzer.predict(batch)
+            except Exception as ex:
+                for _, f in items:
+                    f.set_exception(ex)
+
+                continue
+
+            # Split the results back per request
+            offset = 0
+
+            for w, f in items:
+                f.set_result(logits[offset : offset + len(w)])
+                offset += len(w)
+
+        self.analyzer.release()
+
+
+def getRequestSettings(mdata: dict):
+    """Translates the metadata of a request into Analyzer settings.
+
+    Args:
+        mdata: The metadata of the request.
+
+    Returns:
+        The keyword arguments of Analyzer.withSettings.
+    """
+    if "lat" in mdata and "lon" in mdata:
+        lat, lon = float(mdata["lat"]), float(mdata["lon"])
+    else:
+        lat, lon = -1, -1
+
+    return {
+        "lat": lat,
+        "lon": lon,
+        "week": int(mdata.get("week", -1)),
+        "overlap": float(mdata.get("overlap", 0.0)),
+        "sensitivity": float(mdata.get("sensitivity", 1.0)),
+        "sf_thresh": float(mdata.get("sf_thresh", 0.03)),
+    }
+
+
+def resultPooling(detections: np.ndarray, labels: list[str], num_results=5, pmode="avg"):
+    """Pools the detections into list of (species, score).
 
     Args:
-        lines: List of result scores.
+        detections: The detections, see analyzer.Analyzer.analyzeArray.
+        labels: The (translated) labels.
         num_results: The number of entries to be returned.
         pmode: Decides how the score for each species is computed.
                If "max" used the maximum score for the species,
@@ -30,30 +291,279 @@ def resultPooling(lines: list[str], num_results=5, pmode="avg"):
     Returns:
         A List of (species, score).
     """
-    # Parse results
-    results = {}
+    # Compute score for each species
+    if pmode == "max":
+        pooled = np.zeros(len(labels))
+        np.maximum.at(pooled, detections["label"], detections["score"])
+    else:
+        counts = np.bincount(detections["label"], minlength=len(labels))
+        pooled = np.bincount(detections["label"], weights=detections["score"], minlength=len(labels)) / np.maximum(counts, 1)
 
-    for line in lines:
-        d = line.split("\t")
-        species = d[2].replace(", ", "_")
-        score = float(d[-1])
+    # Sort results, ties keep the order in which the species were detected first
+    found, first = np.unique(detections["label"], return_index=True)
+    found = found[np.argsort(first)]
+    found = found[np.argsort(-pooled[found], kind="stable")][:num_results]
 
-        if not species in results:
-            results[species] = []
+    return [(labels[c], float(pooled[c])) for c in found]
 
-        results[species].append(score)
 
-    # Compute score for each species
-    for species in results:
-        if pmode == "max":
-            results[species] = max(results[species])
-        else:
-            results[species] = sum(results[species]) / len(results[species])
+def getRankings(analyzer, detections: np.ndarray):
+    """Pools the detections with both pooling modes.
+
+    Args:
+        analyzer: The Analyzer of the request.
+        detections: The detections.
+
+    Returns:
+        A dict with the List of (species, score) of "avg" and "max", up to 99 entries each.
+    """
+    return {pmode: resultPooling(detections, analyzer.translated_labels, 99, pmode) for pmode in ["avg", "max"]}
+
+
+def selectResults(rankings: dict, mdata: dict):
+    """Picks the results that a request asked for.
+
+    Args:
+        rankings: The pooled results, see getRankings.
+        mdata: The metadata of the request.
+
+    Returns:
+        A List of (species, score).
+    """
+    pmode = mdata.get("pmode", "avg").lower()
+
+    if pmode not in ["avg", "max"]:
+        pmode = "avg"
+
+    num_results = min(99, max(1, int(mdata.get("num_results", 5))))
+
+    return rankings[pmode][:num_results]
+
+
+def getCacheParams(analyzer):
+    """Returns the settings of an Analyzer that change the results of a request.
+
+    Args:
+        analyzer: The Analyzer of the request.
+
+    Returns:
+        A dict for resultcache.makeKey.
+    """
+    return {k: analyzer.config[k] for k in CACHE_KEYS}
+
+
+def saveUpload(upload):
+    """Stores an upload in the storage path.
+
+    Args:
+        upload: The uploaded file of the request.
+
+    Returns:
+        The file path.
+    """
+    name, ext = os.path.splitext(upload.filename.lower())
+    save_path = os.path.join(cfg.FILE_STORAGE_PATH, str(date.today()))
+
+    os.makedirs(save_path, exist_ok=True)
+
+    file_path = os.path.join(save_path, name + ext)
+    upload.save(file_path, overwrite=True)
+
+    return file_path
+
+
+def spoolUpload(upload, ext: str):
+    """Copies an upload into a temporary file, so a queued job doesn't hold it in memory.
+
+    Args:
+        upload: The uploaded file of the request.
+        ext: The file extension, keeps the format recognizable for the decoder.
+
+    Returns:
+        The path of the temporary file, the caller removes it.
+    """
+    upload.file.seek(0)
+
+    with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as f:
+        shutil.copyfileobj(upload.file, f)
 
-    # Sort results
-    results = sorted(results.items(), key=lambda x: x[1], reverse=True)
+    return f.name
 
-    return results[:num_results]
+
+def analyzeSource(analyzer, source, progress=None):
+    """Analyzes a file on the server or an upload in memory.
+
+    Args:
+        analyzer: The Analyzer of the request.
+        source: A file path, which is decoded in blocks,
+                or the file-like object and the extension of an upload, which is decoded in memory.
+        progress: See analyzer.Analyzer.analyzeArray.
+
+    Returns:
+        The detections.
+    """
+    predict = BATCHER.predict if BATCHER else None
+
+    if isinstance(source, str):
+        return analyzer.analyzeFile(source, predict, progress)
+
+    return analyzer.analyzeArray(*audio.readAudioBuffer(*source), predict, progress)
+
+
+def getLocalPath(path: str):
+    """Resolves a file path of a job on the storage of the server.
+
+    Args:
+        path: Path relative to the job root, see --job_root.
+
+    Returns:
+        The absolute path or None if the path is not an audio file below the job root.
+    """
+    if JOB_ROOT is None:
+        return None
+
+    root = os.path.realpath(JOB_ROOT)
+    file_path = os.path.realpath(os.path.join(root, path))
+
+    if not file_path.startswith(root + os.sep) or not os.path.isfile(file_path):
+        return None
+
+    if os.path.splitext(file_path)[1][1:].lower() not in cfg.ALLOWED_FILETYPES:
+        return None
+
+    return file_path
+
+
+class JobQueue:
+    """Runs analyses in the background.
+
+    At most max_jobs jobs can be queued or running, further jobs are rejected.
+    The last MAX_FINISHED_JOBS finished jobs are kept for their results.
+    """
+
+    def __init__(self, pool: concurrent.futures.Executor, max_jobs: int):
+        """Creates an empty queue.
+
+        Args:
+            pool: The executor that runs the jobs.
+            max_jobs: Maximum number of queued and running jobs.
+        """
+        self.pool = pool
+        self.max_jobs = max(1, int(max_jobs))
+        self._jobs = {}
+        self._finished = collections.deque()
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def submit(self, analyzer, source, mdata: dict, save_path=None, spooled=False):
+        """Adds a job.
+
+        Args:
+            analyzer: The Analyzer with the settings of the job.
+            source: The file, see analyzeSource.
+            mdata: The metadata of the job.
+            save_path: Path of the stored upload, the results are stored next to it.
+            spooled: Whether the source is a temporary file that is removed after the job, see spoolUpload.
+
+        Returns:
+            The job id or None if the queue is full.
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "progress": 0.0,
+            "submitted": datetime.now().isoformat(timespec="seconds"),
+            "started": None,
+            "finished": None,
+            "error": None,
+        }
+
+        with self._lock:
+            if self._active >= self.max_jobs:
+                if spooled:
+                    os.remove(source)
+
+                return None
+
+            self._active += 1
+            self._jobs[job_id] = {"status": job, "results": None}
+
+        self.pool.submit(self._run, self._jobs[job_id], analyzer, source, mdata, save_path, spooled)
+
+        return job_id
+
+    def getStatus(self, job_id: str):
+        """Returns a copy of the status of a job or None if it is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+
+            return dict(job["status"]) if job else None
+
+    def getResults(self, job_id: str):
+        """Returns the results of a finished job or None if there are none (yet)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+
+            return job["results"] if job else None
+
+    def _run(self, job: dict, analyzer, source, mdata: dict, save_path, spooled):
+        """Analyzes the file of a job.
+
+        Args:
+            job: The status and results of the job.
+            analyzer: The Analyzer with the settings of the job.
+            source: The file, see analyzeSource.
+            mdata: The metadata of the job.
+            save_path: Path of the stored upload or None.
+            spooled: Whether the source is removed after the job.
+        """
+        status = job["status"]
+
+        def progress(done, total):
+            status["progress"] = round(done / total, 4)
+
+        status["status"] = "running"
+        status["started"] = datetime.now().isoformat(timespec="seconds")
+
+        try:
+            detections = analyzeSource(analyzer, source, progress)
+            results = {
+                "msg": "success",
+                "results": selectResults(getRankings(analyzer, detections), mdata),
+                "detections": analyzer.describe(detections),
+            }
+
+            # Save results as metadata file
+            if save_path:
+                with open(save_path.rsplit(".", 1)[0] + ".json", "w") as f:
+                    json.dump({**results, "meta": mdata}, f, indent=2)
+
+            job["results"] = results
+            status["progress"] = 1.0
+            status["status"] = "done"
+
+        except Exception as ex:
+            # Write error log
+            print(f"Error: Cannot analyze job {status['id']}.", flush=True)
+            utils.writeErrorLog(ex)
+
+            status["status"] = "failed"
+            status["error"] = str(ex)
+
+        finally:
+            status["finished"] = datetime.now().isoformat(timespec="seconds")
+
+            if spooled:
+                os.remove(source)
+
+            with self._lock:
+                self._active -= 1
+                self._finished.append(status["id"])
+
+                # Forget the oldest finished jobs
+                while len(self._finished) > MAX_FINISHED_JOBS:
+                    self._jobs.pop(self._finished.popleft(), None)
 
 
 @bottle.route("/healthcheck", method="GET")
@@ -65,6 +575,19 @@ def healthcheck():
     return json.dumps({"msg": "Server is healthy."})
 
 
+@bottle.route("/cache", method="GET")
+def cacheStats():
+    """Returns the statistics of the result cache.
+
+    Returns:
+        A json message with the hits, misses and evictions.
+    """
+    if RESULTS is None:
+        return json.dumps({"msg": "Result cache is disabled."})
+
+    return json.dumps({"msg": "success", "cache": RESULTS.getStats()})
+
+
 @bottle.route("/analyze", method="POST")
 def handleRequest():
     """Handles a classification request.
@@ -88,108 +611,194 @@ def handleRequest():
 
     print(mdata)
 
-    # Get filename
-    name, ext = os.path.splitext(upload.filename.lower())
-    file_path = upload.filename
-    file_path_tmp = None
+    ext = os.path.splitext(upload.filename)[1].lower()
 
-    # Save file
+    if ext[1:] not in cfg.ALLOWED_FILETYPES:
+        return json.dumps({"msg": "Filetype not supported."})
+
+    # Save file, only if requested
+    save_path = None
+
+    if mdata.get("save", False):
+        try:
+            save_path = saveUpload(upload)
+
+        except Exception as ex:
+            # Write error log
+            print(f"Error: Cannot save file {upload.filename}.", flush=True)
+            utils.writeErrorLog(ex)
+
+            # Return error
+            return json.dumps({"msg": "Error while saving file."})
+
+    # Analyze file
     try:
-        if ext[1:].lower() in cfg.ALLOWED_FILETYPES:
-            if mdata.get("save", False):
-                save_path = os.path.join(cfg.FILE_STORAGE_PATH, str(date.today()))
+        # Settings of this request only
+        analyzer = ANALYZER.withSettings(**getRequestSettings(mdata))
 
-                os.makedirs(save_path, exist_ok=True)
+        # Look for the results of the same file and settings
+        key = resultcache.makeKey(upload.file, getCacheParams(analyzer)) if RESULTS else None
+        rankings = RESULTS.get(key) if RESULTS else None
 
-                file_path = os.path.join(save_path, name + ext)
-            else:
-                save_path = ""
-                file_path_tmp = tempfile.NamedTemporaryFile(suffix=ext.lower(), delete=False)
-                file_path_tmp.close()
-                file_path = file_path_tmp.name
+        if rankings is None:
+            # Wait for a worker, it decodes the upload from memory
+            detections = POOL.submit(analyzeSource, analyzer, (upload.file, ext)).result()
+            rankings = getRankings(analyzer, detections)
 
-            upload.save(file_path, overwrite=True)
-        else:
-            return json.dumps({"msg": "Filetype not supported."})
+            if RESULTS:
+                RESULTS.put(key, rankings)
 
-    except Exception as ex:
-        if file_path_tmp:
-            os.unlink(file_path_tmp.name)
+        # Prepare response
+        data = {"msg": "success", "results": selectResults(rankings, mdata), "meta": mdata}
 
+        # Save response as metadata file
+        if save_path:
+            with open(save_path.rsplit(".", 1)[0] + ".json", "w") as f:
+                json.dump(data, f, indent=2)
+
+        # Return response
+        del data["meta"]
+
+        return json.dumps(data)
+
+    except Exception as e:
         # Write error log
-        print(f"Error: Cannot save file {file_path}.", flush=True)
-        utils.writeErrorLog(ex)
+        print(f"Error: Cannot analyze file {upload.filename}.", flush=True)
+        utils.writeErrorLog(e)
+
+        data = {"msg": f"Error during analysis: {e}"}
+
+        return json.dumps(data)
 
-        # Return error
-        return json.dumps({"msg": "Error while saving file."})
 
-    # Analyze file
+@bottle.route("/jobs", method="POST")
+def submitJob():
+    """Queues an analysis job.
+
+    Takes the same POST request as /analyze. Instead of the audio file,
+    the metadata can contain the "path" of a file below the job root of the server.
+
+    Returns:
+        A json response with the job id. The status is 503 if the queue is full.
+    """
+    upload = bottle.request.files.get("audio")
+    mdata = json.loads(bottle.request.forms.get("meta", "{}"))
+    save_path = None
+    spooled = False
+
     try:
-        # Set config based on mdata
-        if "lat" in mdata and "lon" in mdata:
-            cfg.LATITUDE = float(mdata["lat"])
-            cfg.LONGITUDE = float(mdata["lon"])
-        else:
-            cfg.LATITUDE = -1
-            cfg.LONGITUDE = -1
-
-        cfg.WEEK = int(mdata.get("week", -1))
-        cfg.SIG_OVERLAP = max(0.0, min(2.9, float(mdata.get("overlap", 0.0))))
-        cfg.SIGMOID_SENSITIVITY = max(0.5, min(1.0 - (float(mdata.get("sensitivity", 1.0)) - 1.0), 1.5))
-        cfg.LOCATION_FILTER_THRESHOLD = max(0.01, min(0.99, float(mdata.get("sf_thresh", 0.03))))
-
-        # Set species list
-        if not cfg.LATITUDE == -1 and not cfg.LONGITUDE == -1:
-            cfg.SPECIES_LIST_FILE = None
-            cfg.SPECIES_LIST = species.getSpeciesList(cfg.LATITUDE, cfg.LONGITUDE, cfg.WEEK, cfg.LOCATION_FILTER_THRESHOLD)
-        else:
-            cfg.SPECIES_LIST_FILE = None
-            cfg.SPECIES_LIST = []
+        # Settings of this job only
+        analyzer = ANALYZER.withSettings(**getRequestSettings(mdata))
 
-        # Analyze file
-        success = analyze.analyzeFile((file_path, cfg.getConfig()))
+    except ValueError as ex:
+        bottle.response.status = 400
 
-        # Parse results
-        if success:
-            # Open result file
-            lines = utils.readLines(cfg.OUTPUT_PATH)
-            pmode = mdata.get("pmode", "avg").lower()
+        return json.dumps({"msg": f"Invalid metadata: {ex}"})
 
-            # Pool results
-            if pmode not in ["avg", "max"]:
-                pmode = "avg"
+    if upload:
+        ext = os.path.splitext(upload.filename)[1].lower()
 
-            num_results = min(99, max(1, int(mdata.get("num_results", 5))))
+        if ext[1:] not in cfg.ALLOWED_FILETYPES:
+            bottle.response.status = 400
 
-            results = resultPooling(lines, num_results, pmode)
+            return json.dumps({"msg": "Filetype not supported."})
 
-            # Prepare response
-            data = {"msg": "success", "results": results, "meta": mdata}
+        if mdata.get("save", False):
+            try:
+                save_path = saveUpload(upload)
 
-            # Save response as metadata file
-            if mdata.get("save", False):
-                with open(file_path.rsplit(".", 1)[0] + ".json", "w") as f:
-                    json.dump(data, f, indent=2)
+            except Exception as ex:
+                # Write error log
+                print(f"Error: Cannot save file {upload.filename}.", flush=True)
+                utils.writeErrorLog(ex)
 
-            # Return response
-            del data["meta"]
+                bottle.response.status = 500
 
-            return json.dumps(data)
+                return json.dumps({"msg": "Error while saving file."})
 
+        # The request body is gone when the job runs, the file is decoded in blocks
+        if save_path:
+            source = save_path
         else:
-            return json.dumps({"msg": "Error during analysis."})
+            try:
+                source = spoolUpload(upload, ext)
+                spooled = True
 
-    except Exception as e:
-        # Write error log
-        print(f"Error: Cannot analyze file {file_path}.", flush=True)
-        utils.writeErrorLog(e)
+            except Exception as ex:
+                # Write error log
+                print(f"Error: Cannot store file {upload.filename}.", flush=True)
+                utils.writeErrorLog(ex)
 
-        data = {"msg": f"Error during analysis: {e}"}
+                bottle.response.status = 500
 
-        return json.dumps(data)
-    finally:
-        if file_path_tmp:
-            os.unlink(file_path_tmp.name)
+                return json.dumps({"msg": "Error while storing file."})
+
+    elif mdata.get("path"):
+        source = getLocalPath(mdata["path"])
+
+        if source is None:
+            bottle.response.status = 400
+
+            return json.dumps({"msg": "Invalid path."})
+    else:
+        bottle.response.status = 400
+
+        return json.dumps({"msg": "No audio file."})
+
+    job_id = JOBS.submit(analyzer, source, mdata, save_path, spooled)
+
+    if job_id is None:
+        bottle.response.status = 503
+
+        return json.dumps({"msg": "Too many jobs, try again later."})
+
+    print(f"Job {job_id}: {mdata}", flush=True)
+
+    bottle.response.status = 202
+
+    return json.dumps({"msg": "success", "id": job_id})
+
+
+@bottle.route("/jobs/<job_id>", method="GET")
+def getJob(job_id):
+    """Returns the status and progress of a job.
+
+    Returns:
+        A json response with the status.
+    """
+    status = JOBS.getStatus(job_id)
+
+    if status is None:
+        bottle.response.status = 404
+
+        return json.dumps({"msg": "Unknown job."})
+
+    return json.dumps({"msg": "success", "job": status})
+
+
+@bottle.route("/jobs/<job_id>/results", method="GET")
+def getJobResults(job_id):
+    """Returns the pooled results and all detections of a finished job.
+
+    Returns:
+        A json response with the results.
+    """
+    status = JOBS.getStatus(job_id)
+
+    if status is None:
+        bottle.response.status = 404
+
+        return json.dumps({"msg": "Unknown job."})
+
+    if status["status"] == "failed":
+        return json.dumps({"msg": f"Error during analysis: {status['error']}"})
+
+    if status["status"] != "done":
+        bottle.response.status = 409
+
+        return json.dumps({"msg": "Job not finished.", "job": status})
+
+    return json.dumps(JOBS.getResults(job_id))
 
 
 if __name__ == "__main__":
@@ -206,6 +815,43 @@ if __name__ == "__main__":
         "--spath", default="uploads/", help="Path to folder where uploaded files should be stored. Defaults to '/uploads'."
     )
     parser.add_argument("--threads", type=int, default=4, help="Number of CPU threads for analysis. Defaults to 4.")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of requests that are analyzed at the same time. Defaults to 1."
+    )
+    parser.add_argument(
+        "--batchsize", type=int, default=1, help="Number of windows predicted at once. Defaults to 1."
+    )
+    parser.add_argument(
+        "--batch_delay",
+        type=float,
+        default=None,
+        help="Combine the windows of concurrent requests into batches of up to --batchsize windows, waiting at most this many milliseconds for more. "
+        "Needs --batchsize greater than 1. Defaults to no combining.",
+    )
+    parser.add_argument(
+        "--batch_workers", type=int, default=1, help="Number of threads that predict the combined batches. Defaults to 1."
+    )
+    parser.add_argument(
+        "--job_workers", type=int, default=1, help="Number of jobs of /jobs that are analyzed at the same time. Defaults to 1."
+    )
+    parser.add_argument(
+        "--job_queue", type=int, default=16, help="Maximum number of queued and running jobs, further jobs are rejected. Defaults to 16."
+    )
+    parser.add_argument(
+        "--job_root", default=None, help="Folder whose files jobs may analyze by path instead of uploading them. Defaults to uploads only."
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=1000,
+        help="Number of results of /analyze that are cached in memory, by file content and settings. 0 disables the cache. Defaults to 1000.",
+    )
+    parser.add_argument(
+        "--cache_file", default=None, help="SQLite file that keeps the cached results across restarts. Defaults to memory only."
+    )
+    parser.add_argument(
+        "--cache_ttl", type=float, default=168, help="Hours after which cached results expire. Defaults to 168 (one week)."
+    )
     parser.add_argument(
         "--locale",
         default="en",
@@ -214,42 +860,55 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    # Load eBird codes, labels
-    cfg.CODES = analyze.loadCodes()
-    cfg.LABELS = utils.readLines(cfg.LABELS_FILE)
-
-    # Load translated labels
-    lfile = os.path.join(
-        cfg.TRANSLATED_LABELS_PATH, os.path.basename(cfg.LABELS_FILE).replace(".txt", "_{}.txt".format(args.locale))
-    )
-
-    if not args.locale in ["en"] and os.path.isfile(lfile):
-        cfg.TRANSLATED_LABELS = utils.readLines(lfile)
-    else:
-        cfg.TRANSLATED_LABELS = cfg.LABELS
+    # Batches of single windows cannot be combined
+    if args.batch_delay is not None and args.batchsize < 2:
+        parser.error("--batch_delay needs --batchsize greater than 1.")
 
     # Set storage file path
     cfg.FILE_STORAGE_PATH = args.spath
 
-    # Set min_conf to 0.0, because we want all results
-    cfg.MIN_CONFIDENCE = 0.0
+    # Load the model once, min_conf is 0.0, because we want all results
+    ANALYZER = Analyzer(min_conf=0.0, locale=args.locale, threads=args.threads, batch_size=args.batchsize)
 
-    output_file = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
-    output_file.close()
+    # Start the workers, with combined batches they only read the files
+    if args.batch_delay is not None:
+        BATCHER = MicroBatcher(ANALYZER, args.batchsize, args.batch_delay / 1000, max(1, int(args.batch_workers)))
+        POOL = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(args.workers)), thread_name_prefix="analysis")
+    else:
+        POOL = startPool(ANALYZER, max(1, int(args.workers)))
 
-    # Set path for temporary result file
-    cfg.OUTPUT_PATH = output_file.name
+    # Result cache
+    if args.cache_size > 0 or args.cache_file:
+        RESULTS = resultcache.ResultCache(args.cache_size, args.cache_file, args.cache_ttl * 3600)
 
-    # Set result type
-    cfg.RESULT_TYPE = "audacity"
+    # Start the job queue
+    JOB_ROOT = args.job_root
 
-    # Set number of TFLite threads
-    cfg.TFLITE_THREADS = max(1, int(args.threads))
+    if BATCHER:
+        JOBS = JobQueue(concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(args.job_workers)), thread_name_prefix="jobs"), args.job_queue)
+    else:
+        JOBS = JobQueue(startPool(ANALYZER, max(1, int(args.job_workers))), args.job_queue)
 
     # Run server
     print(f"UP AND RUNNING! LISTENING ON {args.host}:{args.port}", flush=True)
 
     try:
-        bottle.run(host=args.host, port=args.port, quiet=True)
+        bottle.run(host=args.host, port=args.port, quiet=True, server_class=ThreadingWSGIServer)
     finally:
-        os.unlink(output_file.name)
+        POOL.shutdown()
+        JOBS.pool.shutdown(cancel_futures=True)
+
+        if RESULTS:
+            print(f"Result cache: {RESULTS.getStats()}", flush=True)
+
+        if BATCHER:
+            BATCHER.close()
+            print(f"Predicted {BATCHER.windows} windows in {BATCHER.batches} batches.", flush=True)
+
+    # A few examples to test
+    # python3 server.py
+    # python3 server.py --port 8081 --workers 4 --threads 1
+    # python3 server.py --port 8081 --workers 16 --threads 4 --batchsize 32 --batch_delay 10
+    # python3 server.py --port 8081 --job_workers 2 --job_queue 32 --job_root /mnt/recordings
+    # python3 server.py --port 8081 --cache_size 5000 --cache_file cache/results.sqlite --cache_ttl 24
+    # python3 benchmark.py --mode server --port 8081 --concurrency 1,4,16
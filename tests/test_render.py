@@ -0,0 +1,96 @@
+"""Checks that rendered score files use the location of their recording."""
+import numpy as np
+import pytest
+
+try:
+    import analyze
+    import config as cfg
+    import render
+    import scores
+    import species
+except ImportError:
+    pytest.skip("needs tflite_runtime or tensorflow", allow_module_level=True)
+
+
+LABELS = [f"S{i}_C{i}" for i in range(6)]
+
+
+def fakeSpeciesList(lat, lon, week, threshold):
+    """The first three species live in week 20, the others in any other week."""
+    return LABELS[:3] if week == 20 else LABELS[3:]
+
+
+@pytest.fixture
+def score_file(tmp_path, monkeypatch):
+    for key, value in {
+        "LABELS": LABELS,
+        "TRANSLATED_LABELS": LABELS,
+        "LABELS_FILE": "labels.txt",
+        "CODES": {},
+        "RESULT_TYPE": "csv",
+        "MIN_CONFIDENCE": 0.5,
+        "LATITUDE": -1,
+        "LONGITUDE": -1,
+        "WEEK": -1,
+        "FILE_METADATA": {},
+        "INPUT_PATH": str(tmp_path),
+        "OUTPUT_PATH": str(tmp_path / "out"),
+    }.items():
+        monkeypatch.setattr(cfg, key, value)
+
+    monkeypatch.setattr(species, "getSpeciesList", fakeSpeciesList)
+    analyze._locationMask.cache_clear()
+
+    # Every species scores high in every window
+    path = str(tmp_path / "rec.BirdNET.scores.npy")
+    f = scores.openScoreFile(path, len(LABELS))
+    scores.writeScores(f, 0, np.full((4, len(LABELS)), 10, dtype="float32"))
+    f.close()
+    scores.finishScoreFile(path, 4, len(LABELS), str(tmp_path / "rec.wav"), 48000, 12.0, (42.5, -76.45, 20))
+
+    yield path
+
+    analyze._locationMask.cache_clear()
+
+
+def renderedSpecies(result_file):
+    with open(result_file) as f:
+        return sorted({line.split(",")[2] for line in f.readlines()[1:]})
+
+
+def test_render_uses_location_of_recording(score_file):
+    result_file = render.renderFile(score_file)[0]
+
+    assert renderedSpecies(result_file) == ["S0", "S1", "S2"]
+
+
+def test_render_settings_with_location_win(score_file, monkeypatch):
+    monkeypatch.setattr(cfg, "LATITUDE", 10.0)
+    monkeypatch.setattr(cfg, "LONGITUDE", 10.0)
+
+    result_file = render.renderFile(score_file, np.isin(np.array(LABELS), LABELS[4:]))[0]
+
+    assert renderedSpecies(result_file) == ["S4", "S5"]
+
+
+def test_sweep_uses_location_of_recording(score_file, tmp_path):
+    configs = [
+        {
+            "name": name,
+            "MIN_CONFIDENCE": 0.5,
+            "SIGMOID_SENSITIVITY": 1.0,
+            "LATITUDE": lat,
+            "LONGITUDE": lat,
+            "WEEK": 1,
+            "LOCATION_FILTER_THRESHOLD": 0.03,
+            "SPECIES_LIST_FILE": None,
+            "SPECIES_LIST": slist,
+        }
+        for name, lat, slist in [("file", -1, []), ("own", 10.0, LABELS[3:])]
+    ]
+    masks = [None, np.isin(np.array(LABELS), LABELS[3:])]
+
+    entries = render.renderSweep(score_file, configs, masks, str(tmp_path / "sweep"))
+
+    assert renderedSpecies(entries[0][0]) == ["S0", "S1", "S2"]
+    assert renderedSpecies(entries[1][0]) == ["S3", "S4", "S5"]
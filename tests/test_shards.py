@@ -0,0 +1,69 @@
+"""Checks that sharded files give the same results as serial runs."""
+import numpy as np
+import pytest
+
+try:
+    import analyze
+    import config as cfg
+    import model
+except ImportError:
+    pytest.skip("needs tflite_runtime or tensorflow", allow_module_level=True)
+
+
+def fakePredict(samples):
+    """Logits that depend on the exact samples of every window."""
+    s = np.asarray(samples)
+
+    return (np.abs(s[:, ::9000][:, :5]) * np.arange(1, 6)[None, :] * 20 - 5).astype("float32")
+
+
+@pytest.fixture
+def recording(tmp_path):
+    sf = pytest.importorskip("soundfile")
+    path = tmp_path / "long.wav"
+    rng = np.random.default_rng(0)
+    sf.write(path, (rng.standard_normal((44100 * 100 + 777, 2)) * 0.1).astype("float32"), 44100)
+
+    return str(path)
+
+
+@pytest.mark.parametrize("overlap", [0.7, 2.1, 2.7])
+def test_shards_match_serial(recording, tmp_path, monkeypatch, overlap):
+    labels = [f"S{i}_C{i}" for i in range(5)]
+
+    for key, value in {
+        "LABELS": labels,
+        "TRANSLATED_LABELS": labels,
+        "CODES": {},
+        "SPECIES_LIST": [],
+        "RESULT_TYPE": "csv",
+        "MIN_CONFIDENCE": 0.1,
+        "BATCH_SIZE": 4,
+        "FILE_SPLITTING_DURATION": 13,
+        "SIG_OVERLAP": overlap,
+        "SAVE_SCORES": False,
+        "INPUT_PATH": str(tmp_path),
+    }.items():
+        monkeypatch.setattr(cfg, key, value)
+
+    monkeypatch.setattr(model, "predict", fakePredict)
+
+    # Serial
+    monkeypatch.setattr(cfg, "OUTPUT_PATH", str(tmp_path / "serial.csv"))
+    analyze.analyzeFiles([recording])
+
+    # Sharded, collected in reverse order
+    monkeypatch.setattr(cfg, "SHARD_DURATION", 17)
+    monkeypatch.setattr(cfg, "OUTPUT_PATH", str(tmp_path / "sharded.csv"))
+    shards = analyze.planShards(recording)
+    collected = {}
+
+    assert len(shards) > 2
+
+    for shard in shards[::-1]:
+        analyze.collectShard(*analyze.analyzeShard(shard), {recording: len(shards)}, collected)
+
+    serial = (tmp_path / "serial.csv").read_text()
+
+    assert len(serial.splitlines()) > 50
+    assert (tmp_path / "sharded.csv").read_text() == serial
@@ -47,7 +47,7 @@ def _loadAudioFile(f, label_vector, config):
     if cfg.SAMPLE_CROP_MODE == "center":
         sig_splits = [audio.cropCenter(sig, rate, cfg.SIG_LENGTH)]
     elif cfg.SAMPLE_CROP_MODE == "first":
-        sig_splits = [audio.splitSignal(sig, rate, cfg.SIG_LENGTH, cfg.SIG_OVERLAP, cfg.SIG_MINLEN)[0]]
+        sig_splits = audio.splitSignal(sig, rate, cfg.SIG_LENGTH, cfg.SIG_OVERLAP, cfg.SIG_MINLEN)[:1]
     else:
         sig_splits = audio.splitSignal(sig, rate, cfg.SIG_LENGTH, cfg.SIG_OVERLAP, cfg.SIG_MINLEN)
 
@@ -0,0 +1,154 @@
+"""Module to manage the pool of worker processes.
+
+The pool restores the config and loads the model once per worker,
+so the tasks only have to carry the file paths.
+"""
+import atexit
+import multiprocessing
+
+import numpy as np
+
+import config as cfg
+import utils
+
+_POOL = None
+_POOL_KEY = None
+
+# Tasks per process when the group size is picked from the number of files.
+# More tasks balance the load between the processes, larger groups share more batches.
+TASKS_PER_PROCESS = 4
+
+# Largest group size that is picked automatically, the results of a group
+# are reported back, and recorded in the manifest, when all of its files are done
+MAX_GROUP_SIZE = 16
+
+
+def initWorker(config: dict, warmup: str | None = None):
+    """Initializes a worker process.
+
+    Restores the config and loads the model by running a first inference,
+    so the interpreter is ready when the first task arrives.
+
+    Args:
+        config: The config of the parent process.
+        warmup: Either "predict", "embeddings" or None to skip loading the model.
+    """
+    cfg.setConfig(config)
+
+    if not warmup:
+        return
+
+    import model
+
+    try:
+        sample = np.zeros((cfg.BATCH_SIZE, int(cfg.SIG_LENGTH * cfg.SAMPLE_RATE)), dtype="float32")
+
+        if warmup == "embeddings":
+            model.embeddings(sample)
+        else:
+            model.predict(sample)
+
+    except Exception as ex:
+        # The first task will try again and report the error for its file
+        print("Error: Cannot load model in worker.", flush=True)
+        utils.writeErrorLog(ex)
+
+
+def getPool(processes: int, config: dict, warmup: str | None = None):
+    """Returns the worker pool.
+
+    The pool is kept alive and reused as long as the number of processes,
+    the warmup and the config do not change.
+
+    Args:
+        processes: The number of worker processes.
+        config: The config for the workers, see config.getConfig().
+        warmup: Either "predict", "embeddings" or None, see initWorker.
+
+    Returns:
+        A multiprocessing pool.
+    """
+    global _POOL
+    global _POOL_KEY
+
+    # Workers get their files with the tasks
+    config = dict(config, FILE_LIST=[])
+    key = (processes, warmup, config)
+
+    if _POOL is not None and _POOL_KEY == key:
+        return _POOL
+
+    shutdown()
+
+    _POOL = multiprocessing.Pool(processes, initializer=initWorker, initargs=(config, warmup))
+    _POOL_KEY = key
+
+    return _POOL
+
+
+def imapUnordered(func, items, processes: int, config: dict, warmup: str | None = None, chunksize: int = 1):
+    """Maps a function over the items with the worker pool.
+
+    Args:
+        func: The function to be called with each item. Must be picklable.
+        items: The items, usually file paths.
+        processes: The number of worker processes.
+        config: The config for the workers, see config.getConfig().
+        warmup: Either "predict", "embeddings" or None, see initWorker.
+        chunksize: The number of items sent to a worker at once.
+
+    Returns:
+        An iterator over the results in the order of completion.
+    """
+    pool = getPool(processes, config, warmup)
+
+    return pool.imap_unordered(func, items, chunksize=max(1, int(chunksize)))
+
+
+def getGroupSize(num_files: int, processes: int, group_size: int = 0):
+    """Returns the number of files per worker task.
+
+    Args:
+        num_files: The number of files.
+        processes: The number of worker processes.
+        group_size: The configured size, 0 to pick it from the number of files and processes.
+
+    Returns:
+        The group size.
+    """
+    if group_size > 0:
+        return int(group_size)
+
+    return max(1, min(MAX_GROUP_SIZE, -(-num_files // (max(1, processes) * TASKS_PER_PROCESS))))
+
+
+def groupFiles(files: list, group_size: int, processes: int = 1):
+    """Splits the file list into groups for the workers.
+
+    Args:
+        files: The list of files.
+        group_size: The number of files per group, see getGroupSize.
+        processes: The number of worker processes.
+
+    Returns:
+        A list of lists of files.
+    """
+    group_size = getGroupSize(len(files), processes, group_size)
+
+    return [files[i : i + group_size] for i in range(0, len(files), group_size)]
+
+
+def shutdown():
+    """Closes the worker pool and waits for the workers to exit."""
+    global _POOL
+    global _POOL_KEY
+
+    if _POOL is not None:
+        _POOL.close()
+        _POOL.join()
+
+    _POOL = None
+    _POOL_KEY = None
+
+
+atexit.register(shutdown)